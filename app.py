@@ -6,6 +6,8 @@ import threading
 import asyncio
 import traceback # Ajouté pour un meilleur logging d'erreur
 import base64
+import hmac
+import hashlib
 
 # Imports pour l'e-mail
 import smtplib, ssl
@@ -21,7 +23,8 @@ import shopify
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 import json
-from shared_utils import Logger, DB_FILE, anonymize_email, get_db_connection
+from shared_utils import Logger, DB_FILE, USER_STATS_QUERY, anonymize_email, get_db_connection, db_write, db_write_many, product_key, rollup_start_day
+from db_migrations import run_migrations
 # [CORRECTION] Import des variables depuis config.py et catalogue_final pour le bot
 
 
@@ -38,6 +41,8 @@ SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION')
 SENDER_EMAIL = os.getenv('SENDER_EMAIL')
 INFOMANIAK_APP_PASSWORD = os.getenv('INFOMANIAK_APP_PASSWORD')
 SHOPIFY_ADMIN_ACCESS_TOKEN = os.getenv('SHOPIFY_ADMIN_ACCESS_TOKEN')
+SHOPIFY_WEBHOOK_SECRET = os.getenv('SHOPIFY_WEBHOOK_SECRET')
+CATALOG_WEBHOOK_TOPICS = {'products/update', 'products/delete', 'inventory_levels/update'}
 
 # On utilise le même chemin que le bot pour avoir une seule DB
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -50,35 +55,9 @@ WELCOME_CODES_FILE = os.path.join(BASE_DIR, "welcome_codes.txt")
 # Dans app.py
 
 def initialize_db():
-    """Initialise les tables pour la liaison de comptes, les rappels et la liste noire dans la DB partagée."""
+    """Applique les migrations de la DB partagée (liaison de comptes, rappels, liste noire, notes, webhooks)."""
     print(f"INFO: Initialisation des tables dans la base de données: {DB_FILE}")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Tables existantes
-    cursor.execute("CREATE TABLE IF NOT EXISTS user_links (discord_id TEXT PRIMARY KEY, user_email TEXT NOT NULL UNIQUE);")
-    cursor.execute("CREATE TABLE IF NOT EXISTS verification_codes (discord_id TEXT PRIMARY KEY, user_email TEXT NOT NULL, code TEXT NOT NULL, expires_at INTEGER NOT NULL);")
-    
-    # Table pour suivre les rappels envoyés
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS reminders (
-            discord_id TEXT NOT NULL,
-            order_id INTEGER NOT NULL,
-            notified_at TEXT NOT NULL,
-            PRIMARY KEY (discord_id, order_id)
-        );
-    """)
-    
-    # --- NOUVELLE TABLE POUR LA LISTE NOIRE ---
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS reminder_blacklist (
-            discord_id TEXT PRIMARY KEY,
-            blacklisted_at TEXT NOT NULL
-        );
-    """)
-    
-    conn.commit()
-    conn.close()
+    run_migrations(DB_FILE)
 
 initialize_db()
 
@@ -110,7 +89,9 @@ def start_verification():
 
     # ... (Le reste de la fonction pour envoyer l'email est inchangé)
     cursor.execute("SELECT discord_id FROM user_links WHERE user_email = ?", (email,))
-    if cursor.fetchone(): conn.close(); return jsonify({"error": "Cet e-mail est déjà utilisé par un autre compte."}), 409
+    email_taken = cursor.fetchone() is not None
+    conn.close()
+    if email_taken: return jsonify({"error": "Cet e-mail est déjà utilisé par un autre compte."}), 409
     
     code = str(random.randint(100000, 999999))
     expires_at = int(time.time()) + 600
@@ -135,10 +116,39 @@ def start_verification():
         print(f"ERREUR SMTP CRITIQUE: {e}"); traceback.print_exc()
         return jsonify({"error": "Impossible d'envoyer l'e-mail de vérification."}), 500
 
-    cursor.execute("INSERT OR REPLACE INTO verification_codes VALUES (?, ?, ?, ?)", (discord_id, email, code, expires_at))
-    conn.commit(); conn.close()
+    db_write("INSERT OR REPLACE INTO verification_codes VALUES (?, ?, ?, ?)", (discord_id, email, code, expires_at))
     return jsonify({"success": True}), 200
 
+def _verify_shopify_hmac(raw_body: bytes, received_hmac: str) -> bool:
+    """Vérifie la signature X-Shopify-Hmac-Sha256 (HMAC-SHA256 du corps brut, en base64)."""
+    if not SHOPIFY_WEBHOOK_SECRET or not received_hmac:
+        return False
+    digest = hmac.new(SHOPIFY_WEBHOOK_SECRET.encode('utf-8'), raw_body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), received_hmac)
+
+@app.route('/api/shopify/webhook', methods=['POST'])
+def shopify_catalog_webhook():
+    """Reçoit les webhooks catalogue de Shopify et les met en file pour le bot (table catalog_events)."""
+    raw_body = request.get_data()
+    if not _verify_shopify_hmac(raw_body, request.headers.get('X-Shopify-Hmac-Sha256', '')):
+        Logger.warning("API: Webhook Shopify rejeté (signature HMAC invalide).")
+        return jsonify({"error": "Signature invalide."}), 401
+
+    topic = request.headers.get('X-Shopify-Topic', '')
+    if topic not in CATALOG_WEBHOOK_TOPICS:
+        # On acquitte quand même pour que Shopify ne réessaie pas indéfiniment.
+        return jsonify({"success": True, "ignored": topic}), 200
+
+    try:
+        # Shopify peut livrer deux fois le même webhook : son ID sert de clé de déduplication.
+        db_write("INSERT OR IGNORE INTO catalog_events (webhook_id, topic, payload, received_at) VALUES (?, ?, ?, ?)",
+                 (request.headers.get('X-Shopify-Webhook-Id'), topic, raw_body.decode('utf-8'), datetime.utcnow().isoformat()))
+        Logger.info(f"API: Webhook Shopify '{topic}' mis en file pour le bot.")
+        return jsonify({"success": True}), 200
+    except Exception as e:
+        Logger.error(f"API DB Error dans shopify_catalog_webhook: {e}")
+        return jsonify({"error": "Erreur interne."}), 500
+
 @app.route('/api/blacklist_user_for_reminders', methods=['POST'])
 def blacklist_user_for_reminders():
     """Ajoute un utilisateur à la liste noire pour les rappels."""
@@ -148,20 +158,15 @@ def blacklist_user_for_reminders():
     if not discord_id:
         return jsonify({"error": "L'ID Discord est manquant."}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
         # On insère ou on remplace s'il existe déjà (ce qui ne devrait pas arriver avec un custom_id unique)
-        cursor.execute("INSERT OR REPLACE INTO reminder_blacklist (discord_id, blacklisted_at) VALUES (?, ?)",
-                       (discord_id, datetime.utcnow().isoformat()))
-        conn.commit()
+        db_write("INSERT OR REPLACE INTO reminder_blacklist (discord_id, blacklisted_at) VALUES (?, ?)",
+                 (discord_id, datetime.utcnow().isoformat()))
         Logger.success(f"API: L'utilisateur {discord_id} a été ajouté à la liste noire des rappels.")
         return jsonify({"success": True}), 200
     except Exception as e:
         Logger.error(f"API DB Error dans blacklist_user_for_reminders: {e}")
         return jsonify({"error": "Erreur interne lors de l'ajout à la liste noire."}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/is_user_blacklisted', methods=['POST'])
 def is_user_blacklisted():
@@ -239,21 +244,17 @@ def add_comment():
         return jsonify({"error": "Données manquantes pour ajouter le commentaire."}), 400
 
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("""
+        # Écriture groupée avec les autres notes/commentaires en attente (un seul commit par lot)
+        updated = db_write("""
             UPDATE ratings 
             SET comment = ? 
             WHERE user_id = ? AND product_name = ?
         """, (comment_text, user_id, product_name))
-        conn.commit()
         
         # On vérifie si une ligne a bien été modifiée
-        if conn.total_changes == 0:
-            conn.close()
+        if updated == 0:
             return jsonify({"error": "Aucune note correspondante à mettre à jour."}), 404
             
-        conn.close()
         print(f"INFO: Commentaire ajouté pour {user_id} sur le produit {product_name}")
         return jsonify({"success": True}), 200
     except Exception as e:
@@ -276,15 +277,15 @@ def confirm_verification():
         conn.close()
         return jsonify({"error": "Code invalide ou expiré."}), 400
     
+    conn.close()
     user_email, expires_at = result
     if time.time() > expires_at:
-        conn.close()
         return jsonify({"error": "Le code de vérification a expiré."}), 400
         
-    cursor.execute("INSERT OR REPLACE INTO user_links (discord_id, user_email) VALUES (?, ?)", (discord_id, user_email))
-    cursor.execute("DELETE FROM verification_codes WHERE discord_id = ?", (discord_id,))
-    conn.commit()
-    conn.close()
+    db_write_many([
+        ("INSERT OR REPLACE INTO user_links (discord_id, user_email) VALUES (?, ?)", (discord_id, user_email)),
+        ("DELETE FROM verification_codes WHERE discord_id = ?", (discord_id,)),
+    ])
 
     # --- Logique d'envoi de code de bienvenue ---
     try:
@@ -351,14 +352,12 @@ def unlink_account():
     cursor = conn.cursor()
     cursor.execute("SELECT user_email FROM user_links WHERE discord_id = ?", (discord_id,))
     result = cursor.fetchone()
+    conn.close()
 
     if not result:
-        conn.close()
         return jsonify({"error": "Aucun compte n'est lié à cet ID Discord."}), 404
 
-    cursor.execute("DELETE FROM user_links WHERE discord_id = ?", (discord_id,))
-    conn.commit()
-    conn.close()
+    db_write("DELETE FROM user_links WHERE discord_id = ?", (discord_id,))
     return jsonify({"success": True, "unlinked_email": result[0]}), 200
 
 @app.route('/api/force-link', methods=['POST'])
@@ -383,11 +382,12 @@ def force_link():
             anonymized_email = anonymize_email(result[0])
             conn.close()
             return jsonify({"status": "conflict", "existing_email": anonymized_email}), 409
-
-    cursor.execute("INSERT OR REPLACE INTO user_links (discord_id, user_email) VALUES (?, ?)", (discord_id, email))
-    cursor.execute("DELETE FROM verification_codes WHERE discord_id = ?", (discord_id,))
-    conn.commit()
     conn.close()
+
+    db_write_many([
+        ("INSERT OR REPLACE INTO user_links (discord_id, user_email) VALUES (?, ?)", (discord_id, email)),
+        ("DELETE FROM verification_codes WHERE discord_id = ?", (discord_id,)),
+    ])
     return jsonify({"success": True, "message": f"Compte {discord_id} forcé à être lié à {email}."}), 200
 
 @app.route('/api/get_purchased_products/<discord_id>')
@@ -450,20 +450,23 @@ def submit_rating():
     comment_text = data.get('comment')  # .get() pour gérer le cas où le commentaire est optionnel
 
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("""
-            INSERT OR REPLACE INTO ratings 
-            (user_id, user_name, product_name, visual_score, smell_score, touch_score, taste_score, effects_score, rating_timestamp, comment) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        # Upsert plutôt qu'INSERT OR REPLACE : le remplacement ne déclencherait pas le trigger DELETE de product_stats.
+        # L'écriture passe par la file d'écritures du processus, validée par lots dans une seule transaction.
+        db_write("""
+            INSERT INTO ratings 
+            (user_id, user_name, product_name, product_key, visual_score, smell_score, touch_score, taste_score, effects_score, rating_timestamp, comment) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, product_name) DO UPDATE SET
+                user_name = excluded.user_name, product_key = excluded.product_key,
+                visual_score = excluded.visual_score, smell_score = excluded.smell_score, touch_score = excluded.touch_score,
+                taste_score = excluded.taste_score, effects_score = excluded.effects_score,
+                rating_timestamp = excluded.rating_timestamp, comment = excluded.comment
         """, (
-            user_id, user_name, product_name, 
+            user_id, user_name, product_name, product_key(product_name), 
             scores.get('visual'), scores.get('smell'), scores.get('touch'), 
             scores.get('taste'), scores.get('effects'), 
             datetime.utcnow().isoformat(), comment_text
         ))
-        conn.commit()
-        conn.close()
         print(f"INFO: Note enregistrée pour {user_name} sur le produit {product_name}")
         return jsonify({"success": True}), 200
     except Exception as e:
@@ -484,26 +487,8 @@ def get_user_stats(discord_id):
         c.execute("SELECT * FROM ratings WHERE user_id = ? ORDER BY rating_timestamp DESC", (user_id_int,))
         user_ratings = [dict(row) for row in c.fetchall()]
 
-        # Calculer les statistiques
-        c.execute("""
-            WITH UserAverageNotes AS (
-                SELECT user_id, 
-                       (COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0 AS avg_note
-                FROM ratings
-            ), AllRanks AS (
-                SELECT user_id, 
-                       COUNT(user_id) as rating_count, 
-                       AVG(avg_note) as global_avg, 
-                       MIN(avg_note) as min_note, 
-                       MAX(avg_note) as max_note,
-                       RANK() OVER (ORDER BY COUNT(user_id) DESC, AVG(avg_note) DESC) as user_rank
-                FROM UserAverageNotes 
-                GROUP BY user_id
-            )
-            SELECT user_rank, rating_count, global_avg, min_note, max_note
-            FROM AllRanks 
-            WHERE user_id = ?
-        """, (user_id_int,))
+        # Statistiques et rang, lus dans user_stats (tenue à jour par triggers)
+        c.execute(USER_STATS_QUERY, (user_id_int,))
         stats_row = c.fetchone()
         
         user_stats = {'rank': 'N/C', 'count': 0, 'avg': 0, 'min_note': 0, 'max_note': 0}
@@ -511,8 +496,7 @@ def get_user_stats(discord_id):
             user_stats.update(dict(zip(stats_row.keys(), stats_row)))
 
         # Badge Top 3 du mois
-        one_month_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
-        c.execute("SELECT user_id FROM ratings WHERE rating_timestamp >= ? GROUP BY user_id ORDER BY COUNT(id) DESC LIMIT 3", (one_month_ago,))
+        c.execute("SELECT user_id FROM user_daily_stats WHERE day >= ? GROUP BY user_id ORDER BY SUM(rating_count) DESC LIMIT 3", (rollup_start_day(30),))
         top_3_monthly_ids = [row['user_id'] for row in c.fetchall()]
         user_stats['is_top_3_monthly'] = user_id_int in top_3_monthly_ids
 
@@ -708,12 +692,9 @@ def mark_reminder_sent():
     if not discord_id or not order_id:
         return jsonify({"error": "Données manquantes."}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO reminders (discord_id, order_id, notified_at) VALUES (?, ?, ?)",
-                       (discord_id, order_id, datetime.utcnow().isoformat()))
-        conn.commit()
+        db_write("INSERT INTO reminders (discord_id, order_id, notified_at) VALUES (?, ?, ?)",
+                 (discord_id, order_id, datetime.utcnow().isoformat()))
         Logger.info(f"API: Rappel marqué comme envoyé pour l'utilisateur {discord_id}, commande {order_id}.")
         return jsonify({"success": True}), 200
     except sqlite3.IntegrityError:
@@ -722,8 +703,6 @@ def mark_reminder_sent():
     except Exception as e:
         Logger.error(f"Erreur DB dans mark_reminder_sent: {e}")
         return jsonify({"error": "Erreur interne du serveur."}), 500
-    finally:
-        conn.close()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
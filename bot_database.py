@@ -0,0 +1,263 @@
+# bot_database.py
+# Accès asynchrone à la base partagée pour le bot : une seule connexion aiosqlite longue durée,
+# une méthode typée par requête. Les handlers font `await bot_db.xxx()` au lieu d'un `_..._sync` + to_thread.
+
+import asyncio
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+from shared_utils import Logger, DB_FILE, USER_STATS_QUERY, product_key
+
+# Moyenne des 5 critères d'une note, les critères absents comptant pour 0.
+AVG_NOTE_SQL = "(COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0"
+
+
+class BotDatabase:
+    """
+    Dépôt asynchrone des notes, comptes liés, statistiques et événements catalogue.
+    Les lectures par produit passent par product_stats, tenue à jour par triggers (voir db_migrations).
+    La connexion est ouverte au premier appel (PRAGMAs appliqués une fois) et fermée par `close()`.
+    Les rappels restent gérés par l'API Flask, seule à écrire dans leurs tables.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self) -> aiosqlite.Connection:
+        if self._conn is not None:
+            return self._conn
+        async with self._connect_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path, timeout=10, cached_statements=256)
+                conn.row_factory = aiosqlite.Row
+                await conn.execute("PRAGMA journal_mode=WAL;")
+                await conn.execute("PRAGMA mmap_size=67108864;")
+                await conn.execute("PRAGMA temp_store=MEMORY;")
+                self._conn = conn
+                Logger.info(f"Connexion aiosqlite ouverte sur '{self.path}'.")
+        return self._conn
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        conn = await self.connect()
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _fetchone(self, sql: str, params: tuple = ()):
+        conn = await self.connect()
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    async def _fetchvalue(self, sql: str, params: tuple = (), default=0):
+        row = await self._fetchone(sql, params)
+        return row[0] if row else default
+
+    async def _write(self, sql: str, params: tuple = ()) -> int:
+        conn = await self.connect()
+        cursor = await conn.execute(sql, params)
+        await conn.commit()
+        return cursor.rowcount
+
+    # --- Notes ---
+
+    async def get_user_rating(self, user_id: int, product_name: str) -> Optional[dict]:
+        row = await self._fetchone("SELECT * FROM ratings WHERE user_id = ? AND product_name = ?", (user_id, product_name))
+        return dict(row) if row else None
+
+    async def _ratings_page(self, select: str, where: str, params: tuple,
+                            before: Optional[tuple], after: Optional[tuple], limit: int) -> List[dict]:
+        """
+        Page de notes triée par (rating_timestamp, id) décroissants, lue par curseur sur ces deux colonnes :
+        `before` donne les notes plus anciennes que la clé, `after` les plus récentes (rendues dans le même ordre).
+        """
+        if after:
+            rows = await self._fetchall(f"""
+                SELECT {select} WHERE {where} AND (r.rating_timestamp, r.id) > (?, ?)
+                ORDER BY r.rating_timestamp ASC, r.id ASC LIMIT ?
+            """, (*params, *after, limit))
+            rows = rows[::-1]
+        else:
+            cursor = " AND (r.rating_timestamp, r.id) < (?, ?)" if before else ""
+            rows = await self._fetchall(f"""
+                SELECT {select} WHERE {where}{cursor}
+                ORDER BY r.rating_timestamp DESC, r.id DESC LIMIT ?
+            """, (*params, *(before or ()), limit))
+        return [dict(row) for row in rows]
+
+    async def get_user_ratings_page(self, user_id: int, before: Optional[tuple] = None,
+                                    after: Optional[tuple] = None, limit: int = 10) -> List[dict]:
+        """Notes d'un membre, les plus récentes d'abord, avec la moyenne de la communauté sur chaque produit ('community_avg')."""
+        return await self._ratings_page(
+            "r.*, ps.note_sum / ps.rating_count AS community_avg FROM ratings r LEFT JOIN product_stats ps ON ps.product_key = r.product_key",
+            "r.user_id = ?", (user_id,), before, after, limit)
+
+    async def get_rated_product_names(self, user_id: int) -> List[str]:
+        rows = await self._fetchall("SELECT product_name FROM ratings WHERE user_id = ?", (user_id,))
+        return [row[0] for row in rows]
+
+    async def delete_user_ratings(self, user_id: int) -> int:
+        return await self._write("DELETE FROM ratings WHERE user_id = ?", (user_id,))
+
+    async def get_product_reviews_page(self, product_name: str, before: Optional[tuple] = None,
+                                       after: Optional[tuple] = None, limit: int = 10) -> List[dict]:
+        """Notes accompagnées d'un commentaire, les plus récentes d'abord (index ratings(product_key, rating_timestamp))."""
+        return await self._ratings_page(
+            "r.* FROM ratings r", "r.product_key = ? AND r.comment IS NOT NULL AND TRIM(r.comment) != ''",
+            (product_key(product_name),), before, after, limit)
+
+    async def get_product_review_counts(self, product_name: str) -> dict:
+        """Nombre total de notes et nombre de commentaires d'un produit."""
+        row = await self._fetchone("SELECT rating_count, comment_count FROM product_stats WHERE product_key = ?", (product_key(product_name),))
+        return {"total": row[0] if row else 0, "comments": row[1] if row else 0}
+
+    async def get_rating_counts_by_product(self) -> Dict[str, int]:
+        """Nombre de notes par nom de produit normalisé."""
+        rows = await self._fetchall("SELECT product_key, rating_count FROM product_stats")
+        return {row[0]: row[1] for row in rows}
+
+    async def get_product_rankings(self) -> list:
+        """(nom, moyenne, nombre de notes) de tous les produits notés, du mieux au moins bien noté."""
+        return await self._fetchall("""
+            SELECT product_name, note_sum / rating_count AS avg_score, rating_count
+            FROM product_stats WHERE rating_count > 0
+            ORDER BY avg_score DESC
+        """)
+
+    async def get_top_products(self, limit: int = 3) -> list:
+        """(nom, moyenne, nombre de notes) des produits les mieux notés, toutes périodes confondues."""
+        return await self._fetchall("""
+            SELECT product_name, note_sum / rating_count AS avg_score, rating_count AS num_ratings
+            FROM product_stats WHERE rating_count > 0
+            ORDER BY avg_score DESC LIMIT ?
+        """, (limit,))
+
+    async def get_top_products_since(self, since_day: str, limit: int = 3) -> list:
+        """(nom, moyenne, nombre de notes) des produits les mieux notés depuis le jour `since_day` inclus (voir rollup_start_day)."""
+        return await self._fetchall("""
+            SELECT ps.product_name, SUM(d.note_sum) / SUM(d.rating_count) AS avg_score, SUM(d.rating_count)
+            FROM product_daily_stats d JOIN product_stats ps ON ps.product_key = d.product_key
+            WHERE d.day >= ? GROUP BY d.product_key
+            ORDER BY avg_score DESC LIMIT ?
+        """, (since_day, limit))
+
+    async def get_comparison_data(self, product_names: List[str]) -> Dict[str, dict]:
+        """Moyennes détaillées par critère, indexées par nom normalisé, pour /comparer."""
+        data_map = {}
+        for name in product_names:
+            key = product_key(name)
+            result = await self._fetchone("SELECT * FROM product_stats WHERE product_key = ?", (key,))
+            if result and result['rating_count'] > 0:
+                axis = lambda a: result[f'{a}_sum'] / result[f'{a}_n'] if result[f'{a}_n'] else 0
+                data_map[key] = {
+                    "name": result['product_name'],
+                    "count": result['rating_count'],
+                    "avg_total": result['note_sum'] / result['rating_count'],
+                    "details": {'Visuel': axis('visual'), 'Odeur': axis('smell'), 'Toucher': axis('touch'), 'Goût': axis('taste'), 'Effets': axis('effects')}
+                }
+        return data_map
+
+    # --- Statistiques des membres ---
+
+    async def count_raters(self) -> int:
+        """Nombre de membres ayant au moins une note (somme de l'histogramme, une ligne par nombre de notes)."""
+        return await self._fetchvalue("SELECT COALESCE(SUM(users), 0) FROM user_rating_histogram")
+
+    async def get_top_raters_page(self, after: Optional[tuple] = None, limit: int = 5) -> List[dict]:
+        """
+        Une page du classement des noteurs (nombre de notes puis moyenne, décroissants), par pagination keyset :
+        `after` est la clé (rating_count, avg_note, user_id) du dernier membre de la page précédente, None pour la première.
+        Chaque ligne porte sa clé dans 'cursor', le dernier pseudo connu et le produit préféré du membre.
+        """
+        where = "WHERE (s.rating_count, s.avg_note, s.user_id) < (?, ?, ?)" if after else ""
+        rows = await self._fetchall(f"""
+            SELECT s.user_id, COALESCE(d.user_name, s.user_name) AS last_user_name,
+                   s.rating_count, s.avg_note AS global_avg
+            FROM user_stats s LEFT JOIN user_directory d ON d.user_id = s.user_id
+            {where}
+            ORDER BY s.rating_count DESC, s.avg_note DESC, s.user_id DESC
+            LIMIT ?
+        """, (*(after or ()), limit))
+        raters = [dict(row) for row in rows]
+        if not raters:
+            return raters
+
+        # Produit préféré des seuls membres de la page (index ratings(user_id, rating_timestamp)).
+        user_ids = [r['user_id'] for r in raters]
+        placeholders = ",".join("?" * len(user_ids))
+        best = await self._fetchall(f"""
+            SELECT user_id, product_name FROM (
+                SELECT user_id, product_name,
+                       ROW_NUMBER() OVER(PARTITION BY user_id ORDER BY {AVG_NOTE_SQL} DESC, rating_timestamp DESC) AS rn
+                FROM ratings WHERE user_id IN ({placeholders})
+            ) WHERE rn = 1
+        """, tuple(user_ids))
+        best_by_user = {row[0]: row[1] for row in best}
+        for rater in raters:
+            rater['best_rated_product'] = best_by_user.get(rater['user_id'], 'N/A')
+            rater['cursor'] = (rater['rating_count'], rater['global_avg'], rater['user_id'])
+        return raters
+
+    async def get_user_stats(self, user_id: int) -> Optional[dict]:
+        """Rang, nombre de notes, moyenne, note min et max d'un membre (None s'il n'a rien noté)."""
+        row = await self._fetchone(USER_STATS_QUERY, (user_id,))
+        return dict(row) if row else None
+
+    async def get_rating_counts_by_user(self) -> list:
+        """(user_id, nombre de notes) de chaque membre ayant noté."""
+        return await self._fetchall("SELECT user_id, rating_count FROM user_stats")
+
+    async def get_top_raters_since(self, since_day: str, limit: int = 3) -> list:
+        """(user_id, nombre de notes) des membres les plus actifs depuis le jour `since_day` inclus."""
+        return await self._fetchall("""
+            SELECT user_id, SUM(rating_count) as weekly_rating_count FROM user_daily_stats
+            WHERE day >= ? GROUP BY user_id ORDER BY weekly_rating_count DESC LIMIT ?
+        """, (since_day, limit))
+
+    async def get_dashboard_stats(self, since_day: str) -> dict:
+        total_ratings = await self._fetchvalue("SELECT COALESCE(SUM(rating_count), 0) FROM user_stats")
+        total_linked = await self.count_linked_accounts()
+        total_raters = await self._fetchvalue("SELECT COUNT(*) FROM user_stats")
+        weekly_ratings = await self._fetchvalue("SELECT COALESCE(SUM(rating_count), 0) FROM user_daily_stats WHERE day >= ?", (since_day,))
+        top_rater = await self._fetchone(
+            "SELECT user_id, SUM(rating_count) as count FROM user_daily_stats WHERE day >= ? GROUP BY user_id ORDER BY count DESC LIMIT 1", (since_day,))
+        # Nom courant du produit pris dans product_stats, comme partout ailleurs
+        product_window = ("SELECT ps.product_name, SUM(d.note_sum) / SUM(d.rating_count) as avg_score "
+                          "FROM product_daily_stats d JOIN product_stats ps ON ps.product_key = d.product_key "
+                          "WHERE d.day >= ? GROUP BY d.product_key ORDER BY avg_score")
+        top_product = await self._fetchone(f"{product_window} DESC LIMIT 1", (since_day,))
+        worst_product = await self._fetchone(f"{product_window} ASC LIMIT 1", (since_day,))
+        return {
+            "total_ratings": total_ratings, "total_linked": total_linked,
+            "total_raters": total_raters, "weekly_ratings": weekly_ratings,
+            "top_rater": top_rater, "top_product": top_product,
+            "worst_product": worst_product
+        }
+
+    # --- Comptes liés ---
+
+    async def get_linked_email(self, user_id: int) -> Optional[str]:
+        row = await self._fetchone("SELECT user_email FROM user_links WHERE discord_id = ?", (str(user_id),))
+        return row['user_email'] if row else None
+
+    async def count_linked_accounts(self) -> int:
+        return await self._fetchvalue("SELECT COUNT(discord_id) FROM user_links")
+
+    async def count_ratings(self) -> int:
+        return await self._fetchvalue("SELECT COUNT(*) FROM ratings")
+
+    # --- Événements catalogue (webhooks Shopify) ---
+
+    async def read_catalog_events(self, limit: int = 200) -> list:
+        return await self._fetchall("SELECT id, topic, payload FROM catalog_events ORDER BY id LIMIT ?", (limit,))
+
+    async def delete_catalog_events(self, max_id: int):
+        await self._write("DELETE FROM catalog_events WHERE id <= ?", (max_id,))
+
+
+bot_db = BotDatabase(DB_FILE)
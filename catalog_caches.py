@@ -0,0 +1,143 @@
+# catalog_caches.py
+# Caches persistants utilisés par la synchronisation du catalogue.
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from bs4 import BeautifulSoup
+
+from shared_utils import Logger, DESCRIPTION_CACHE_FILE, FILE_URL_CACHE_FILE
+
+# lxml est nettement plus rapide que html.parser ; on garde html.parser si lxml n'est pas installé.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+def html_to_text(html: str) -> str:
+    return BeautifulSoup(html or '', HTML_PARSER).get_text(separator='\n', strip=True)
+
+
+def _atomic_write_json(path: str, data) -> bool:
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        Logger.error(f"Impossible de sauvegarder le cache '{path}': {e}")
+        return False
+
+
+class DescriptionTextCache:
+    """
+    Mémo persistant bodyHtml -> texte, indexé par le SHA-1 du parseur et du HTML : une description
+    inchangée n'est jamais re-parsée d'une synchro à l'autre, ni après un redémarrage. Changer de
+    parseur (lxml installé ou retiré) change toutes les clés ; les anciennes sont purgées par prune_unseen.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Optional[dict] = None
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._dirty = False
+
+    def load(self):
+        if self.entries is not None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get_text(self, html: str) -> str:
+        self.load()
+        key = hashlib.sha1(f"{HTML_PARSER}\0{html or ''}".encode('utf-8')).hexdigest()
+        self._seen.add(key)
+        text = self.entries.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = html_to_text(html)
+        self.entries[key] = text
+        self._dirty = True
+        return text
+
+    def prune_unseen(self):
+        """Après une synchro complète, oublie les descriptions qui ne correspondent plus à aucun produit."""
+        if self.entries is None:
+            return
+        stale = set(self.entries) - self._seen
+        for key in stale:
+            del self.entries[key]
+        self._dirty = self._dirty or bool(stale)
+        self._seen.clear()
+
+    def save(self):
+        if self._dirty and _atomic_write_json(self.path, self.entries):
+            self._dirty = False
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries or {}), "parser": HTML_PARSER}
+
+
+class FileUrlCache:
+    """
+    Correspondance persistante GID de fichier Shopify -> URL (PDF d'analyses, terpènes),
+    avec une date d'expiration par entrée : seuls les GIDs inconnus ou expirés sont redemandés.
+    Les GIDs que Shopify ne résout pas (fichier supprimé, sans URL) sont mémorisés avec une URL
+    None et un TTL court, pour ne pas être redemandés à chaque synchro delta.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Optional[dict] = None
+        self._dirty = False
+
+    def load(self):
+        if self.entries is not None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def lookup(self, gids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Renvoie les entrées encore valides pour `gids` (None = GID connu comme introuvable) ; les absents sont à résoudre."""
+        self.load()
+        now = time.time()
+        found = {}
+        for gid in gids:
+            entry = self.entries.get(gid)
+            if entry and entry.get('expires_at', 0) > now:
+                found[gid] = entry['url']
+        return found
+
+    def store(self, gid: str, url: Optional[str], ttl_seconds: float):
+        self.load()
+        self.entries[gid] = {"url": url, "expires_at": time.time() + ttl_seconds}
+        self._dirty = True
+
+    def save(self):
+        if self.entries is None:
+            return
+        # On en profite pour purger les entrées expirées.
+        now = time.time()
+        expired = [gid for gid, entry in self.entries.items() if entry.get('expires_at', 0) <= now]
+        for gid in expired:
+            del self.entries[gid]
+        if (self._dirty or expired) and _atomic_write_json(self.path, self.entries):
+            self._dirty = False
+
+
+description_cache = DescriptionTextCache(DESCRIPTION_CACHE_FILE)
+file_url_cache = FileUrlCache(FILE_URL_CACHE_FILE)
@@ -0,0 +1,131 @@
+# catalog_diff.py
+# Empreintes par produit et différences structurées entre deux états du catalogue.
+
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+
+def fingerprint_product(product: dict) -> str:
+    """Empreinte stable d'un produit du cache (hors `updated_at`, qui bouge sans changer le menu)."""
+    data = {k: v for k, v in product.items() if k != 'updated_at'}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def compute_fingerprints(products: List[dict], previous_products: Optional[List[dict]] = None,
+                         previous_fingerprints: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Table id -> empreinte. Un produit qui est le même objet que dans le catalogue précédent
+    (synchro delta, webhook) reprend son ancienne empreinte : seuls les produits relus sont re-sérialisés.
+    """
+    previous_fingerprints = previous_fingerprints or {}
+    previous_by_id = {p.get('id'): p for p in previous_products or []}
+    fingerprints = {}
+    for product in products:
+        product_id = product.get('id')
+        if previous_by_id.get(product_id) is product and product_id in previous_fingerprints:
+            fingerprints[product_id] = previous_fingerprints[product_id]
+        else:
+            fingerprints[product_id] = fingerprint_product(product)
+    return fingerprints
+
+
+def menu_hash(fingerprints: Dict[str, str], general_promos: List[str]) -> str:
+    """Hash global du menu, dérivé des empreintes (sans re-sérialiser les produits)."""
+    data = {'products': sorted(fingerprints.items()), 'general_promos': sorted(general_promos or [])}
+    return hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+class CatalogDiff:
+    """Ce qui a changé entre deux catalogues : ajouts, retraits, prix, stock, promos."""
+    def __init__(self):
+        self.added: List[dict] = []
+        self.removed: List[dict] = []
+        self.price_changed: List[dict] = []
+        self.restocked: List[dict] = []
+        self.sold_out: List[dict] = []
+        self.promo_started: List[dict] = []
+        self.promo_ended: List[dict] = []
+        self.other_changed: List[dict] = []
+        self.promos_changed = False
+
+    @property
+    def stock_changed(self) -> List[dict]:
+        return self.restocked + self.sold_out
+
+    @property
+    def has_changes(self) -> bool:
+        return self.promos_changed or any([self.added, self.removed, self.price_changed, self.restocked,
+                                           self.sold_out, self.promo_started, self.promo_ended, self.other_changed])
+
+    @property
+    def is_notable(self) -> bool:
+        """Changements qui valent une mention du rôle : nouveautés, retours en stock, nouvelles promos, prix."""
+        return self.promos_changed or any([self.added, self.restocked, self.promo_started, self.price_changed])
+
+    def summary(self) -> str:
+        parts = []
+        if self.added: parts.append(f"🆕 {len(self.added)} nouveauté(s)")
+        if self.restocked: parts.append(f"📦 {len(self.restocked)} retour(s) en stock")
+        if self.promo_started: parts.append(f"🏷️ {len(self.promo_started)} nouvelle(s) promo(s)")
+        if self.price_changed: parts.append(f"💶 {len(self.price_changed)} prix modifié(s)")
+        if self.sold_out: parts.append(f"❌ {len(self.sold_out)} épuisé(s)")
+        if self.removed: parts.append(f"🗑️ {len(self.removed)} retiré(s)")
+        return " · ".join(parts)
+
+    def merged(self, other: 'CatalogDiff') -> 'CatalogDiff':
+        """Cumul de deux diffs successifs (changements webhook pas encore annoncés + synchro suivante)."""
+        combined = CatalogDiff()
+        for field in ('added', 'removed', 'price_changed', 'restocked', 'sold_out', 'promo_started', 'promo_ended', 'other_changed'):
+            setattr(combined, field, getattr(self, field) + getattr(other, field))
+        combined.promos_changed = self.promos_changed or other.promos_changed
+        return combined
+
+    def to_dict(self) -> dict:
+        """Version sérialisable (noms de produits) pour les logs et les autres fonctionnalités."""
+        return {
+            'added': [p.get('name') for p in self.added],
+            'removed': [p.get('name') for p in self.removed],
+            'price_changed': [p.get('name') for p in self.price_changed],
+            'restocked': [p.get('name') for p in self.restocked],
+            'sold_out': [p.get('name') for p in self.sold_out],
+            'promo_started': [p.get('name') for p in self.promo_started],
+            'promo_ended': [p.get('name') for p in self.promo_ended],
+            'other_changed': [p.get('name') for p in self.other_changed],
+            'promos_changed': self.promos_changed,
+        }
+
+
+def diff_catalogs(previous_data: Optional[dict], current_data: dict) -> CatalogDiff:
+    """Compare deux caches produits via leurs tables d'empreintes ; seuls les produits dont l'empreinte diffère sont examinés."""
+    diff = CatalogDiff()
+    previous_data = previous_data or {}
+    previous_fingerprints = previous_data.get('fingerprints') or {}
+    current_fingerprints = current_data.get('fingerprints') or {}
+    previous_by_id = {p.get('id'): p for p in previous_data.get('products', [])}
+
+    for product in current_data.get('products', []):
+        product_id = product.get('id')
+        old = previous_by_id.pop(product_id, None)
+        if old is None:
+            diff.added.append(product)
+            continue
+        if previous_fingerprints.get(product_id) == current_fingerprints.get(product_id):
+            continue
+        categorized = False
+        if old.get('price') != product.get('price'):
+            diff.price_changed.append(product); categorized = True
+        if old.get('is_sold_out') and not product.get('is_sold_out'):
+            diff.restocked.append(product); categorized = True
+        elif not old.get('is_sold_out') and product.get('is_sold_out'):
+            diff.sold_out.append(product); categorized = True
+        if product.get('is_promo') and not old.get('is_promo'):
+            diff.promo_started.append(product); categorized = True
+        elif old.get('is_promo') and not product.get('is_promo'):
+            diff.promo_ended.append(product); categorized = True
+        if not categorized:
+            diff.other_changed.append(product)
+
+    diff.removed = list(previous_by_id.values())
+    diff.promos_changed = sorted(previous_data.get('general_promos', [])) != sorted(current_data.get('general_promos', []))
+    return diff
@@ -0,0 +1,111 @@
+# catalog_snapshot.py
+# Instantané binaire versionné du catalogue : écriture atomique, relecture quasi gratuite.
+
+import os
+import json
+import mmap
+import pickle
+import struct
+import threading
+from typing import Optional
+
+from shared_utils import Logger, CACHE_FILE, CATALOG_SNAPSHOT_FILE
+
+SNAPSHOT_MAGIC = b'LFCATSNP'
+SNAPSHOT_SCHEMA_VERSION = 1
+# En-tête : magie, version du schéma, longueur de la charge utile.
+_HEADER = struct.Struct('<8sHQ')
+
+# Migrations version N -> N+1 des données décodées, appliquées en chaîne au chargement.
+_SCHEMA_UPGRADES = {}
+
+_lock = threading.Lock()
+_loaded = {"key": None, "data": None}
+
+
+def write_catalog_snapshot(site_data: dict, path: str = CATALOG_SNAPSHOT_FILE) -> bool:
+    """
+    Écrit l'instantané dans un fichier temporaire puis le renomme : un lecteur voit
+    soit l'ancien fichier complet, soit le nouveau, jamais un fichier à moitié écrit.
+    """
+    payload = pickle.dumps(site_data, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA_VERSION, len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        Logger.error(f"Impossible d'écrire l'instantané du catalogue '{path}': {e}")
+        return False
+    with _lock:
+        # L'objet qu'on vient d'écrire est déjà décodé : inutile de le relire.
+        _loaded.update(key=_file_key(path), data=site_data)
+    return True
+
+
+def _file_key(path: str):
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _decode(path: str) -> Optional[dict]:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < _HEADER.size:
+            return None
+        magic, version, length = _HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or _HEADER.size + length > len(mm):
+            Logger.warning(f"Instantané du catalogue '{path}' invalide ou tronqué, ignoré.")
+            return None
+        if version > SNAPSHOT_SCHEMA_VERSION:
+            Logger.warning(f"Instantané du catalogue en version {version} (supportée : {SNAPSHOT_SCHEMA_VERSION}), ignoré.")
+            return None
+        # Décodage directement depuis la projection mémoire, sans copie intermédiaire du fichier.
+        with memoryview(mm) as buffer, buffer[_HEADER.size:_HEADER.size + length] as view:
+            data = pickle.loads(view)
+    while version < SNAPSHOT_SCHEMA_VERSION:
+        data = _SCHEMA_UPGRADES[version](data)
+        version += 1
+    return data
+
+
+def _load_legacy_json() -> Optional[dict]:
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def load_catalog_snapshot(path: str = CATALOG_SNAPSHOT_FILE) -> dict:
+    """
+    Renvoie le dernier catalogue écrit (dictionnaire `site_data`), ou {} s'il n'y en a pas.
+    Tant que le fichier n'a pas changé, le même objet déjà décodé est renvoyé : les appelants
+    ne doivent pas le modifier. Sans instantané, l'ancien scrape_cache.json est migré.
+    """
+    with _lock:
+        try:
+            key = _file_key(path)
+        except FileNotFoundError:
+            legacy = _load_legacy_json()
+            if legacy is None:
+                return {}
+            Logger.info("Migration de l'ancien cache JSON vers l'instantané binaire du catalogue.")
+            data = legacy
+        else:
+            if _loaded["key"] == key:
+                return _loaded["data"]
+            try:
+                data = _decode(path)
+            except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+                Logger.warning(f"Lecture de l'instantané du catalogue impossible : {e}")
+                data = None
+            if data is None:
+                return {}
+            _loaded.update(key=key, data=data)
+            return data
+    # Migration hors du verrou : write_catalog_snapshot le reprend.
+    write_catalog_snapshot(data, path)
+    return data
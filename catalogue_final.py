@@ -3,32 +3,37 @@
 # --- Imports ---
 import os
 import json
-import hashlib
 import asyncio
 import traceback
 import time
-from datetime import time as dt_time, datetime, timedelta
+from datetime import time as dt_time, datetime, timezone
 from typing import List, Optional
 import sqlite3
 import re
 import aiohttp
 # Imports des librairies nécessaires
-import shopify
 import discord
 from discord.ext import commands, tasks # <--- CORRECTION : 'commands' et 'tasks' importés ici
 from discord import app_commands
-from bs4 import BeautifulSoup
 
 
 # Imports depuis vos fichiers de projet
-from commands import MenuView, UnsubscribeButton
+from commands import MenuView, UnsubscribeButton, ProductBrowserButton
 from shared_utils import (
     TOKEN, CHANNEL_ID, ROLE_ID_TO_MENTION, CATALOG_URL,
     Logger, executor, paris_tz, initialize_database, config_manager,
-    CACHE_FILE, RANKING_CHANNEL_ID, DB_FILE, THUMBNAIL_LOGO_URL,
-    create_styled_embed, get_product_counts, GUILD_ID, SELECTION_CHANNEL_ID, 
+    RANKING_CHANNEL_ID, DB_FILE, THUMBNAIL_LOGO_URL,
+    create_styled_embed, GUILD_ID, SELECTION_CHANNEL_ID, rollup_start_day,
 )
 from graph_generator import create_radar_chart
+from shopify_client import ShopifyClient, get_shopify_client, close_shopify_client
+from shopify_bulk import iter_bulk_product_pages
+from catalog_caches import description_cache, file_url_cache
+from catalog_diff import CatalogDiff, compute_fingerprints, diff_catalogs, menu_hash
+from catalog_snapshot import write_catalog_snapshot, load_catalog_snapshot
+from product_catalog import ProductCatalog, EMPTY_CATALOG
+from product_search import ProductSearchIndex, EMPTY_SEARCH_INDEX
+from bot_database import bot_db
 
 # --- Initialisation du bot ---
 intents = discord.Intents.default()
@@ -37,6 +42,14 @@ intents.members = True
 intents.presences = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 bot.product_cache = {}
+bot.catalog = EMPTY_CATALOG
+bot.last_catalog_diff = None
+# Changements appliqués par les webhooks sans mention : la synchro périodique suivante les annonce.
+bot.unannounced_diff = None
+bot.product_search = EMPTY_SEARCH_INDEX
+bot.product_rating_counts = {}
+# Sérialise les synchros planifiées et l'application des webhooks sur `bot.product_cache`.
+catalog_sync_lock = asyncio.Lock()
 
 # Configuration des heures pour les tâches programmées
 update_time = dt_time(hour=8, minute=0, tzinfo=paris_tz)
@@ -44,11 +57,19 @@ ranking_time = dt_time(hour=16, minute=0, tzinfo=paris_tz)
 selection_time = dt_time(hour=12, minute=0, tzinfo=paris_tz)
 role_sync_time = dt_time(hour=8, minute=5, tzinfo=paris_tz)
 reengagement_time = dt_time(hour=10, minute=0, tzinfo=paris_tz)
+CATALOG_EVENTS_POLL_SECONDS = 5
 
 
-PRODUCTS_WITH_METAFIELDS_QUERY = """
-query getProductsWithMetafields {
-  products(first: 100, query: "published_status:published") {
+# --- Synchronisation paginée du catalogue ---
+# Shopify refuse toute requête dont le coût estimé dépasse 1000 points : avec
+# les sous-connexions ci-dessous, un produit coûte ~45 points, d'où 20 produits par page.
+CATALOG_PAGE_SIZE = 20
+NESTED_PAGE_SIZE = 50
+
+PRODUCTS_PAGE_QUERY = """
+query getProductsPage($cursor: String, $pageSize: Int!, $search: String!) {
+  products(first: $pageSize, after: $cursor, query: $search) {
+    pageInfo { hasNextPage endCursor }
     edges {
       node {
         id
@@ -56,12 +77,16 @@ query getProductsWithMetafields {
         tags
         handle
         bodyHtml
+        status
+        publishedAt
+        updatedAt
         images(first: 1) {
           edges {
             node { url }
           }
         }
         variants(first: 10) {
+          pageInfo { hasNextPage endCursor }
           edges {
             node {
               price
@@ -72,11 +97,13 @@ query getProductsWithMetafields {
           }
         }
         collections(first: 5) {
+          pageInfo { hasNextPage endCursor }
           edges {
             node { title }
           }
         }
         metafields(first: 20) {
+          pageInfo { hasNextPage endCursor }
           edges {
             node {
               namespace
@@ -90,6 +117,126 @@ query getProductsWithMetafields {
   }
 }
 """
+
+# Requêtes de suite pour les sous-connexions d'un produit qui dépassent la première page.
+PRODUCT_CONNECTION_QUERIES = {
+    'variants': """
+query getProductVariants($id: ID!, $cursor: String, $pageSize: Int!) {
+  node(id: $id) {
+    ... on Product {
+      connection: variants(first: $pageSize, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { node { price compareAtPrice inventoryPolicy inventoryQuantity } }
+      }
+    }
+  }
+}
+""",
+    'collections': """
+query getProductCollections($id: ID!, $cursor: String, $pageSize: Int!) {
+  node(id: $id) {
+    ... on Product {
+      connection: collections(first: $pageSize, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { node { title } }
+      }
+    }
+  }
+}
+""",
+    'metafields': """
+query getProductMetafields($id: ID!, $cursor: String, $pageSize: Int!) {
+  node(id: $id) {
+    ... on Product {
+      connection: metafields(first: $pageSize, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        edges { node { namespace key value } }
+      }
+    }
+  }
+}
+""",
+}
+
+# Produits supprimés depuis le dernier passage (ils n'apparaissent plus dans `products`).
+DELETED_PRODUCTS_QUERY = """
+query getDeletedProducts($cursor: String, $search: String!) {
+  deletionEvents(first: 250, after: $cursor, subjectTypes: [PRODUCT], query: $search) {
+    pageInfo { hasNextPage endCursor }
+    edges {
+      node { subjectId occurredAt }
+    }
+  }
+}
+"""
+
+PUBLISHED_PRODUCTS_SEARCH = "published_status:published"
+
+# Toutes les réductions à code et leur premier code en une seule requête paginée
+# (remplace PriceRule.find() + un DiscountCode.find() par règle).
+DISCOUNTS_PAGE_QUERY = """
+query getCodeDiscounts($cursor: String) {
+  codeDiscountNodes(first: 50, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      codeDiscount {
+        __typename
+        ... on DiscountCodeBasic {
+          title startsAt endsAt usageLimit
+          codes(first: 1) { nodes { code asyncUsageCount } }
+          customerGets {
+            value {
+              ... on DiscountPercentage { percentage }
+              ... on DiscountAmount { amount { amount } }
+            }
+          }
+        }
+        ... on DiscountCodeFreeShipping {
+          title startsAt endsAt usageLimit
+          codes(first: 1) { nodes { code asyncUsageCount } }
+        }
+        ... on DiscountCodeBxgy {
+          title startsAt endsAt usageLimit
+          codes(first: 1) { nodes { code asyncUsageCount } }
+          customerBuys {
+            value {
+              ... on DiscountQuantity { buysQuantity: quantity }
+              ... on DiscountPurchaseAmount { buysAmount: amount }
+            }
+          }
+          customerGets {
+            value {
+              ... on DiscountOnQuantity {
+                getsQuantity: quantity { quantity }
+                effect {
+                  ... on DiscountPercentage { percentage }
+                  ... on DiscountAmount { amount { amount } }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Produit auquel appartient un article de stock (webhook inventory_levels/update).
+INVENTORY_ITEMS_PRODUCTS_QUERY = """
+query getInventoryItemProducts($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on InventoryItem {
+      variant { product { id } }
+    }
+  }
+}
+"""
+
+# `nodes(ids:)` accepte au plus 250 identifiants par requête ; chaque requête a sa propre taille de lot.
+RESOLVE_FILES_BATCH_SIZE = 250
+INVENTORY_ITEMS_BATCH_SIZE = 250
+
 RESOLVE_FILES_QUERY = """
 query getFiles($ids: [ID!]!) {
   nodes(ids: $ids) {
@@ -101,132 +248,249 @@ query getFiles($ids: [ID!]!) {
 }
 """
 
-def get_site_data_from_graphql():
+async def _complete_product_connections(client: ShopifyClient, prod: dict):
+    """Suit `endCursor` des variantes, collections et métachamps d'un produit jusqu'à la dernière page."""
+    for field, query in PRODUCT_CONNECTION_QUERIES.items():
+        connection = prod.get(field) or {}
+        page_info = connection.get('pageInfo') or {}
+        while page_info.get('hasNextPage'):
+            data = await client.execute(query, {"id": prod['id'], "cursor": page_info.get('endCursor'), "pageSize": NESTED_PAGE_SIZE})
+            next_connection = (data.get('node') or {}).get('connection') or {}
+            connection.setdefault('edges', []).extend(next_connection.get('edges', []))
+            page_info = next_connection.get('pageInfo') or {}
+
+async def iter_product_pages(client: ShopifyClient, search: str = PUBLISHED_PRODUCTS_SEARCH):
+    """Générateur asynchrone : renvoie les produits correspondant à `search` page par page, sous-connexions complètes."""
+    cursor = None
+    while True:
+        data = await client.execute(PRODUCTS_PAGE_QUERY, {"cursor": cursor, "pageSize": CATALOG_PAGE_SIZE, "search": search})
+        products = data.get('products') or {}
+        page = [edge['node'] for edge in products.get('edges', [])]
+        for prod in page:
+            await _complete_product_connections(client, prod)
+        yield page
+
+        page_info = products.get('pageInfo') or {}
+        if not page_info.get('hasNextPage'):
+            break
+        cursor = page_info.get('endCursor')
+
+async def _fetch_deleted_product_ids(client: ShopifyClient, since: str) -> set:
+    """Renvoie les GIDs des produits supprimés depuis `since`. Un échec n'est pas bloquant : la réconciliation complète rattrapera."""
+    deleted_ids = set()
+    cursor = None
+    try:
+        while True:
+            data = await client.execute(DELETED_PRODUCTS_QUERY, {"cursor": cursor, "search": f"occurred_at:>='{since}'"})
+            events = data.get('deletionEvents') or {}
+            deleted_ids.update(edge['node']['subjectId'] for edge in events.get('edges', []) if edge.get('node'))
+            page_info = events.get('pageInfo') or {}
+            if not page_info.get('hasNextPage'):
+                break
+            cursor = page_info.get('endCursor')
+    except Exception as e:
+        Logger.warning(f"Impossible de récupérer les suppressions de produits : {e}")
+    return deleted_ids
+
+def _is_product_listed(prod: dict) -> bool:
+    """Un produit reste au menu s'il est actif et publié sur la boutique."""
+    return prod.get('status', 'ACTIVE') == 'ACTIVE' and bool(prod.get('publishedAt'))
+
+def _merge_products(cached_products: list, changed_products: list, removed_ids: set) -> list:
+    """Applique un delta au catalogue en cache en conservant l'ordre existant."""
+    changed_by_id = {p['id']: p for p in changed_products}
+    merged = []
+    for product in cached_products:
+        if product.get('id') in removed_ids:
+            continue
+        merged.append(changed_by_id.pop(product.get('id'), product))
+    merged.extend(changed_by_id.values())
+    return merged
+
+def _needs_full_sync(previous_data: Optional[dict]) -> bool:
+    """La synchro delta n'est possible qu'avec un point de reprise et tant que la dernière réconciliation est récente."""
+    if not previous_data or not previous_data.get('high_water_mark') or 'products' not in previous_data:
+        return True
+    reconcile_hours = config_manager.get_config("catalog.full_reconcile_hours", 24)
+    return time.time() - previous_data.get('last_full_sync', 0) >= reconcile_hours * 3600
+
+def _parse_product_node(prod: dict, gids_to_resolve: set) -> dict:
+    """Transforme un nœud produit GraphQL en dictionnaire produit du cache."""
+    # --- DÉBUT DE LA LOGIQUE DE CATÉGORISATION CORRIGÉE ---
+    tags = prod.get('tags', [])
+    tag_category_found = False
+    category = "accessoire" # On initialise la catégorie par défaut ici
+
+    # 1. On cherche d'abord un tag de catégorie
+    for tag in tags:
+        if tag.startswith("categorie:"):
+            category = tag.split(":", 1)[1]
+            tag_category_found = True
+            break
+
+    # 2. Si aucun tag n'est trouvé, on utilise l'ancienne logique comme fallback
+    if not tag_category_found:
+        collection_titles = [c['node']['title'].lower() for c in prod.get('collections', {}).get('edges', [])]
+        if any("box" in title for title in collection_titles): category = "box"
+        elif any("weed" in title for title in collection_titles): category = "weed"
+        elif any("hash" in title for title in collection_titles): category = "hash"
+    # --- FIN DE LA LOGIQUE DE CATÉGORISATION CORRIGÉE ---
+
+    images_edges = prod.get('images', {}).get('edges', [])
+    image_url = images_edges[0].get('node', {}).get('url') if images_edges else None
+
+    category_map_display = {"weed": "fleurs", "hash": "résines", "box": "box", "accessoire": "accessoires"}
+    product_data = {
+        'id': prod.get('id'), 'name': prod.get('title'), 'updated_at': prod.get('updatedAt'),
+        'product_url': f"https://la-foncedalle.fr/products/{prod.get('handle')}",
+        'image': image_url, 'category': category_map_display.get(category),
+        'detailed_description': description_cache.get_text(prod.get('bodyHtml', '')),
+        'stats': {}, 'box_contents': {}
+    }
+
+    variants = [v['node'] for v in prod.get('variants', {}).get('edges', [])]
+    available_variants = [v for v in variants if v.get('inventoryQuantity', 0) > 0 or v.get('inventoryPolicy') == 'CONTINUE']
+    product_data['is_sold_out'] = not available_variants
+    if available_variants:
+        min_price_variant = min(available_variants, key=lambda v: float(v['price']))
+        price = float(min_price_variant.get('price', 0))
+        compare_price = float(min_price_variant.get('compareAtPrice', 0) or 0)
+        product_data['is_promo'] = compare_price > price
+        product_data['original_price'] = f"{compare_price:.2f} €".replace('.', ',') if product_data['is_promo'] else None
+        price_prefix = "à partir de " if len(available_variants) > 1 and price > 0 else ""
+        product_data['price'] = f"{price_prefix}{price:.2f} €".replace('.', ',') if price > 0 else "Cadeau !"
+    else:
+        product_data.update({'price': "N/A", 'is_promo': False, 'original_price': None})
+
+    metafields = [m['node'] for m in prod.get('metafields', {}).get('edges', [])]
+    for meta in metafields:
+        full_key = f"{meta.get('namespace')}.{meta.get('key')}"
+        value = str(meta.get('value', ''))
+
+        if category == 'box' and full_key == 'custom.box_description':
+            all_lines = [line.strip() for line in value.split('\n') if line.strip()]
+            current_section = "Général"
+            product_data['box_contents'][current_section] = []
+            for line in all_lines[1:]:
+                if line.lower().startswith("les hash"): current_section = "Les Hash 🍫"
+                elif line.lower().startswith("les fleurs"): current_section = "Les Fleurs 🍃"
+                if current_section not in product_data['box_contents']: product_data['box_contents'][current_section] = []
+                product_data['box_contents'][current_section].append(line.lstrip('•* ').replace('*', ''))
+            continue
+
+        if category != 'box':
+            if full_key == 'custom.effet_tag': product_data['stats']['Effet'] = value
+            elif full_key == 'custom.gout_tag': product_data['stats']['Goût'] = value
+
+        if 'pdf' in full_key.lower() and value.startswith("gid://shopify/"):
+            key_formatted = meta.get('key').replace('_', ' ').capitalize()
+            product_data['stats'][key_formatted] = value
+            gids_to_resolve.add(value)
+
+    return product_data
+
+async def _resolve_file_urls(client: Optional[ShopifyClient], products: list, gids_to_resolve: set) -> list:
+    """Remplace les GIDs de fichiers des `stats` par leur URL, en ne demandant à Shopify que les GIDs inconnus ou expirés."""
+    await asyncio.to_thread(file_url_cache.load)
+    gid_url_map = file_url_cache.lookup(gids_to_resolve)
+    unresolved = sorted(gids_to_resolve - gid_url_map.keys())
+    if unresolved and client is not None:
+        Logger.info(f"Résolution de {len(unresolved)} GIDs de fichiers ({len(gid_url_map)} déjà en cache)...")
+        ttl_seconds = config_manager.get_config("catalog.file_url_ttl_hours", 168) * 3600
+        missing_ttl_seconds = config_manager.get_config("catalog.file_url_missing_ttl_hours", 6) * 3600
+        for i in range(0, len(unresolved), RESOLVE_FILES_BATCH_SIZE):
+            batch = unresolved[i:i + RESOLVE_FILES_BATCH_SIZE]
+            data = await client.execute(RESOLVE_FILES_QUERY, {"ids": batch})
+            for node in data.get('nodes', []):
+                if node and node.get('id') and node.get('url'):
+                    gid_url_map[node['id']] = node['url']
+                    file_url_cache.store(node['id'], node['url'], ttl_seconds)
+            # GIDs renvoyés à null ou sans URL : entrée négative à TTL court
+            for gid in batch:
+                if gid not in gid_url_map:
+                    file_url_cache.store(gid, None, missing_ttl_seconds)
+    await asyncio.to_thread(file_url_cache.save)
+
+    for product_data in products:
+        for key, value in product_data['stats'].items():
+            if isinstance(value, str) and gid_url_map.get(value):
+                product_data['stats'][key] = gid_url_map[value]
+    return products
+
+async def get_site_data_from_graphql(previous_data: Optional[dict] = None, force_full: bool = False):
     """
-    Récupère toutes les données du site en une seule requête GraphQL.
-    [VERSION 4.1 - Correction de la logique de catégorisation]
+    Récupère les données du site via GraphQL, page par page.
+    En mode delta, seuls les produits modifiés depuis `high_water_mark` sont relus et
+    fusionnés dans `previous_data` ; une réconciliation complète a lieu à cadence plus lente.
+    [VERSION 5.2 - Client aiohttp asynchrone, directement sur la boucle du bot]
     """
-    Logger.info("Démarrage de la récupération via GraphQL Shopify...")
+    full_sync = force_full or _needs_full_sync(previous_data)
+    Logger.info(f"Démarrage de la récupération via GraphQL Shopify (mode : {'complet' if full_sync else 'delta'}, moteur : {config_manager.get_config('catalog.ingestion_mode', 'paginated')})...")
     try:
-        shop_url = os.getenv('SHOPIFY_SHOP_URL')
-        api_version = os.getenv('SHOPIFY_API_VERSION')
-        access_token = os.getenv('SHOPIFY_ADMIN_ACCESS_TOKEN')
-        if not all([shop_url, api_version, access_token]): 
+        client = get_shopify_client()
+        ingestion_mode = config_manager.get_config("catalog.ingestion_mode", "paginated")
+        bulk_source_file = config_manager.get_config("catalog.bulk_source_file")
+        if client is None and not (ingestion_mode == "bulk" and bulk_source_file):
             Logger.error("Identifiants Shopify manquants."); return None
-            
-        session = shopify.Session(shop_url, api_version, access_token)
-        shopify.ShopifyResource.activate_session(session)
-        client = shopify.GraphQL()
-        result_json = client.execute(PRODUCTS_WITH_METAFIELDS_QUERY)
-        result = json.loads(result_json)
-        
+
+        since = None if full_sync else previous_data['high_water_mark']
+        search = PUBLISHED_PRODUCTS_SEARCH if full_sync else f"updated_at:>='{since}'"
+        high_water_mark = since
+
+        await asyncio.to_thread(description_cache.load)
         gids_to_resolve = set()
         raw_products_data = []
+        removed_ids = set()
 
-        for product_edge in result.get('data', {}).get('products', {}).get('edges', []):
-            prod = product_edge['node']
-            
-            # --- DÉBUT DE LA LOGIQUE DE CATÉGORISATION CORRIGÉE ---
-            tags = prod.get('tags', [])
-            tag_category_found = False
-            category = "accessoire" # On initialise la catégorie par défaut ici
-
-            # 1. On cherche d'abord un tag de catégorie
-            for tag in tags:
-                if tag.startswith("categorie:"):
-                    category = tag.split(":", 1)[1]
-                    tag_category_found = True
-                    break
-            
-            # 2. Si aucun tag n'est trouvé, on utilise l'ancienne logique comme fallback
-            if not tag_category_found:
-                collection_titles = [c['node']['title'].lower() for c in prod.get('collections', {}).get('edges', [])]
-                if any("box" in title for title in collection_titles): category = "box"
-                elif any("weed" in title for title in collection_titles): category = "weed"
-                elif any("hash" in title for title in collection_titles): category = "hash"
-            # --- FIN DE LA LOGIQUE DE CATÉGORISATION CORRIGÉE ---
-            
-            images_edges = prod.get('images', {}).get('edges', [])
-            image_url = images_edges[0].get('node', {}).get('url') if images_edges else None
-            
-            category_map_display = {"weed": "fleurs", "hash": "résines", "box": "box", "accessoire": "accessoires"}
-            product_data = {
-                'id': prod.get('id'), 'name': prod.get('title'),
-                'product_url': f"https://la-foncedalle.fr/products/{prod.get('handle')}",
-                'image': image_url, 'category': category_map_display.get(category),
-                'detailed_description': BeautifulSoup(prod.get('bodyHtml', ''), 'html.parser').get_text(separator='\n', strip=True),
-                'stats': {}, 'box_contents': {}
-            }
+        if ingestion_mode == "bulk":
+            product_pages = iter_bulk_product_pages(client, search, bulk_source_file)
+        else:
+            product_pages = iter_product_pages(client, search)
+
+        page_number = 0
+        async for page in product_pages:
+            page_number += 1
+            for prod in page:
+                if prod.get('updatedAt') and (high_water_mark is None or prod['updatedAt'] > high_water_mark):
+                    high_water_mark = prod['updatedAt']
+                # En delta, la recherche n'est pas filtrée sur la publication : un produit dépublié doit sortir du menu.
+                if full_sync or _is_product_listed(prod):
+                    raw_products_data.append(_parse_product_node(prod, gids_to_resolve))
+                else:
+                    removed_ids.add(prod.get('id'))
+            Logger.info(f"Page {page_number} du catalogue reçue ({len(raw_products_data)} produits au total).")
 
-            variants = [v['node'] for v in prod.get('variants', {}).get('edges', [])]
-            available_variants = [v for v in variants if v.get('inventoryQuantity', 0) > 0 or v.get('inventoryPolicy') == 'CONTINUE']
-            product_data['is_sold_out'] = not available_variants
-            if available_variants:
-                min_price_variant = min(available_variants, key=lambda v: float(v['price']))
-                price = float(min_price_variant.get('price', 0))
-                compare_price = float(min_price_variant.get('compareAtPrice', 0) or 0)
-                product_data['is_promo'] = compare_price > price
-                product_data['original_price'] = f"{compare_price:.2f} €".replace('.', ',') if product_data['is_promo'] else None
-                price_prefix = "à partir de " if len(available_variants) > 1 and price > 0 else ""
-                product_data['price'] = f"{price_prefix}{price:.2f} €".replace('.', ',') if price > 0 else "Cadeau !"
-            else:
-                product_data.update({'price': "N/A", 'is_promo': False, 'original_price': None})
-
-            metafields = [m['node'] for m in prod.get('metafields', {}).get('edges', [])]
-            for meta in metafields:
-                full_key = f"{meta.get('namespace')}.{meta.get('key')}"
-                value = str(meta.get('value', ''))
-
-                if category == 'box' and full_key == 'custom.box_description':
-                    all_lines = [line.strip() for line in value.split('\n') if line.strip()]
-                    current_section = "Général"
-                    product_data['box_contents'][current_section] = []
-                    for line in all_lines[1:]:
-                        if line.lower().startswith("les hash"): current_section = "Les Hash 🍫"
-                        elif line.lower().startswith("les fleurs"): current_section = "Les Fleurs 🍃"
-                        if current_section not in product_data['box_contents']: product_data['box_contents'][current_section] = []
-                        product_data['box_contents'][current_section].append(line.lstrip('•* ').replace('*', ''))
-                    continue
-                
-                if category != 'box':
-                    if full_key == 'custom.effet_tag': product_data['stats']['Effet'] = value
-                    elif full_key == 'custom.gout_tag': product_data['stats']['Goût'] = value
-                
-                if 'pdf' in full_key.lower() and value.startswith("gid://shopify/"):
-                    key_formatted = meta.get('key').replace('_', ' ').capitalize()
-                    product_data['stats'][key_formatted] = value
-                    gids_to_resolve.add(value)
+        if not full_sync and client is not None:
+            removed_ids |= await _fetch_deleted_product_ids(client, since)
 
-            raw_products_data.append(product_data)
-        
-        # Le reste de la fonction est correct
-        gid_url_map = {}
-        if gids_to_resolve:
-            Logger.info(f"Résolution de {len(gids_to_resolve)} GIDs de fichiers...")
-            result_json = client.execute(RESOLVE_FILES_QUERY, variables={"ids": list(gids_to_resolve)})
-            result = json.loads(result_json)
-            for node in result.get('data', {}).get('nodes', []):
-                if node and node.get('id') and node.get('url'):
-                    gid_url_map[node['id']] = node['url']
+        final_products = await _resolve_file_urls(client, raw_products_data, gids_to_resolve)
 
-        final_products = []
-        for product_data in raw_products_data:
-            for key, value in product_data['stats'].items():
-                if isinstance(value, str) and value in gid_url_map:
-                    product_data['stats'][key] = gid_url_map[value]
-            final_products.append(product_data)
-            
-        general_promos = get_smart_promotions_from_api()
-        shopify.ShopifyResource.clear_session()
-        
-        Logger.success(f"Récupération GraphQL terminée. {len(final_products)} produits valides trouvés.")
-        return {"timestamp": time.time(), "products": final_products, "general_promos": general_promos}
+        general_promos = await get_smart_promotions_from_api(client, force_refresh=force_full)
+
+        if full_sync:
+            description_cache.prune_unseen()
+        await asyncio.to_thread(description_cache.save)
+        stats = description_cache.stats()
+        Logger.info(f"Cache des descriptions depuis le démarrage : {stats['hits']} hits, {stats['misses']} parsées ({stats['parser']}).")
+
+        if full_sync:
+            last_full_sync = time.time()
+            Logger.success(f"Récupération GraphQL complète terminée. {len(final_products)} produits valides trouvés.")
+        else:
+            last_full_sync = previous_data.get('last_full_sync', 0)
+            # On construit une nouvelle liste plutôt que de muter celle que lisent les commandes sur la boucle.
+            final_products = _merge_products(previous_data.get('products', []), final_products, removed_ids)
+            Logger.success(f"Synchro delta terminée : {len(raw_products_data)} produit(s) modifié(s), {len(removed_ids)} retiré(s), {len(final_products)} au total.")
+
+        return {
+            "timestamp": time.time(), "products": final_products, "general_promos": general_promos,
+            "high_water_mark": high_water_mark, "last_full_sync": last_full_sync,
+            "sync_mode": "full" if full_sync else "delta",
+        }
 
     except Exception as e:
         Logger.error(f"CRITIQUE lors de la récupération via GraphQL Shopify : {e}")
         traceback.print_exc()
-        if 'shopify' in locals() and shopify.ShopifyResource.get_session():
-            shopify.ShopifyResource.clear_session()
         return None
 
 async def post_weekly_selection(bot_instance: commands.Bot, guild_id_to_run: Optional[int] = None):
@@ -245,51 +509,18 @@ async def post_weekly_selection(bot_instance: commands.Bot, guild_id_to_run: Opt
             return
 
         try:
-            # --- DÉBUT DE LA LOGIQUE RESTAURÉE ---
-            def _get_top_products_sync():
-                conn = sqlite3.connect(DB_FILE)
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT 
-                        product_name,
-                        AVG((COALESCE(visual_score,0) + COALESCE(smell_score,0) + COALESCE(touch_score,0) + COALESCE(taste_score,0) + COALESCE(effects_score,0)) / 5.0) as avg_score,
-                        COUNT(id) as num_ratings
-                    FROM ratings GROUP BY LOWER(TRIM(product_name)) HAVING COUNT(id) > 0
-                    ORDER BY avg_score DESC LIMIT 3
-                """)
-                results = cursor.fetchall()
-                conn.close()
-                return results
-
-            def _get_weekly_top_raters_sync():
-                conn = sqlite3.connect(DB_FILE)
-                cursor = conn.cursor()
-                seven_days_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
-                cursor.execute("""
-                    SELECT user_id, COUNT(id) as weekly_rating_count FROM ratings
-                    WHERE rating_timestamp >= ? GROUP BY user_id ORDER BY weekly_rating_count DESC LIMIT 3
-                """, (seven_days_ago,))
-                results = cursor.fetchall()
-                conn.close()
-                return results
-
-            def _read_product_cache_sync():
-                with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-
-            top_products, weekly_top_raters, site_data = await asyncio.gather(
-                asyncio.to_thread(_get_top_products_sync),
-                asyncio.to_thread(_get_weekly_top_raters_sync),
-                asyncio.to_thread(_read_product_cache_sync)
+            top_products, weekly_top_raters = await asyncio.gather(
+                bot_db.get_top_products(3),
+                bot_db.get_top_raters_since(rollup_start_day(7), 3)
             )
+            catalog = bot_instance.catalog
 
-            if not top_products or not site_data.get("products"):
+            if not top_products or not catalog:
                 Logger.warning("Données insuffisantes pour générer la sélection. Annulation.")
                 await channel.send("⚠️ Aucune sélection de la semaine à publier, pas assez de données.")
                 return
 
             week_number = datetime.utcnow().isocalendar()[1]
-            product_map = {p['name'].strip().lower(): p for p in site_data.get("products", [])}
             
             embed = create_styled_embed(
                 f"🔎 Sélection de la Semaine #{week_number}",
@@ -299,7 +530,7 @@ async def post_weekly_selection(bot_instance: commands.Bot, guild_id_to_run: Opt
 
             medals = ["🥇", "🥈", "🥉"]
             for i, (prod_name, avg_score, num_ratings) in enumerate(top_products):
-                prod = product_map.get(prod_name.strip().lower())
+                prod = catalog.get(prod_name)
                 note_str = f"**Note :** {round(avg_score,2)}/10\n"
                 count_str = f"**Nombre de notations :** {num_ratings}\n"
                 if prod:
@@ -354,61 +585,111 @@ async def post_weekly_selection(bot_instance: commands.Bot, guild_id_to_run: Opt
             await run_for_guild(guild_id)
 
 
-def get_smart_promotions_from_api():
+_promo_cache = {"texts": None, "expires_at": 0.0}
+
+def _parse_shopify_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+def _format_discount(discount: dict, now: datetime) -> Optional[str]:
+    """Applique localement les règles d'affichage d'une promo (fenêtre, quota d'utilisation, code en ...10)."""
+    starts_at = _parse_shopify_datetime(discount.get('startsAt'))
+    ends_at = _parse_shopify_datetime(discount.get('endsAt'))
+    if (starts_at and starts_at > now) or (ends_at and ends_at < now):
+        return None
+
+    title = discount.get('title') or ""
+    title_lower = title.lower()
+    if title_lower.startswith(('test', '_', 'z-')):
+        return None
+
+    codes = (discount.get('codes') or {}).get('nodes') or []
+    is_shipping_offer = "livraison" in title_lower
+    if not codes and not is_shipping_offer:
+        return None
+    if codes and discount.get('usageLimit') is not None and (codes[0].get('asyncUsageCount') or 0) >= discount['usageLimit']:
+        return None
+    if not (is_shipping_offer or codes[0]['code'].endswith('10')):
+        return None
+
+    if is_shipping_offer:
+        return f"🚚 {title}"
+    code_text = f" (avec le code `{codes[0]['code']}`)" if codes else ""
+    value = (discount.get('customerGets') or {}).get('value') or {}
+    if discount.get('__typename') == 'DiscountCodeBxgy':
+        return _format_bxgy(discount, value, title, code_text)
+    if value.get('percentage') is not None:
+        return f"💰 {float(value['percentage']) * 100:.0f}% de réduction sur {title}{code_text}"
+    if value.get('amount'):
+        return f"💰 {abs(float(value['amount']['amount'])):.2f}€ de réduction sur {title}{code_text}"
+    return None
+
+def _format_bxgy(discount: dict, gets_value: dict, title: str, code_text: str) -> Optional[str]:
+    """Texte d'une offre « X achetés, Y offerts / remisés » (DiscountCodeBxgy)."""
+    gets_quantity = (gets_value.get('getsQuantity') or {}).get('quantity')
+    if not gets_quantity:
+        return None
+    buys = (discount.get('customerBuys') or {}).get('value') or {}
+    if buys.get('buysQuantity'):
+        condition = f"{buys['buysQuantity']} acheté(s)"
+    elif buys.get('buysAmount'):
+        condition = f"dès {float(buys['buysAmount']):.2f}€ d'achat"
+    else:
+        return None
+    effect = gets_value.get('effect') or {}
+    if effect.get('percentage') is not None:
+        percentage = float(effect['percentage']) * 100
+        reward = "offert(s)" if percentage >= 100 else f"à -{percentage:.0f}%"
+    elif effect.get('amount'):
+        reward = f"à -{abs(float(effect['amount']['amount'])):.2f}€"
+    else:
+        return None
+    return f"🎁 {condition}, {gets_quantity} {reward} sur {title}{code_text}"
+
+async def get_smart_promotions_from_api(client: Optional[ShopifyClient] = None, force_refresh: bool = False):
     """
     Interroge l'API Shopify pour trouver toutes les promotions disponibles.
-    [CORRECTION] Gère les titres de promotion vides.
+    Une seule requête GraphQL paginée ramène réductions et codes ; le résultat est
+    gardé `catalog.promo_cache_ttl_seconds` secondes pour ne pas refaire l'aller-retour à chaque synchro.
     """
+    if not force_refresh and _promo_cache["texts"] is not None and time.time() < _promo_cache["expires_at"]:
+        return _promo_cache["texts"]
+
     Logger.info("Recherche des promotions intelligentes et disponibles via l'API...")
     promo_texts = []
     try:
-        session = shopify.Session(os.getenv('SHOPIFY_SHOP_URL'), os.getenv('SHOPIFY_API_VERSION'), os.getenv('SHOPIFY_ADMIN_ACCESS_TOKEN'))
-        shopify.ShopifyResource.activate_session(session)
-        price_rules = shopify.PriceRule.find()
-
-        for rule in price_rules:
-            now = datetime.utcnow().isoformat()
-            if rule.starts_at > now or (rule.ends_at and rule.ends_at < now):
-                continue
-            
-            title_lower = rule.title.lower() if rule.title else ""
-            if title_lower.startswith(('test', '_', 'z-')):
-                continue
-
-            discount_codes = shopify.DiscountCode.find(price_rule_id=rule.id)
-            is_shipping_offer = "livraison" in title_lower
-
-            if not discount_codes and not is_shipping_offer:
-                continue
-            if discount_codes and rule.usage_limit is not None and discount_codes[0].usage_count >= rule.usage_limit:
-                continue
-            
-            is_valid_promo = is_shipping_offer or (discount_codes and discount_codes[0].code.endswith('10'))
-            if not is_valid_promo:
-                continue
-
-            code_text = f" (avec le code `{discount_codes[0].code}`)" if discount_codes else ""
-            value = float(rule.value)
-            
-            if is_shipping_offer:
-                 promo_texts.append(f"🚚 {rule.title}")
-            elif rule.value_type == 'percentage':
-                promo_texts.append(f"💰 {abs(value):.0f}% de réduction sur {rule.title}{code_text}")
-            elif rule.value_type == 'fixed_amount':
-                promo_texts.append(f"💰 {abs(value):.2f}€ de réduction sur {rule.title}{code_text}")
-                
-        shopify.ShopifyResource.clear_session()
-        
-        if not promo_texts: return ["Aucune promotion spéciale en ce moment."]
-        Logger.success(f"{len(promo_texts)} promotions disponibles trouvées.")
+        client = client or get_shopify_client()
+        if client is None:
+            Logger.error("Identifiants Shopify manquants."); return ["Impossible de charger les promotions."]
+
+        now = datetime.now(timezone.utc)
+        cursor = None
+        while True:
+            data = await client.execute(DISCOUNTS_PAGE_QUERY, {"cursor": cursor})
+            connection = data.get('codeDiscountNodes') or {}
+            for node in connection.get('nodes', []):
+                text = _format_discount(node.get('codeDiscount') or {}, now)
+                if text:
+                    promo_texts.append(text)
+            page_info = connection.get('pageInfo') or {}
+            if not page_info.get('hasNextPage'):
+                break
+            cursor = page_info.get('endCursor')
+
+        if not promo_texts:
+            promo_texts = ["Aucune promotion spéciale en ce moment."]
+        else:
+            Logger.success(f"{len(promo_texts)} promotions disponibles trouvées.")
+        _promo_cache.update(texts=promo_texts, expires_at=time.time() + config_manager.get_config("catalog.promo_cache_ttl_seconds", 900))
         return promo_texts
     except Exception as e:
-        Logger.error(f"Erreur lors de la récupération des PriceRule : {e}")
-        if 'shopify' in locals() and shopify.ShopifyResource.get_session():
-            shopify.ShopifyResource.clear_session()
+        Logger.error(f"Erreur lors de la récupération des promotions : {e}")
+        # Mieux vaut une liste un peu ancienne qu'un message d'erreur dans le menu.
+        if _promo_cache["texts"] is not None:
+            return _promo_cache["texts"]
         return ["Impossible de charger les promotions."]
     
-async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: int, mention: bool = False):
+async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: int, mention: bool = False, diff: Optional[CatalogDiff] = None, edit_in_place: bool = False):
+    """Publie le menu d'un serveur ; avec `edit_in_place`, modifie le dernier message au lieu de le supprimer et le renvoyer."""
     Logger.info(f"Publication du menu pour le serveur {guild_id} (mention: {mention})...")
     
     # On récupère la config spécifique à ce serveur
@@ -422,11 +703,10 @@ async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: in
         Logger.error(f"Salon avec l'ID {channel_id} non trouvé pour la publication sur le serveur {guild_id}.")
         return False
 
-    products = site_data.get('products', [])
-    promos_list = site_data.get('general_promos', [])
-    general_promos_text = "\n".join([f"• {promo.strip()}" for promo in promos_list if promo.strip()]) or "Aucune promotion générale en cours."
+    catalog = bot_instance.catalog if bot_instance.catalog.site_data is site_data else ProductCatalog(site_data)
+    general_promos_text = "\n".join([f"• {promo.strip()}" for promo in catalog.general_promos if promo.strip()]) or "Aucune promotion générale en cours."
 
-    hash_count, weed_count, box_count, accessoire_count = get_product_counts(products)
+    hash_count, weed_count, box_count, accessoire_count = catalog.counts
 
     description_text = (f"__**📦 Produits disponibles :**__\n\n"
                       f"**`Fleurs 🍃 :` {weed_count}**\n"
@@ -435,6 +715,8 @@ async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: in
                       f"**`Accessoires 🛠️ :` {accessoire_count}**\n\n"
                       f"__**💰 Promotions disponibles :**__\n\n{general_promos_text}\n\n"
                       f"*(Mise à jour <t:{int(site_data.get('timestamp'))}:R>)*")
+    if diff and diff.summary():
+        description_text += f"\n\n__**🔔 Quoi de neuf :**__ {diff.summary()}"
     
     embed = discord.Embed(title="📢 Nouveautés et Promotions !", url=CATALOG_URL, description=description_text, color=discord.Color.from_rgb(0, 102, 204))
     
@@ -454,6 +736,11 @@ async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: in
         if last_message_id:
             try:
                 old_message = await channel.fetch_message(int(last_message_id))
+                if edit_in_place:
+                    bot_instance.add_view(view)
+                    await old_message.edit(content=old_message.content, embed=embed, view=view)
+                    Logger.success(f"Menu mis à jour sur place (ID: {old_message.id}) sur le serveur {guild_id}.")
+                    return True
                 await old_message.delete()
             except (discord.NotFound, discord.Forbidden): pass
         
@@ -470,47 +757,175 @@ async def publish_menu(bot_instance: commands.Bot, site_data: dict, guild_id: in
         return False
 
 
-async def check_for_updates(bot_instance: commands.Bot, force_publish: bool = False):
-    Logger.info(f"Vérification du menu... (Forcé: {force_publish})")
-
-    site_data = await bot_instance.loop.run_in_executor(
-        executor, get_site_data_from_graphql # <--- Changement ici
-    )
-    
-    if not site_data or 'products' not in site_data:
-        Logger.error("Récupération des données API échouée, la vérification s'arrête.")
-        bot_instance.product_cache = {} 
-        return False
-        
-    def write_cache():
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(site_data, f, indent=4, ensure_ascii=False)
-    await asyncio.to_thread(write_cache)
+def set_catalog(bot_instance: commands.Bot, site_data: dict, stale: bool = False):
+    """Remplace d'un bloc le cache brut et l'instantané indexé lu par les commandes."""
+    catalog = ProductCatalog(site_data, stale=stale) if site_data else EMPTY_CATALOG
     bot_instance.product_cache = site_data
-    Logger.success(f"Cache de produits mis à jour sur le disque avec {len(site_data.get('products', []))} produits.")
+    bot_instance.catalog = catalog
+    bot_instance.product_search = _build_search_index(catalog, bot_instance.product_rating_counts)
 
-    data_to_hash = {
-        'products': site_data.get('products', []),
-        'general_promos': sorted(site_data.get('general_promos', [])) 
-    }
-    current_hash = hashlib.sha256(json.dumps(data_to_hash, sort_keys=True).encode('utf-8')).hexdigest()
+def _build_search_index(catalog: ProductCatalog, rating_counts: dict) -> ProductSearchIndex:
+    if not catalog:
+        return EMPTY_SEARCH_INDEX
+    return ProductSearchIndex((p['name'] for p in catalog.products if p.get('name')), rating_counts)
+
+async def refresh_search_index(bot_instance: commands.Bot):
+    """Recharge la popularité des produits puis reconstruit l'index de recherche hors de la boucle."""
+    try:
+        bot_instance.product_rating_counts = await bot_db.get_rating_counts_by_product()
+    except sqlite3.Error as e:
+        Logger.warning(f"Compteurs de notes indisponibles pour l'autocomplétion : {e}")
+    catalog = bot_instance.catalog
+    index = await asyncio.to_thread(_build_search_index, catalog, bot_instance.product_rating_counts)
+    # Un autre catalogue a pu être publié entre-temps : il a déjà son propre index.
+    if bot_instance.catalog is catalog:
+        bot_instance.product_search = index
+
+async def _store_and_publish(bot_instance: commands.Bot, site_data: dict, force_publish: bool = False, silent_refresh: bool = True, announce: bool = True):
+    """
+    Écrit le cache puis republie le menu des serveurs dont le hash a changé (et rafraîchit les autres si `silent_refresh`).
+    Avec `announce=False` (patchs webhook), le menu existant est seulement modifié sur place, sans mention ;
+    le hash publié n'est pas mis à jour et le diff est gardé pour l'annonce de la synchro périodique suivante.
+    Le diff structuré avec le catalogue précédent décide de la mention du rôle et reste disponible dans `bot.last_catalog_diff` ;
+    il est aussi renvoyé, pour les appelants qui le lisent sous `catalog_sync_lock`.
+    Aucun dictionnaire déjà publié n'est modifié : un nouveau cache est construit puis substitué d'un bloc.
+    """
+    previous_data = bot_instance.product_cache or {}
+    if previous_data.get('products') and not previous_data.get('fingerprints'):
+        previous_data = {**previous_data, 'fingerprints': compute_fingerprints(previous_data['products'])}
+    site_data = {**site_data, 'fingerprints': compute_fingerprints(site_data.get('products', []), previous_data.get('products'), previous_data.get('fingerprints'))}
+    diff = diff_catalogs(previous_data, site_data)
+    bot_instance.last_catalog_diff = diff
+    if diff.has_changes:
+        Logger.info(f"Changements du catalogue : {diff.summary() or 'modifications mineures'}.")
+
+    await asyncio.to_thread(write_catalog_snapshot, site_data)
+    set_catalog(bot_instance, site_data)
+    await refresh_search_index(bot_instance)
+    Logger.success(f"Cache de produits mis à jour sur le disque avec {len(site_data.get('products', []))} produits.")
 
     # On boucle sur tous les serveurs qui ont une configuration
     configured_guilds = await config_manager.get_all_configured_guilds()
+
+    if not announce:
+        if diff.has_changes:
+            pending = bot_instance.unannounced_diff
+            bot_instance.unannounced_diff = pending.merged(diff) if pending else diff
+            for guild_id in configured_guilds:
+                await publish_menu(bot_instance, site_data, guild_id, mention=False, edit_in_place=True)
+        return diff
+
+    # Les changements webhook encore non annoncés sont annoncés avec ceux de cette synchro.
+    announced_diff = bot_instance.unannounced_diff.merged(diff) if bot_instance.unannounced_diff else diff
+    current_hash = menu_hash(site_data['fingerprints'], site_data.get('general_promos', []))
+    # Sans catalogue précédent, on ne sait pas ce qui a changé : on mentionne comme avant.
+    mention = force_publish or not previous_data.get('products') or announced_diff.is_notable
+
     Logger.info(f"Vérification des mises à jour pour {len(configured_guilds)} serveur(s) configuré(s).")
 
     for guild_id in configured_guilds:
         last_hash = await config_manager.get_state(guild_id, 'last_menu_hash', "")
         
         if current_hash != last_hash or force_publish:
-            Logger.info(f"Changement détecté (ou forcé) pour le serveur {guild_id}. Publication du menu.")
-            if await publish_menu(bot_instance, site_data, guild_id, mention=True): 
+            Logger.info(f"Changement détecté (ou forcé) pour le serveur {guild_id}. Publication du menu (mention: {mention}).")
+            if await publish_menu(bot_instance, site_data, guild_id, mention=mention, diff=announced_diff): 
                 await config_manager.update_state(guild_id, 'last_menu_hash', current_hash)
-        else:
+        elif silent_refresh:
             Logger.info(f"Aucun changement pour le serveur {guild_id}. Mise à jour silencieuse.")
             await publish_menu(bot_instance, site_data, guild_id, mention=False)
+    bot_instance.unannounced_diff = None
+    return diff
+
+async def check_for_updates(bot_instance: commands.Bot, force_publish: bool = False, full_sync: bool = False):
+    Logger.info(f"Vérification du menu... (Forcé: {force_publish}, Complète: {full_sync})")
+
+    async with catalog_sync_lock:
+        site_data = await get_site_data_from_graphql(bot_instance.product_cache, full_sync)
+        
+        if not site_data or 'products' not in site_data:
+            Logger.error("Récupération des données API échouée, la vérification s'arrête.")
+            # On continue de servir le dernier catalogue connu, marqué comme périmé.
+            set_catalog(bot_instance, bot_instance.product_cache, stale=True)
+            return False
+
+        # Diff lu sous le verrou : un patch webhook peut remplacer bot.last_catalog_diff dès sa libération.
+        diff = await _store_and_publish(bot_instance, site_data, force_publish)
             
-    return True # La fonction a terminé son travail
+    # Vrai si le catalogue a réellement changé (utilisé par /check pour son message).
+    return diff.has_changes
+
+def _product_gid(resource_id) -> str:
+    return f"gid://shopify/Product/{resource_id}"
+
+async def _products_for_inventory_items(client: ShopifyClient, inventory_item_ids: set) -> set:
+    product_ids = set()
+    item_gids = sorted(f"gid://shopify/InventoryItem/{item_id}" for item_id in inventory_item_ids)
+    for i in range(0, len(item_gids), INVENTORY_ITEMS_BATCH_SIZE):
+        data = await client.execute(INVENTORY_ITEMS_PRODUCTS_QUERY, {"ids": item_gids[i:i + INVENTORY_ITEMS_BATCH_SIZE]})
+        for node in data.get('nodes', []):
+            product = ((node or {}).get('variant') or {}).get('product') or {}
+            if product.get('id'):
+                product_ids.add(product['id'])
+    return product_ids
+
+async def process_catalog_events(bot_instance: commands.Bot):
+    """
+    Consomme la file `catalog_events` alimentée par les webhooks Shopify de l'API :
+    seuls les produits concernés sont relus puis fusionnés dans `bot.product_cache`. Si le contenu a changé,
+    le menu est modifié sur place sans mention ; l'annonce revient à la synchro périodique suivante.
+    """
+    events = await bot_db.read_catalog_events()
+    if not events:
+        return
+    client = get_shopify_client()
+    previous_data = bot_instance.product_cache
+    if client is None or not previous_data or 'products' not in previous_data:
+        # Pas de catalogue de référence à patcher : la prochaine synchro complète s'en chargera.
+        await bot_db.delete_catalog_events(events[-1]['id'])
+        return
+
+    updated_ids, deleted_ids, inventory_item_ids = set(), set(), set()
+    for event in events:
+        try:
+            payload = json.loads(event['payload'])
+        except json.JSONDecodeError:
+            continue
+        if event['topic'] == 'products/delete':
+            deleted_ids.add(_product_gid(payload.get('id')))
+        elif event['topic'] == 'products/update':
+            updated_ids.add(_product_gid(payload.get('id')))
+        elif event['topic'] == 'inventory_levels/update' and payload.get('inventory_item_id'):
+            inventory_item_ids.add(payload['inventory_item_id'])
+    Logger.info(f"Webhooks catalogue : {len(updated_ids)} produit(s) modifié(s), {len(deleted_ids)} supprimé(s), {len(inventory_item_ids)} stock(s) modifié(s).")
+
+    async with catalog_sync_lock:
+        try:
+            if inventory_item_ids:
+                updated_ids |= await _products_for_inventory_items(client, inventory_item_ids)
+            updated_ids -= deleted_ids
+
+            gids_to_resolve = set()
+            changed_products = []
+            if updated_ids:
+                search = " OR ".join(f"id:{gid.rsplit('/', 1)[-1]}" for gid in sorted(updated_ids))
+                async for page in iter_product_pages(client, search):
+                    changed_products.extend(_parse_product_node(prod, gids_to_resolve) for prod in page if _is_product_listed(prod))
+            changed_products = await _resolve_file_urls(client, changed_products, gids_to_resolve)
+            await asyncio.to_thread(description_cache.save)
+
+            # Un produit relu mais absent (dépublié, supprimé entre-temps) sort du menu.
+            removed_ids = deleted_ids | (updated_ids - {p['id'] for p in changed_products})
+            site_data = dict(bot_instance.product_cache)
+            site_data['products'] = _merge_products(site_data.get('products', []), changed_products, removed_ids)
+            site_data['timestamp'] = time.time()
+            # Pas de mention ni de renvoi du message à chaque webhook : la synchro périodique annonce.
+            await _store_and_publish(bot_instance, site_data, silent_refresh=False, announce=False)
+        except Exception as e:
+            Logger.error(f"Erreur lors de l'application des webhooks catalogue : {e}")
+            traceback.print_exc()
+        finally:
+            # Même en cas d'échec, la synchro delta suivante rattrapera ces produits : on ne rejoue pas la file en boucle.
+            await bot_db.delete_catalog_events(events[-1]['id'])
 
 async def generate_and_send_ranking(bot_instance: commands.Bot, force_run: bool = False):
     Logger.info("Exécution de la logique de classement...")
@@ -523,14 +938,8 @@ async def generate_and_send_ranking(bot_instance: commands.Bot, force_run: bool
     if not channel:
         Logger.error(f"Salon du classement (ID: {ranking_channel_id}) non trouvé.")
         return
-    def _get_top_products_sync():
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        seven_days_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
-        cursor.execute("SELECT product_name, AVG((visual_score + smell_score + touch_score + taste_score + effects_score) / 5.0), COUNT(id) FROM ratings WHERE rating_timestamp >= ? GROUP BY product_name HAVING COUNT(id) > 0 ORDER BY AVG((visual_score + smell_score + touch_score + taste_score + effects_score) / 5.0) DESC LIMIT 3", (seven_days_ago,))
-        return cursor.fetchall()
     try:
-        top_products = await asyncio.to_thread(_get_top_products_sync)
+        top_products = await bot_db.get_top_products_since(rollup_start_day(7), 3)
     except Exception as e:
         Logger.error(f"Erreur lors de la génération du classement : {e}"); traceback.print_exc()
         return
@@ -540,15 +949,12 @@ async def generate_and_send_ranking(bot_instance: commands.Bot, force_run: bool
         Logger.info("Aucune nouvelle note cette semaine, pas de classement à publier.")
         if force_run: await channel.send("🏆 (DEBUG) Aucune nouvelle note cette semaine, pas de classement à publier.")
         return
-    product_details_map = {}
-    try:
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f: site_data = json.load(f)
-        product_details_map = {p['name'].strip().lower(): p for p in site_data.get('products', [])}
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        Logger.warning(f"Cache des produits non trouvé pour classement : {e}.")
+    catalog = bot_instance.catalog
+    if not catalog:
+        Logger.warning("Cache des produits non trouvé pour classement.")
     embed = discord.Embed(title=title_prefix, description="Voici les 3 produits les mieux notés par la communauté ces 7 derniers jours.", color=discord.Color.gold())
     winner_name = top_products[0][0]
-    if (winner_details := product_details_map.get(winner_name.strip().lower())) and (winner_image := winner_details.get('image')):
+    if (winner_details := catalog.get(winner_name)) and (winner_image := winner_details.get('image')):
         embed.set_thumbnail(url=winner_image)
     medals = ["🥇", "🥈", "🥉"]
     for i, (name, avg_score, count) in enumerate(top_products):
@@ -569,14 +975,8 @@ async def sync_all_loyalty_roles(bot_instance: commands.Bot):
         Logger.error("Impossible de démarrer la synchro des rôles : le cog 'SlashCommands' est introuvable.")
         return
 
-    def _get_all_raters_sync():
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id, COUNT(id) as rating_count FROM ratings GROUP BY user_id")
-        return cursor.fetchall()
-
     try:
-        all_raters = await asyncio.to_thread(_get_all_raters_sync)
+        all_raters = await bot_db.get_rating_counts_by_user()
         if not all_raters:
             Logger.info("Aucun membre avec des notes trouvé. Fin de la synchro des rôles.")
             return
@@ -731,11 +1131,19 @@ async def scheduled_db_export(bot_instance: commands.Bot):
 
 bot.sync_all_loyalty_roles = sync_all_loyalty_roles
 bot.check_for_updates = check_for_updates
+bot.set_catalog = set_catalog
 bot.post_weekly_selection = post_weekly_selection
 
 @tasks.loop(time=update_time)
 async def scheduled_check(): await check_for_updates(bot)
 
+@tasks.loop(seconds=CATALOG_EVENTS_POLL_SECONDS)
+async def catalog_events_watcher():
+    try:
+        await process_catalog_events(bot)
+    except Exception as e:
+        Logger.error(f"Erreur dans la lecture de la file des webhooks catalogue : {e}")
+
 @tasks.loop(time=ranking_time)
 async def post_weekly_ranking(): await generate_and_send_ranking(bot)
 
@@ -769,6 +1177,32 @@ activity = discord.Activity(
     small_text="Tes avis comptent !", # Texte au survol de la petite image
 )
 
+@bot.event
+async def setup_hook():
+    """
+    Exécuté avant la connexion à la passerelle : base migrée, vues persistantes et boutons dynamiques
+    enregistrés. Avec le catalogue chargé par warm_start_catalog, le menu répond dès le premier événement,
+    sans attendre la synchro des commandes d'on_ready.
+    """
+    # Initialisation de la base de données
+    await asyncio.to_thread(initialize_database)
+    await bot_db.connect()
+    await refresh_search_index(bot)
+
+    # Chargement de la vue persistante
+    try:
+        bot.add_view(MenuView())
+        bot.add_dynamic_items(ProductBrowserButton)
+        Logger.success("Vue de menu persistante ré-enregistrée avec succès.")
+    except Exception as e:
+        Logger.error(f"Échec critique du chargement de la vue persistante : {e}")
+    try:
+        bot.add_view(UnsubscribeButton(user_id=0, order_id="", bot=bot)) 
+        Logger.success("Vue persistante 'UnsubscribeButton' ré-enregistrée avec succès.")
+    except Exception as e:
+        Logger.error(f"Échec critique du chargement de la vue persistante 'UnsubscribeButton': {e}")
+        traceback.print_exc()
+
 @bot.event
 async def on_ready():
     Logger.info("Le bot est prêt.")
@@ -787,29 +1221,14 @@ async def on_ready():
         Logger.error(f"Échec de la synchronisation des commandes : {e}")
     # --- FIN DU BLOC DE SYNCHRONISATION ---
 
-    # Initialisation de la base de données
-    await asyncio.to_thread(initialize_database)
-
     # Lancement de la vérification initiale des mises à jour (différée)
+    # Le catalogue de l'instantané disque est déjà servi (warm_start_catalog) ; on le revalide en fond.
     async def initial_update_task():
         await asyncio.sleep(5) # Attendre un peu pour que Discord soit bien prêt
         Logger.info("Lancement de la vérification initiale différée...")
         await check_for_updates(bot, force_publish=False)
     asyncio.create_task(initial_update_task())
 
-    # Chargement de la vue persistante
-    try:
-        bot.add_view(MenuView())
-        Logger.success("Vue de menu persistante ré-enregistrée avec succès.")
-    except Exception as e:
-        Logger.error(f"Échec critique du chargement de la vue persistante : {e}")
-    try:
-        bot.add_view(UnsubscribeButton(user_id=0, order_id="", bot=bot)) 
-        Logger.success("Vue persistante 'UnsubscribeButton' ré-enregistrée avec succès.")
-    except Exception as e:
-        Logger.error(f"Échec critique du chargement de la vue persistante 'UnsubscribeButton': {e}")
-        traceback.print_exc()
-
     # --- Application de la présence ---
     try:
         await bot.change_presence(activity=activity) # Utilise l'objet 'activity' défini ci-dessus
@@ -819,6 +1238,7 @@ async def on_ready():
 
     # --- DÉMARRAGE DES TÂCHES PROGRAMMÉES ---
     if not scheduled_check.is_running(): scheduled_check.start()
+    if not catalog_events_watcher.is_running(): catalog_events_watcher.start()
     if not post_weekly_ranking.is_running(): post_weekly_ranking.start()
     if not scheduled_selection.is_running(): scheduled_selection.start()
     if not daily_role_sync.is_running(): daily_role_sync.start()
@@ -893,11 +1313,28 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
         Logger.error(f"CRITICAL: Impossible d'envoyer un message d'erreur à l'utilisateur: {e}")
 
 
+def warm_start_catalog(bot_instance: commands.Bot):
+    """
+    Charge de façon synchrone le dernier instantané disque avant la connexion à Discord :
+    les menus répondent dès le premier événement, en attendant la synchro de fond.
+    """
+    site_data = load_catalog_snapshot()
+    if site_data.get('products'):
+        set_catalog(bot_instance, site_data, stale=True)
+        Logger.success(f"Démarrage à chaud : {len(site_data['products'])} produits servis depuis l'instantané du {datetime.fromtimestamp(site_data.get('timestamp', 0), paris_tz).strftime('%d/%m %H:%M')}.")
+    else:
+        Logger.warning("Aucun instantané du catalogue sur disque : le menu attendra la première synchro.")
+
 async def main():
+    warm_start_catalog(bot)
     async with bot:
         await bot.load_extension("commands")
         await bot.load_extension("dev_stats_cog")
-        await bot.start(TOKEN)
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await close_shopify_client()
+            await bot_db.close()
 
 if __name__ == "__main__":
     # Ce bloc n'est plus le point d'entrée principal, mais peut servir pour des tests directs.
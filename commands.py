@@ -8,6 +8,7 @@ from typing import List, Optional, Union
 from discord.app_commands import Choice
 from profil_image_generator import create_profile_card
 from shared_utils import *
+from bot_database import bot_db
 from graph_generator import create_radar_chart
 import re
 import numpy as np
@@ -288,11 +289,41 @@ class ConfirmOverwriteView(discord.ui.View):
         await interaction.response.edit_message(content="Opération annulée.", view=None)
         self.stop()
 
+class CatalogRenderCache:
+    """
+    Embeds déjà construits pour l'instantané courant du catalogue (fiches produit, pages de promos,
+    liens de téléchargement) : paginer devient un lookup de dictionnaire. Le cache se vide tout seul
+    quand `bot.catalog` est remplacé. Les embeds sont partagés : les copier avant de les modifier.
+    """
+    def __init__(self):
+        self._catalog = None
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, catalog, key, build):
+        if catalog is not self._catalog:
+            self._catalog = catalog
+            self._entries = {}
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            value = self._entries[key] = build()
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+render_cache = CatalogRenderCache()
+
 class PromoPaginatorView(discord.ui.View):
-    def __init__(self, promo_products: List[dict], general_promos: List[str], items_per_page=2): # On affiche 2 produits par page pour plus de clarté
+    def __init__(self, catalog, items_per_page=2): # On affiche 2 produits par page pour plus de clarté
         super().__init__(timeout=180)
-        self.promo_products = promo_products
-        self.general_promos = general_promos
+        self.catalog = catalog
+        self.promo_products = catalog.promo_products
+        self.general_promos = catalog.general_promos
         self.items_per_page = items_per_page
         self.current_page = 0
         self.total_product_pages = max(0, (len(self.promo_products) - 1) // self.items_per_page)
@@ -308,13 +339,17 @@ class PromoPaginatorView(discord.ui.View):
             self.add_item(self.NextButton(disabled=(self.current_page >= self.total_product_pages)))
 
     def create_embed(self) -> discord.Embed:
+        banner_url = config_manager.get_config("contact_info.promo_banner_url")
+        key = ('promos', self.current_page, self.items_per_page, banner_url)
+        return render_cache.get(self.catalog, key, lambda: self._render_page(banner_url))
+
+    def _render_page(self, banner_url: Optional[str]) -> discord.Embed:
         embed = create_styled_embed(
             title="🎁 Promotions & Avantages en Cours",
             description="Toutes les offres actuellement disponibles sur la boutique.",
             color=discord.Color.from_rgb(230, 80, 150)
         )
 
-        banner_url = config_manager.get_config("contact_info.promo_banner_url")
         if banner_url:
             embed.set_image(url=banner_url)
 
@@ -394,22 +429,62 @@ class PromoPaginatorView(discord.ui.View):
             if self.view.current_page < self.view.total_product_pages: self.view.current_page += 1
             await self.view.update_message(interaction)
             
+class RatingsWindow:
+    """
+    Fenêtre de notes autour de la page affichée, lue par curseur (rating_timestamp, id) des plus récentes aux plus anciennes.
+    `fetch(before, after, limit)` est une méthode *_page de bot_db ; au plus 2 * chunk_size notes restent en mémoire.
+    """
+    def __init__(self, fetch, chunk_size=10):
+        self.fetch = fetch
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.offset = 0  # Position de rows[0] dans la liste complète
+
+    @staticmethod
+    def _key(row) -> tuple:
+        return (row['rating_timestamp'], row['id'])
+
+    async def get(self, index: int) -> Optional[dict]:
+        if not self.rows:
+            self.rows, self.offset = await self.fetch(None, None, self.chunk_size), 0
+        while self.rows and index >= self.offset + len(self.rows):
+            older = await self.fetch(self._key(self.rows[-1]), None, self.chunk_size)
+            if not older: return None
+            kept = self.rows[-self.chunk_size:]
+            self.offset += len(self.rows) - len(kept)
+            self.rows = kept + older
+        while self.rows and index < self.offset:
+            newer = await self.fetch(None, self._key(self.rows[0]), self.chunk_size)
+            if not newer: return None
+            self.offset -= len(newer)
+            self.rows = newer + self.rows[:self.chunk_size]
+        if not self.rows or index < self.offset: return None
+        return self.rows[index - self.offset]
+
 class RatingsPaginatorView(discord.ui.View):
-    def __init__(self, target_user, user_ratings, community_ratings_map, items_per_page=1):
+    def __init__(self, target_user, total_ratings, product_map, items_per_page=1):
         super().__init__(timeout=180)
         self.target_user = target_user
-        self.user_ratings = user_ratings
-        self.community_ratings_map = community_ratings_map  # On stocke les notes de la communauté
         self.items_per_page = items_per_page
         self.current_page = 0
-        self.total_pages = (len(self.user_ratings) - 1) // self.items_per_page
+        self.total_ratings = total_ratings
+        self.total_pages = (total_ratings - 1) // self.items_per_page
+        self.rating = None
+        # Seule la note affichée et ses voisines sont chargées, avec la moyenne communautaire du produit
+        self.window = RatingsWindow(lambda before, after, limit: bot_db.get_user_ratings_page(target_user.id, before, after, limit))
         
-        try:
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f: self.product_map = {p['name'].strip().lower(): p for p in json.load(f).get('products', [])}
-        except: self.product_map = {}
+        self.product_map = product_map  # Index nom normalisé -> produit (ProductCatalog.by_name)
         
         self.update_buttons()
 
+    async def load_page(self):
+        self.rating = await self.window.get(self.current_page)
+        if self.rating is None and self.current_page > 0:
+            # Des notes ont été supprimées depuis l'ouverture : on revient à la dernière disponible
+            self.total_pages = self.current_page - 1
+            self.current_page -= 1
+            self.rating = await self.window.get(self.current_page)
+
     def update_buttons(self):
         self.clear_items()
         if self.total_pages > 0:
@@ -417,14 +492,14 @@ class RatingsPaginatorView(discord.ui.View):
             self.add_item(self.NextButton(disabled=self.current_page >= self.total_pages))
     
     def create_embed(self) -> discord.Embed:
-        if not self.user_ratings: return discord.Embed(description="Aucune note à afficher.")
+        if not self.rating: return discord.Embed(description="Aucune note à afficher.")
         
-        rating = self.user_ratings[self.current_page]
+        rating = self.rating
         p_name = rating['product_name']
         p_details = self.product_map.get(p_name.strip().lower(), {})
         
-        # Récupérer la note moyenne de la communauté
-        community_score = self.community_ratings_map.get(p_name.strip().lower())
+        # Note moyenne de la communauté, jointe à la note par la requête de page
+        community_score = rating.get('community_avg')
         community_score_str = f"**{community_score:.2f} / 10**" if community_score else "N/A"
         
         # Calculer la note personnelle de l'utilisateur
@@ -449,11 +524,12 @@ class RatingsPaginatorView(discord.ui.View):
             embed.add_field(name="💬 Votre Commentaire", value=f"```{rating['comment']}```", inline=False)
         
         if self.total_pages >= 0: 
-            embed.set_footer(text=f"Avis {self.current_page + 1} sur {len(self.user_ratings)}")
+            embed.set_footer(text=f"Avis {self.current_page + 1} sur {self.total_pages + 1}")
             
         return embed
 
     async def update_message(self, i: discord.Interaction):
+        await self.load_page()
         self.update_buttons()
         await i.response.edit_message(embed=self.create_embed(), view=self)
 
@@ -470,10 +546,10 @@ class RatingsPaginatorView(discord.ui.View):
             await self.view.update_message(i)
 
 class ProfileView(discord.ui.View):
-    def __init__(self, target_user, user_stats, user_ratings, shopify_data, can_reset, bot):
+    def __init__(self, target_user, user_stats, shopify_data, can_reset, bot):
         super().__init__(timeout=300)
-        self.target_user, self.user_stats, self.user_ratings, self.shopify_data, self.can_reset, self.bot = target_user, user_stats, user_ratings, shopify_data, can_reset, bot
-        if not self.user_ratings: self.show_notes_button.disabled = True
+        self.target_user, self.user_stats, self.shopify_data, self.can_reset, self.bot = target_user, user_stats, shopify_data, can_reset, bot
+        if not self.user_stats.get('count'): self.show_notes_button.disabled = True
         if not self.can_reset: self.remove_item(self.reset_button)
 
     @discord.ui.button(label="Voir les notes en détail", style=discord.ButtonStyle.secondary, emoji="📝")
@@ -481,27 +557,9 @@ class ProfileView(discord.ui.View):
         # On lance le chargement en attendant la requête DB
         await i.response.defer(ephemeral=True, thinking=True)
         
-        # Fonction pour récupérer toutes les notes moyennes de la communauté en une seule requête
-        def _fetch_community_ratings_sync():
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT 
-                    LOWER(TRIM(product_name)), 
-                    AVG((COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0)
-                FROM ratings 
-                GROUP BY LOWER(TRIM(product_name))
-            """)
-            # On transforme le résultat en un dictionnaire pour un accès facile
-            ratings_map = {name: score for name, score in cursor.fetchall()}
-            conn.close()
-            return ratings_map
-
-        # On exécute la fonction dans un thread séparé
-        community_ratings = await asyncio.to_thread(_fetch_community_ratings_sync)
-        
-        # On passe le dictionnaire des notes au paginateur
-        paginator = RatingsPaginatorView(self.target_user, self.user_ratings, community_ratings)
+        # Le paginateur ne lit que la première note (et quelques suivantes) au lieu de toutes
+        paginator = RatingsPaginatorView(self.target_user, self.user_stats.get('count', 0), self.bot.catalog.by_name)
+        await paginator.load_page()
         await i.followup.send(embed=paginator.create_embed(), view=paginator, ephemeral=True)
 
     @discord.ui.button(label="Afficher la Carte de Profil", style=discord.ButtonStyle.secondary, emoji="🖼️")
@@ -607,7 +665,7 @@ class DebugView(discord.ui.View):
     async def force_publish(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer(thinking=True, ephemeral=True)
         try:
-            await self.bot.check_for_updates(self.bot, force_publish=True)
+            await self.bot.check_for_updates(self.bot, force_publish=True, full_sync=True)
             await interaction.followup.send("✅ Tâche de publication du menu lancée.", ephemeral=True)
         except Exception as e: await interaction.followup.send(f"❌ **Échec :**\n```py\n{e}\n```", ephemeral=True)
     
@@ -669,7 +727,7 @@ class DebugView(discord.ui.View):
     # --- Ligne 3 : Actions de Maintenance ---
     @discord.ui.button(label="🗑️ Vider Cache", style=discord.ButtonStyle.secondary, row=3)
     async def clear_cache(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.bot.product_cache = {}
+        self.bot.set_catalog(self.bot, {})
         await interaction.response.send_message("✅ Cache de produits en mémoire vidé.", ephemeral=True)
     
     @discord.ui.button(label="📁 Exporter DB", style=discord.ButtonStyle.secondary, row=3)
@@ -689,13 +747,13 @@ class MenuView(discord.ui.View):
 
     async def _load_and_categorize_products(self, interaction: discord.Interaction) -> dict:
         try:
-            # Cette ligne fonctionnera maintenant
-            site_data = interaction.client.product_cache
-            if not site_data or 'products' not in site_data:
+            # Les catégories sont précalculées une fois par synchro dans le ProductCatalog.
+            catalog = interaction.client.catalog
+            if not catalog:
                 raise ValueError("Les données des produits sont actuellement indisponibles.")
-            return categorize_products(site_data['products'])
-        except (FileNotFoundError, json.JSONDecodeError):
-            raise ValueError("Le menu est en cours de construction, veuillez réessayer.")
+            return catalog.by_category
+        except ValueError:
+            raise
         except Exception as e:
             Logger.error(f"Erreur en chargeant les produits pour MenuView: {e}")
             raise ValueError("Une erreur est survenue lors de la récupération du menu.")
@@ -708,8 +766,7 @@ class MenuView(discord.ui.View):
             if not products_for_category:
                 await interaction.followup.send(f"Désolé, aucun produit de type '{category_name}' n'est disponible.", ephemeral=True)
                 return
-            view = ProductView(products_for_category, category=category_key)
-            embed = view.create_embed()
+            embed, view = await build_product_page(interaction.client.catalog, category_key, 0)
             await interaction.followup.send(embed=embed, view=view, ephemeral=True)
         except ValueError as e:
             await interaction.followup.send(str(e), ephemeral=True)
@@ -735,15 +792,25 @@ class MenuView(discord.ui.View):
         await self._handle_button_click(interaction, "accessoire", "Accessoires")
 
 class ProductReviewsPaginatorView(discord.ui.View):
-    def __init__(self, reviews: list, product_name: str, product_image_url: Optional[str]):
+    def __init__(self, product_name: str, product_image_url: Optional[str], total_reviews: int):
         super().__init__(timeout=180)
-        self.reviews = reviews
         self.product_name = product_name
         self.product_image_url = product_image_url
         self.current_page = 0
-        self.total_pages = len(self.reviews)
+        self.total_pages = total_reviews
+        self.review = None
+        # Les avis sont lus par petits blocs autour de la page affichée, jamais tous d'un coup
+        self.window = RatingsWindow(lambda before, after, limit: bot_db.get_product_reviews_page(product_name, before, after, limit))
         self.update_buttons()
 
+    async def load_page(self):
+        self.review = await self.window.get(self.current_page)
+        if self.review is None and self.current_page > 0:
+            # Des avis ont été supprimés depuis l'ouverture : on revient au dernier disponible
+            self.total_pages = self.current_page
+            self.current_page -= 1
+            self.review = await self.window.get(self.current_page)
+
     def update_buttons(self):
         self.clear_items()
         if self.total_pages > 1:
@@ -751,10 +818,10 @@ class ProductReviewsPaginatorView(discord.ui.View):
             self.add_item(self.NextButton(disabled=(self.current_page >= self.total_pages - 1)))
 
     def create_embed(self) -> discord.Embed:
-        if not self.reviews:
+        if not self.review:
             return create_styled_embed("Avis Clients", "Il n'y a encore aucun avis pour ce produit.")
 
-        review = self.reviews[self.current_page]
+        review = self.review
         user_name = review.get('user_name', 'Utilisateur Anonyme').split('#')[0]
         rating_date = datetime.fromisoformat(review['rating_timestamp']).strftime('%d/%m/%Y')
         
@@ -783,6 +850,7 @@ class ProductReviewsPaginatorView(discord.ui.View):
         return embed
 
     async def update_message(self, interaction: discord.Interaction):
+        await self.load_page()
         self.update_buttons()
         await interaction.response.edit_message(embed=self.create_embed(), view=self)
 
@@ -799,210 +867,166 @@ class ProductReviewsPaginatorView(discord.ui.View):
             await self.view.update_message(interaction)
 
 
-# Dans commands.py, remplacez l'ancienne classe ProductView par celle-ci
-
-class ProductView(discord.ui.View):
-    def __init__(self, products: List[dict], category: str = None):
-        super().__init__(timeout=300)
-        self.products = products
-        self.current_index = 0
-        self.category = category
-        
-        # [AMÉLIORATION] On pré-charge le nombre d'avis pour tous les produits de la vue en une seule fois
-        self.review_counts = self._get_review_counts()
-        
-        # On ajoute les boutons fixes
-        self.add_item(self.PrevButton())
-        self.add_item(self.NextButton())
-        self.add_item(self.ShowReviewsButton())
-        self.add_item(self.ShowGraphButton())
-        
-        # On met à jour l'état de tous les boutons
-        self.update_ui_elements()
-
-    def _get_review_counts(self) -> dict:
-        """[CORRIGÉ] Récupère le nombre total de notes ET le nombre de commentaires en une seule requête."""
-        product_names = [p['name'] for p in self.products]
-        if not product_names: return {}
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        placeholders = ','.join('?' for _ in product_names)
-        
-        # Cette requête récupère les deux comptes nécessaires
-        query = f"""
-            SELECT 
-                product_name, 
-                COUNT(id) as total_ratings,
-                COUNT(CASE WHEN comment IS NOT NULL AND TRIM(comment) != '' THEN 1 END) as comment_count
-            FROM ratings 
-            WHERE product_name IN ({placeholders})
-            GROUP BY product_name
-        """
-        cursor.execute(query, product_names)
-        
-        # On stocke les deux comptes dans un dictionnaire
-        counts = {name: {"total": total, "comments": comments} for name, total, comments in cursor.fetchall()}
-        conn.close()
-        return counts
+# --- Navigation produits sans état ---
+# Tout l'état d'une page (catégorie, index, version de la liste) est dans le custom_id des boutons :
+# aucune vue n'est gardée en mémoire par menu ouvert et les boutons survivent aux redémarrages.
+
+def get_category_emoji(category: Optional[str]) -> str:
+    if category == "weed": return "🍃"
+    if category == "hash": return "🍫"
+    if category == "box": return "📦"
+    if category == "accessoire": return "🛠️"
+    return ""
+
+def create_product_embed(product: dict, category: Optional[str], index: int, total: int) -> discord.Embed:
+    emoji = get_category_emoji(category)
+    embed_color = discord.Color.dark_red() if product.get('is_sold_out') else discord.Color.from_rgb(255, 204, 0)
+    title = f"{emoji} **{product.get('name', 'Produit inconnu')}**"
+    embed = discord.Embed(title=title, url=product.get('product_url', CATALOG_URL), color=embed_color)
+    if product.get('image'):
+        embed.set_thumbnail(url=product['image'])
     
-    def update_ui_elements(self):
-        """Met à jour l'état de tous les boutons en fonction du produit actuel."""
-        if not self.products: return
-        product = self.products[self.current_index]
-        product_name = product.get('name', '')
-
-        # Navigation
-        prev_button = discord.utils.get(self.children, custom_id="prev_product")
-        next_button = discord.utils.get(self.children, custom_id="next_product")
-        if prev_button: prev_button.disabled = self.current_index == 0
-        if next_button: next_button.disabled = self.current_index >= len(self.products) - 1
-
-        # Téléchargements (Analyse PDF, etc.)
-        for item in [c for c in self.children if hasattr(c, "is_download_button")]: self.remove_item(item)
+    description = product.get('detailed_description', "Aucune description.")
+    if description:
+        embed.add_field(name="Description", value=description[:1024], inline=False)
+    
+    price_text = ""
+    if product.get('is_sold_out'): price_text = "❌ **ÉPUISÉ**"
+    elif product.get('is_promo'): price_text = f"🏷️ **{product.get('price')}** ~~{product.get('original_price')}~~"
+    else: price_text = f"💰 **{product.get('price', 'N/A')}**"
+    embed.add_field(name="Prix", value=price_text, inline=False)
+    
+    if product.get('category') == 'box' and product.get('box_contents'):
+        content_str = ""
+        for section, items in product['box_contents'].items():
+            if items:
+                if section != "Général": content_str += f"**{section}**\n"
+                content_str += "\n".join([f"• {item}" for item in items]) + "\n\n"
+        embed.add_field(name="📦 Contenu de la Box", value=content_str.strip(), inline=False)
+    else:
         stats = product.get('stats', {})
-        for key, value in stats.items():
-            if isinstance(value, str) and ("lab" in key.lower() or "terpen" in key.lower()) and value.startswith("http"):
-                label = "Télécharger Lab Test" if "lab" in key.lower() else "Télécharger Terpènes"
-                emoji = "🧪" if "lab" in key.lower() else "🌿"
-                self.add_item(self.DownloadButton(label, value, emoji))
-
-        # [CORRIGÉ] On récupère le dictionnaire des comptes pour le produit actuel
-        counts_for_product = self.review_counts.get(product_name, {"total": 0, "comments": 0})
-
-        # Bouton Avis
-        reviews_button = discord.utils.get(self.children, custom_id="show_reviews_button")
-        if reviews_button:
-            comment_count = counts_for_product.get('comments', 0)
-            reviews_button.label = f"💬 Avis Clients ({comment_count})"
-            reviews_button.disabled = (comment_count == 0)
-
-        # Bouton Graphique
-        graph_button = discord.utils.get(self.children, custom_id="show_graph_button")
-        if graph_button:
-            total_rating_count = counts_for_product.get('total', 0)
-            graph_button.disabled = (total_rating_count == 0)
-
-    def get_category_emoji(self):
-        if self.category == "weed": return "🍃"
-        if self.category == "hash": return "🍫"
-        if self.category == "box": return "📦"
-        if self.category == "accessoire": return "🛠️"
-        return ""
+        char_lines = []
+        if 'Effet' in stats: char_lines.append(f"🧠 **Effet :** `{stats['Effet']}`")
+        if 'Goût' in stats: char_lines.append(f"👅 **Goût :** `{stats['Goût']}`")
+        if 'Cbd' in stats: char_lines.append(f"🌿 **CBD :** `{stats['Cbd']}`")
+        if char_lines:
+            embed.add_field(name="Caractéristiques", value="\n".join(char_lines), inline=False)
+
+    embed.add_field(name="\u200b", value=f"**🌐 [Voir la fiche produit sur le site]({product.get('product_url', CATALOG_URL)})**", inline=False)
+    embed.set_footer(text=f"Produit {index + 1} sur {total}")
+    return embed
+
+def _download_links(product: dict) -> tuple:
+    """(label, url, emoji) des analyses (PDF labo, terpènes) ; les boutons-liens n'ont pas de callback."""
+    links = []
+    for key, value in product.get('stats', {}).items():
+        if isinstance(value, str) and ("lab" in key.lower() or "terpen" in key.lower()) and value.startswith("http"):
+            label = "Télécharger Lab Test" if "lab" in key.lower() else "Télécharger Terpènes"
+            emoji = "🧪" if "lab" in key.lower() else "🌿"
+            links.append((label, value, emoji))
+    return tuple(links)
+
+async def build_product_page(catalog, category: str, index: int, outdated: bool = False):
+    """Embed et vue de la page `index` de `category` ; la vue ne contient que des boutons dynamiques et des liens."""
+    products = catalog.by_category.get(category, ())
+    index = max(0, min(index, len(products) - 1))
+    product = products[index]
+    version = catalog.category_versions.get(category, "0")
+    counts = await bot_db.get_product_review_counts(product.get('name', ''))
+
+    embed, links = render_cache.get(catalog, ('product', category, index),
+                                    lambda: (create_product_embed(product, category, index, len(products)), _download_links(product)))
+    if outdated:
+        embed = embed.copy()
+        embed.set_footer(text=f"{embed.footer.text} • Catalogue mis à jour depuis l'ouverture du menu")
+
+    view = discord.ui.View(timeout=None)
+    view.add_item(ProductBrowserButton("prev", category, max(index - 1, 0), version,
+                                       label="⬅️ Précédent", style=discord.ButtonStyle.secondary, row=0, disabled=index == 0))
+    view.add_item(ProductBrowserButton("next", category, min(index + 1, len(products) - 1), version,
+                                       label="Suivant ➡️", style=discord.ButtonStyle.secondary, row=0, disabled=index >= len(products) - 1))
+    view.add_item(ProductBrowserButton("reviews", category, index, version,
+                                       label=f"💬 Avis Clients ({counts['comments']})", style=discord.ButtonStyle.primary, row=1, disabled=counts['comments'] == 0))
+    view.add_item(ProductBrowserButton("graph", category, index, version,
+                                       label="📊 Afficher le Graphique", style=discord.ButtonStyle.primary, row=1, disabled=counts['total'] == 0))
+    for label, url, emoji in links:
+        view.add_item(discord.ui.Button(label=label, style=discord.ButtonStyle.link, url=url, emoji=emoji))
+    return embed, view
+
+class ProductBrowserButton(discord.ui.DynamicItem[discord.ui.Button], template=r'browse:(?P<action>prev|next|reviews|graph):(?P<category>[a-z]+):(?P<index>[0-9]+):(?P<version>[0-9a-f]+)'):
+    """Bouton persistant de la fiche produit, reconstruit à partir de son custom_id à chaque clic."""
+    def __init__(self, action: str, category: str, index: int, version: str, **button_kwargs):
+        super().__init__(discord.ui.Button(custom_id=f"browse:{action}:{category}:{index}:{version}", **button_kwargs))
+        self.action = action
+        self.category = category
+        self.index = index
+        self.version = version
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'], match['category'], int(match['index']), match['version'])
+
+    async def callback(self, interaction: discord.Interaction):
+        catalog = interaction.client.catalog
+        products = catalog.by_category.get(self.category, ())
+        if not products:
+            await interaction.response.send_message("Désolé, cette catégorie n'est plus disponible. Rouvrez le menu.", ephemeral=True)
+            return
+        # Version différente : la liste a changé depuis l'affichage, l'index ne désigne plus forcément le même produit.
+        outdated = self.version != catalog.category_versions.get(self.category)
 
-    def create_embed(self) -> discord.Embed:
-        product = self.products[self.current_index]
-        emoji = self.get_category_emoji()
-        embed_color = discord.Color.dark_red() if product.get('is_sold_out') else discord.Color.from_rgb(255, 204, 0)
-        title = f"{emoji} **{product.get('name', 'Produit inconnu')}**"
-        embed = discord.Embed(title=title, url=product.get('product_url', CATALOG_URL), color=embed_color)
-        if product.get('image'):
-            embed.set_thumbnail(url=product['image'])
-        
-        description = product.get('detailed_description', "Aucune description.")
-        if description:
-            embed.add_field(name="Description", value=description[:1024], inline=False)
-        
-        price_text = ""
-        if product.get('is_sold_out'): price_text = "❌ **ÉPUISÉ**"
-        elif product.get('is_promo'): price_text = f"🏷️ **{product.get('price')}** ~~{product.get('original_price')}~~"
-        else: price_text = f"💰 **{product.get('price', 'N/A')}**"
-        embed.add_field(name="Prix", value=price_text, inline=False)
-        
-        if product.get('category') == 'box' and product.get('box_contents'):
-            content_str = ""
-            for section, items in product['box_contents'].items():
-                if items:
-                    if section != "Général": content_str += f"**{section}**\n"
-                    content_str += "\n".join([f"• {item}" for item in items]) + "\n\n"
-            embed.add_field(name="📦 Contenu de la Box", value=content_str.strip(), inline=False)
-        else:
-            stats = product.get('stats', {})
-            char_lines = []
-            if 'Effet' in stats: char_lines.append(f"🧠 **Effet :** `{stats['Effet']}`")
-            if 'Goût' in stats: char_lines.append(f"👅 **Goût :** `{stats['Goût']}`")
-            if 'Cbd' in stats: char_lines.append(f"🌿 **CBD :** `{stats['Cbd']}`")
-            if char_lines:
-                embed.add_field(name="Caractéristiques", value="\n".join(char_lines), inline=False)
-
-        embed.add_field(name="\u200b", value=f"**🌐 [Voir la fiche produit sur le site]({product.get('product_url', CATALOG_URL)})**", inline=False)
-        embed.set_footer(text=f"Produit {self.current_index + 1} sur {len(self.products)}")
-        return embed
-        
-    async def update_message(self, interaction: discord.Interaction):
-        self.update_ui_elements()
-        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+        if self.action in ("prev", "next"):
+            embed, view = await build_product_page(catalog, self.category, self.index, outdated=outdated)
+            await interaction.response.edit_message(embed=embed, view=view)
+            return
 
-    # --- Les boutons ---
-    # (Les classes de boutons PrevButton, NextButton, ShowReviewsButton, ShowGraphButton et DownloadButton ne changent pas et restent les mêmes que dans votre fichier)
-    class PrevButton(discord.ui.Button):
-        def __init__(self): super().__init__(label="⬅️ Précédent", style=discord.ButtonStyle.secondary, row=0, custom_id="prev_product")
-        async def callback(self, interaction: discord.Interaction):
-            if self.view.current_index > 0: self.view.current_index -= 1
-            await self.view.update_message(interaction)
+        if outdated or self.index >= len(products):
+            embed, view = await build_product_page(catalog, self.category, self.index, outdated=True)
+            await interaction.response.edit_message(embed=embed, view=view)
+            await interaction.followup.send("Le catalogue a été mis à jour : vérifiez le produit affiché puis réessayez.", ephemeral=True)
+            return
 
-    class NextButton(discord.ui.Button):
-        def __init__(self): super().__init__(label="Suivant ➡️", style=discord.ButtonStyle.secondary, row=0, custom_id="next_product")
-        async def callback(self, interaction: discord.Interaction):
-            if self.view.current_index < len(self.view.products) - 1: self.view.current_index += 1
-            await self.view.update_message(interaction)
+        product = products[self.index]
+        if self.action == "reviews":
+            await self._show_reviews(interaction, product)
+        else:
+            await self._show_graph(interaction, product)
 
-    class ShowReviewsButton(discord.ui.Button):
-        def __init__(self): super().__init__(label="💬 Avis Clients", style=discord.ButtonStyle.primary, row=1, custom_id="show_reviews_button")
-        async def callback(self, interaction: discord.Interaction):
-            await interaction.response.defer(ephemeral=True, thinking=True)
-            product = self.view.products[self.view.current_index]
-            product_name, product_image = product.get('name'), product.get('image')
-            def _fetch_reviews_sync(p_name):
-                conn = get_db_connection()
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM ratings WHERE product_name = ? AND comment IS NOT NULL AND TRIM(comment) != '' ORDER BY rating_timestamp DESC", (p_name,))
-                results = [dict(row) for row in cursor.fetchall()]
-                conn.close()
-                return results
-            reviews = await asyncio.to_thread(_fetch_reviews_sync, product_name)
-            if not reviews:
-                await interaction.followup.send("Il n'y a pas encore d'avis avec des commentaires pour ce produit.", ephemeral=True)
-                return
-            paginator = ProductReviewsPaginatorView(reviews, product_name, product_image)
-            await interaction.followup.send(embed=paginator.create_embed(), view=paginator, ephemeral=True)
+    async def _show_reviews(self, interaction: discord.Interaction, product: dict):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        product_name, product_image = product.get('name'), product.get('image')
+        counts = await bot_db.get_product_review_counts(product_name)
+        if not counts['comments']:
+            await interaction.followup.send("Il n'y a pas encore d'avis avec des commentaires pour ce produit.", ephemeral=True)
+            return
+        paginator = ProductReviewsPaginatorView(product_name, product_image, counts['comments'])
+        await paginator.load_page()
+        await interaction.followup.send(embed=paginator.create_embed(), view=paginator, ephemeral=True)
 
-    class ShowGraphButton(discord.ui.Button):
-        def __init__(self):
-            super().__init__(label="📊 Afficher le Graphique", style=discord.ButtonStyle.primary, row=1, custom_id="show_graph_button")
-            
-        async def callback(self, interaction: discord.Interaction):
-            await interaction.response.defer(ephemeral=True, thinking=True)
-            
-            product = self.view.products[self.view.current_index]
-            product_name = product.get('name')
-            chart_path = None
+    async def _show_graph(self, interaction: discord.Interaction, product: dict):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        product_name = product.get('name')
+        chart_path = None
 
-            try:
-                chart_path = await asyncio.to_thread(create_radar_chart, product_name)
-                if chart_path:
-                    file = discord.File(chart_path, filename="radar_chart.png")
-                    embed = discord.Embed(
-                        title=f"Graphique Radar pour {product_name}",
-                        description="Moyenne des notes de la communauté.",
-                        color=discord.Color.green()
-                    ).set_image(url="attachment://radar_chart.png")
-                    await interaction.followup.send(embed=embed, file=file, ephemeral=True)
-                else:
-                    await interaction.followup.send("Impossible de générer le graphique (pas assez de données ?).", ephemeral=True)
-            except Exception as e:
-                Logger.error(f"Échec de la génération du graphique pour '{product_name}': {e}")
-                traceback.print_exc()
-                await interaction.followup.send("❌ Oups ! Une erreur est survenue lors de la création du graphique.", ephemeral=True)
-            finally:
-                if chart_path and os.path.exists(chart_path):
-                    os.remove(chart_path)
-
-    class DownloadButton(discord.ui.Button):
-        def __init__(self, label, url, emoji=None):
-            super().__init__(label=label, style=discord.ButtonStyle.link, url=url, emoji=emoji)
-            self.is_download_button = True
+        try:
+            chart_path = await asyncio.to_thread(create_radar_chart, product_name)
+            if chart_path:
+                file = discord.File(chart_path, filename="radar_chart.png")
+                embed = discord.Embed(
+                    title=f"Graphique Radar pour {product_name}",
+                    description="Moyenne des notes de la communauté.",
+                    color=discord.Color.green()
+                ).set_image(url="attachment://radar_chart.png")
+                await interaction.followup.send(embed=embed, file=file, ephemeral=True)
+            else:
+                await interaction.followup.send("Impossible de générer le graphique (pas assez de données ?).", ephemeral=True)
+        except Exception as e:
+            Logger.error(f"Échec de la génération du graphique pour '{product_name}': {e}")
+            traceback.print_exc()
+            await interaction.followup.send("❌ Oups ! Une erreur est survenue lors de la création du graphique.", ephemeral=True)
+        finally:
+            if chart_path and os.path.exists(chart_path):
+                os.remove(chart_path)
 
 class CommentModal(discord.ui.Modal, title="Ajouter un commentaire"):
     def __init__(self, product_name: str, user: discord.User):
@@ -1085,18 +1109,7 @@ class NotationProductSelectView(discord.ui.View):
                 # Pas besoin de defer ici, la recherche DB est rapide
                 # await interaction.response.defer(thinking=True, ephemeral=True)
 
-                def _fetch_existing_rating_sync(user_id, product_name):
-                    conn = get_db_connection()
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT * FROM ratings WHERE user_id = ? AND product_name = ?", (user_id, product_name))
-                    row = cursor.fetchone()
-                    conn.close()
-                    return dict(row) if row else None
-
-                existing_rating = await asyncio.to_thread(
-                    _fetch_existing_rating_sync, interaction.user.id, full_product_name
-                )
+                existing_rating = await bot_db.get_user_rating(interaction.user.id, full_product_name)
                 
                 if existing_rating:
                     # Affiche la vue de confirmation
@@ -1193,18 +1206,7 @@ async def callback(self, interaction: discord.Interaction):
                 # On informe l'utilisateur que la recherche est en cours
                 await interaction.response.defer(thinking=True, ephemeral=True)
 
-                def _fetch_existing_rating_sync(user_id, product_name):
-                    conn = get_db_connection()
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT * FROM ratings WHERE user_id = ? AND product_name = ?", (user_id, product_name))
-                    row = cursor.fetchone()
-                    conn.close()
-                    return dict(row) if row else None
-
-                existing_rating = await asyncio.to_thread(
-                    _fetch_existing_rating_sync, interaction.user.id, full_product_name
-                )
+                existing_rating = await bot_db.get_user_rating(interaction.user.id, full_product_name)
                 
                 if existing_rating:
                     # Une note existe, on affiche la confirmation
@@ -1244,25 +1246,34 @@ async def callback(self, interaction: discord.Interaction):
                         pass # Si même le followup échoue, on ne peut plus rien faire
 
 class TopRatersPaginatorView(discord.ui.View):
-    def __init__(self, top_raters, guild, items_per_page=5):
+    """
+    Classement des noteurs chargé page par page : seule la page affichée est lue en base.
+    _page_cursors[i] est la clé keyset du dernier membre de la page i - 1 (None pour la première page).
+    """
+    def __init__(self, guild, total_raters, items_per_page=5):
         super().__init__(timeout=180)
-        self.top_raters = top_raters
         self.guild = guild
         self.items_per_page = items_per_page
         self.current_page = 0
-        self.total_pages = max(0, (len(self.top_raters) - 1) // self.items_per_page)
+        self.total_pages = max(0, (total_raters - 1) // self.items_per_page)
+        self.page_raters = []
+        self._page_cursors = [None]
         self.update_buttons()
-        
+
+    async def load_page(self):
+        self.page_raters = await bot_db.get_top_raters_page(self._page_cursors[self.current_page], self.items_per_page)
+        if self.page_raters and len(self._page_cursors) == self.current_page + 1:
+            self._page_cursors.append(self.page_raters[-1]['cursor'])
+
     def update_buttons(self):
         self.clear_items()
         if self.total_pages > 0:
             self.add_item(self.PrevButton(disabled=(self.current_page == 0)))
-            self.add_item(self.NextButton(disabled=(self.current_page >= self.total_pages)))
+            self.add_item(self.NextButton(disabled=(self.current_page >= self.total_pages or len(self.page_raters) < self.items_per_page)))
             
     def create_embed_for_page(self):
         start_index = self.current_page * self.items_per_page
-        end_index = start_index + self.items_per_page
-        page_raters = self.top_raters[start_index:end_index]
+        page_raters = self.page_raters
         
         embed = create_styled_embed(
             title="🏆 Top des Noteurs",
@@ -1318,6 +1329,7 @@ class TopRatersPaginatorView(discord.ui.View):
         return embed
 
     async def update_message(self, interaction: discord.Interaction):
+        await self.load_page()
         self.update_buttons()
         await interaction.response.edit_message(embed=self.create_embed_for_page(), view=self)
 
@@ -1510,9 +1522,7 @@ class ConfirmResetNotesView(discord.ui.View):
     def __init__(self, user, bot): super().__init__(timeout=60); self.user=user; self.bot=bot
     @discord.ui.button(label="Confirmer", style=discord.ButtonStyle.danger)
     async def confirm(self, i: discord.Interaction, b: discord.ui.Button):
-        def _del(uid):
-            conn = get_db_connection(); c=conn.cursor(); c.execute("DELETE FROM ratings WHERE user_id=?",(uid,)); conn.commit(); conn.close()
-        await asyncio.to_thread(_del, self.user.id)
+        await bot_db.delete_user_ratings(self.user.id)
         await i.response.edit_message(content=f"✅ Notes de {self.user.mention} supprimées.", view=None)
     @discord.ui.button(label="Annuler", style=discord.ButtonStyle.secondary)
     async def cancel(self, i: discord.Interaction, b: discord.ui.Button): await i.response.edit_message(content="Opération annulée.", view=None)
@@ -1611,65 +1621,19 @@ class SlashCommands(commands.Cog):
         self.bot = bot
     
     async def product_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
-        products = self.bot.product_cache.get('products', [])
-        
-        if not products or not isinstance(products[0], dict):
-            return []
-
-        # [MODIFICATION] Liste de mots-clés à exclure SPÉCIFIQUEMENT pour la comparaison
-        # On ne veut pas comparer des accessoires.
-        exclude_keywords = ["briquet", "feuille", "papier", "grinder", "accessoire", "telegram", "instagram", "tiktok"]
-
-        choices = [
-            prod['name'] for prod in products 
-            if 'name' in prod 
-            # On vérifie que le nom du produit ne contient aucun mot-clé d'exclusion
-            and not any(keyword in prod['name'].lower() for keyword in exclude_keywords)
-            # Puis on filtre par la saisie de l'utilisateur
-            and current.lower() in prod['name'].lower()
-        ]
-        
+        # Index préfixes/trigrammes reconstruit à chaque synchro : insensible aux accents, tolérant
+        # aux petites fautes de frappe, produits les plus notés en premier.
         return [
-            app_commands.Choice(name=choice, value=choice)
-            for choice in choices[:25]
+            app_commands.Choice(name=name, value=name)
+            for name in self.bot.product_search.search(current)
         ]
     
     async def generate_dashboard_embed(self, guild: discord.Guild) -> discord.Embed:
         """
         [MODIFIÉ] Récupère les statistiques et génère l'embed du dashboard amélioré pour un serveur.
         """
-        one_week_ago_dt = datetime.utcnow() - timedelta(days=7)
-        one_week_ago_iso = one_week_ago_dt.isoformat()
-
-        # 1. Requêtes à la base de données (inchangé)
-        def _fetch_stats_sync():
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            total_ratings = cursor.execute("SELECT COUNT(id) FROM ratings").fetchone()[0]
-            total_linked_accounts = cursor.execute("SELECT COUNT(discord_id) FROM user_links").fetchone()[0]
-            total_raters = cursor.execute("SELECT COUNT(DISTINCT user_id) FROM ratings").fetchone()[0]
-
-            weekly_ratings = cursor.execute("SELECT COUNT(id) FROM ratings WHERE rating_timestamp >= ?", (one_week_ago_iso,)).fetchone()[0]
-            
-            cursor.execute("SELECT user_id, COUNT(id) as count FROM ratings WHERE rating_timestamp >= ? GROUP BY user_id ORDER BY count DESC LIMIT 1", (one_week_ago_iso,))
-            top_rater_row = cursor.fetchone()
-
-            cursor.execute("SELECT product_name, AVG((visual_score+smell_score+touch_score+taste_score+effects_score)/5.0) as avg_score FROM ratings WHERE rating_timestamp >= ? GROUP BY product_name ORDER BY avg_score DESC LIMIT 1", (one_week_ago_iso,))
-            top_product_row = cursor.fetchone()
-            
-            cursor.execute("SELECT product_name, AVG((visual_score+smell_score+touch_score+taste_score+effects_score)/5.0) as avg_score FROM ratings WHERE rating_timestamp >= ? GROUP BY product_name ORDER BY avg_score ASC LIMIT 1", (one_week_ago_iso,))
-            worst_product_row = cursor.fetchone()
-
-            conn.close()
-            return {
-                "total_ratings": total_ratings, "total_linked": total_linked_accounts,
-                "total_raters": total_raters, "weekly_ratings": weekly_ratings,
-                "top_rater": top_rater_row, "top_product": top_product_row,
-                "worst_product": worst_product_row
-            }
-
-        db_stats = await asyncio.to_thread(_fetch_stats_sync)
+        # 1. Requêtes à la base de données (cumuls quotidiens des 7 derniers jours)
+        db_stats = await bot_db.get_dashboard_stats(rollup_start_day(7))
 
         # 2. Appel à l'API Flask (inchangé)
         shop_stats = {}
@@ -1754,15 +1718,7 @@ class SlashCommands(commands.Cog):
             return
 
         # 1. Récupérer les données de l'utilisateur une seule fois
-        def _get_user_ratings_summary(user_id):
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT product_name FROM ratings WHERE user_id = ?", (user_id,))
-            all_rated_products = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            return all_rated_products
-        
-        rated_products = await asyncio.to_thread(_get_user_ratings_summary, member.id)
+        rated_products = await bot_db.get_rated_product_names(member.id)
         total_rating_count = len(rated_products)
         
         # 2. Déterminer les rôles que le membre DEVRAIT avoir
@@ -1826,24 +1782,21 @@ class SlashCommands(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         await log_user_action(interaction, "a demandé le menu interactif (/menu)")
         try:
-            def _read_cache_sync():
-                with open(CACHE_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-            site_data = self.bot.product_cache
-            if not site_data or not (products := site_data.get('products')):
+            catalog = self.bot.catalog
+            if not catalog:
                 await interaction.followup.send("Désolé, le menu n'est pas disponible.", ephemeral=True)
                 return
             
-            promos_list = site_data.get('general_promos', [])
-            general_promos_text = "\n".join([f"• {promo}" for promo in promos_list]) or "Aucune promotion générale en cours."
+            general_promos_text = "\n".join([f"• {promo}" for promo in catalog.general_promos]) or "Aucune promotion générale en cours."
             
-            hash_count, weed_count, box_count, accessoire_count = get_product_counts(products)
+            hash_count, weed_count, box_count, accessoire_count = catalog.counts
             description_text = (f"__**📦 Produits disponibles :**__\n\n"
                               f"**`Fleurs 🍃 :` {weed_count}**\n"
                               f"**`Résines 🍫 :` {hash_count}**\n"
                               f"**`Boxs 📦 :` {box_count}**\n"
                               f"**`Accessoires 🛠️ :` {accessoire_count}**\n\n"
                               f"__**💰 Promotions disponibles :**__\n\n{general_promos_text}\n\n"
-                              f"*(Données mises à jour <t:{int(site_data.get('timestamp'))}:R>)*")
+                              f"*(Données mises à jour <t:{int(catalog.timestamp)}:R>{', actualisation en cours' if catalog.stale else ''})*")
             embed = discord.Embed(title="📢 Nouveautés et Promotions !", url=CATALOG_URL, description=description_text, color=discord.Color.from_rgb(0, 102, 204))
             main_logo_url = config_manager.get_config("contact_info.main_logo_url")
             if main_logo_url: embed.set_thumbnail(url=main_logo_url)
@@ -1921,61 +1874,16 @@ class SlashCommands(commands.Cog):
         await interaction.response.defer(ephemeral=True) 
         await log_user_action(interaction, "a demandé le classement des top noteurs.")
         
-        def _fetch_top_raters_sync():
-            conn = get_db_connection()
-            conn.row_factory = sqlite3.Row # Important pour accéder aux colonnes par leur nom
-            cursor = conn.cursor()
-            
-            # --- NOUVELLE REQUÊTE SQL PLUS COMPLÈTE ---
-            cursor.execute("""
-                WITH UserAverageNotes AS (
-                    SELECT
-                        user_id,
-                        user_name,
-                        product_name,
-                        (COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0 AS avg_note,
-                        -- On utilise ROW_NUMBER pour trouver la meilleure note de chaque utilisateur
-                        ROW_NUMBER() OVER(PARTITION BY user_id ORDER BY (COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) DESC, rating_timestamp DESC) as rn
-                    FROM ratings
-                ),
-                UserStats AS (
-                    SELECT
-                        user_id,
-                        COUNT(user_id) as rating_count,
-                        AVG(avg_note) as global_avg
-                    FROM UserAverageNotes
-                    GROUP BY user_id
-                ),
-                BestProduct AS (
-                    SELECT
-                        user_id,
-                        product_name as best_rated_product
-                    FROM UserAverageNotes
-                    WHERE rn = 1
-                )
-                SELECT
-                    us.user_id,
-                    (SELECT user_name FROM ratings WHERE user_id = us.user_id ORDER BY rating_timestamp DESC LIMIT 1) as last_user_name,
-                    us.rating_count,
-                    us.global_avg,
-                    bp.best_rated_product
-                FROM UserStats us
-                JOIN BestProduct bp ON us.user_id = bp.user_id
-                ORDER BY us.rating_count DESC, us.global_avg DESC;
-            """)
-            
-            results = [dict(row) for row in cursor.fetchall()]
-            conn.close()
-            return results
-            
         try:
-            top_raters = await asyncio.to_thread(_fetch_top_raters_sync)
-            if not top_raters:
+            total_raters = await bot_db.count_raters()
+            if not total_raters:
                 await interaction.followup.send("Personne n'a encore noté de produit !", ephemeral=True)
                 return
             
-            # On passe les données à la vue qui saura comment les afficher
-            paginator = TopRatersPaginatorView(top_raters, interaction.guild)
+            # La vue ne charge que la page affichée (pagination keyset sur user_stats)
+            paginator = TopRatersPaginatorView(interaction.guild, total_raters)
+            await paginator.load_page()
+            paginator.update_buttons()
             embed = paginator.create_embed_for_page()
             await interaction.followup.send(embed=embed, view=paginator, ephemeral=True)
         except Exception as e:
@@ -1988,29 +1896,11 @@ class SlashCommands(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         await log_user_action(interaction, "a demandé le classement général des produits.")
         try:
-            def _fetch_all_ratings_sync():
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT product_name, AVG((COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0), COUNT(id)
-                    FROM ratings GROUP BY product_name HAVING COUNT(id) > 0
-                    ORDER BY AVG((visual_score + smell_score + touch_score + taste_score + effects_score) / 5.0) DESC
-                """)
-                return cursor.fetchall()
-            def _read_product_cache_sync():
-                try:
-                    with open(CACHE_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-                except (FileNotFoundError, json.JSONDecodeError): return {}
-
-            all_products_ratings, site_data = await asyncio.gather(
-                asyncio.to_thread(_fetch_all_ratings_sync),
-                asyncio.to_thread(_read_product_cache_sync)
-            )
+            all_products_ratings = await bot_db.get_product_rankings()
             if not all_products_ratings:
                 await interaction.followup.send("Aucun produit n'a encore été noté.", ephemeral=True)
                 return
-            product_map = {p['name'].strip().lower(): p for p in site_data.get('products', [])}
-            paginator = RankingPaginatorView(all_products_ratings, product_map, items_per_page=5)
+            paginator = RankingPaginatorView(all_products_ratings, self.bot.catalog.by_name, items_per_page=5)
             embed = paginator.create_embed_for_page()
             await interaction.followup.send(embed=embed, view=paginator, ephemeral=True)
         except Exception as e:
@@ -2058,16 +1948,9 @@ class SlashCommands(commands.Cog):
         status_text = f"**API Discord :** `{round(self.bot.latency * 1000)} ms`\n"
         
         try:
-            import shopify
+            from shopify_client import get_shopify_client
             start_time = time.time()
-            shop_url = os.getenv('SHOPIFY_SHOP_URL')
-            api_version = os.getenv('SHOPIFY_API_VERSION')
-            access_token = os.getenv('SHOPIFY_ADMIN_ACCESS_TOKEN')
-            
-            session = shopify.Session(shop_url, api_version, access_token)
-            shopify.ShopifyResource.activate_session(session)
-            shopify.Shop.current()
-            shopify.ShopifyResource.clear_session()
+            await get_shopify_client().rest_get('shop.json')
             
             end_time = time.time()
             status_text += f"✅ **API Shopify :** `Connectée en {round((end_time - start_time) * 1000)} ms`\n"
@@ -2088,10 +1971,11 @@ class SlashCommands(commands.Cog):
         # --- 2. Tâches Programmées (NOUVELLE SECTION) ---
         tasks_text = ""
         # Accéder aux tâches enregistrées dans le fichier principal du bot
-        from catalogue_final import scheduled_check, post_weekly_ranking, scheduled_selection, daily_role_sync, scheduled_db_export, scheduled_reengagement_check
+        from catalogue_final import scheduled_check, post_weekly_ranking, scheduled_selection, daily_role_sync, scheduled_db_export, scheduled_reengagement_check, catalog_events_watcher
 
         tasks_to_check = {
             "Vérification Menu": scheduled_check,
+            "Webhooks Catalogue": catalog_events_watcher,
             "Classement Hebdo": post_weekly_ranking,
             "Sélection Semaine": scheduled_selection,
             "Synchro Rôles": daily_role_sync,
@@ -2133,23 +2017,28 @@ class SlashCommands(commands.Cog):
         if self.bot.product_cache:
             products_count = len(self.bot.product_cache.get('products', []))
             cache_age_ts = self.bot.product_cache.get('timestamp', 0)
-            embed.add_field(name="🗃️ Cache de Produits", value=f"✅ `Chargé`\n**Produits :** `{products_count}`\n**MàJ :** <t:{int(cache_age_ts)}:R>", inline=True)
+            cache_state = "⚠️ `Périmé (instantané disque)`" if self.bot.catalog.stale else "✅ `Chargé`"
+            embed.add_field(name="🗃️ Cache de Produits", value=f"{cache_state}\n**Produits :** `{products_count}`\n**MàJ :** <t:{int(cache_age_ts)}:R>", inline=True)
         else:
             embed.add_field(name="🗃️ Cache de Produits", value="❌ `Vide`", inline=True)
+
+        from catalog_caches import description_cache
+        desc_stats = description_cache.stats()
+        embed.add_field(name="📝 Cache Descriptions", value=f"**Hits :** `{desc_stats['hits']}`\n**Misses :** `{desc_stats['misses']}`\n**Entrées :** `{desc_stats['size']}` (`{desc_stats['parser']}`)", inline=True)
+        render_stats = render_cache.stats()
+        embed.add_field(name="🖼️ Cache Embeds", value=f"**Hits :** `{render_stats['hits']}`\n**Misses :** `{render_stats['misses']}`\n**Entrées :** `{render_stats['size']}`", inline=True)
             
         try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            ratings_count = c.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
-            links_count = c.execute("SELECT COUNT(*) FROM user_links").fetchone()[0]
-            conn.close()
-            embed.add_field(name="💾 Base de Données", value=f"✅ `Accessible`\n**Notes :** `{ratings_count}`\n**Comptes liés :** `{links_count}`", inline=True)
+            ratings_count = await bot_db.count_ratings()
+            links_count = await bot_db.count_linked_accounts()
+            pool = get_db_pool_stats()
+            embed.add_field(name="💾 Base de Données", value=f"✅ `Accessible`\n**Notes :** `{ratings_count}`\n**Comptes liés :** `{links_count}`\n**Pool :** `{pool['in_use']}` utilisée(s), `{pool['idle']}` libre(s), `{pool['reused']}` réutilisations", inline=True)
         except Exception as e:
             embed.add_field(name="💾 Base de Données", value=f"❌ `Erreur d'accès`\n`{e}`", inline=True)
 
         # --- 6. Variables d'Environnement ---
         env_text = ""
-        env_vars_to_check = ['SHOPIFY_SHOP_URL', 'SHOPIFY_API_VERSION', 'SHOPIFY_ADMIN_ACCESS_TOKEN', 'APP_URL', 'FLASK_SECRET_KEY']
+        env_vars_to_check = ['SHOPIFY_SHOP_URL', 'SHOPIFY_API_VERSION', 'SHOPIFY_ADMIN_ACCESS_TOKEN', 'SHOPIFY_WEBHOOK_SECRET', 'APP_URL', 'FLASK_SECRET_KEY']
         for var in env_vars_to_check:
             value = os.getenv(var)
             env_text += f"{'✅' if value else '❌'} **{var}:** `{'Présente' if value else 'Manquante'}`\n"
@@ -2247,38 +2136,18 @@ class SlashCommands(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         target_user = membre or interaction.user
         await log_user_action(interaction, f"a consulté le profil de {target_user.display_name}")
-        def _fetch_user_data_sync(user_id):
-            conn = get_db_connection(); conn.row_factory = sqlite3.Row; c = conn.cursor()
-            
-            # 1. Notes
-            c.execute("SELECT * FROM ratings WHERE user_id = ? ORDER BY rating_timestamp DESC", (user_id,))
-            user_ratings = [dict(row) for row in c.fetchall()]
-
-            # 2. Statistiques
+        async def _fetch_user_data(user_id):
+            # 1. Statistiques (les notes elles-mêmes sont chargées page par page par RatingsPaginatorView)
             user_stats = {'rank': 'N/C', 'count': 0, 'avg': 0, 'min_note': 0, 'max_note': 0, 'loyalty_badge': None}
-            c.execute("""
-                WITH UserAverageNotes AS (
-                    SELECT user_id, (COALESCE(visual_score, 0) + COALESCE(smell_score, 0) + COALESCE(touch_score, 0) + COALESCE(taste_score, 0) + COALESCE(effects_score, 0)) / 5.0 AS avg_note
-                    FROM ratings
-                ), AllRanks AS (
-                    SELECT user_id, COUNT(user_id) as rating_count, AVG(avg_note) as global_avg, MIN(avg_note) as min_note, MAX(avg_note) as max_note,
-                        RANK() OVER (ORDER BY COUNT(user_id) DESC, AVG(avg_note) DESC) as user_rank
-                    FROM UserAverageNotes GROUP BY user_id
-                )
-                SELECT user_rank, rating_count, global_avg, min_note, max_note FROM AllRanks WHERE user_id = ?
-            """, (user_id,))
-            stats_row = c.fetchone()
-            
-            # --- CORRECTION APPLIQUÉE ICI ---
+            stats_row = await bot_db.get_user_stats(user_id)
             if stats_row:
                 user_stats['rank'] = stats_row['user_rank']
                 user_stats['count'] = stats_row['rating_count']
                 user_stats['avg'] = stats_row['global_avg']
                 user_stats['min_note'] = stats_row['min_note']
                 user_stats['max_note'] = stats_row['max_note']
-            # --- FIN DE LA CORRECTION ---
 
-            # 3. Badge de fidélité
+            # 2. Badge de fidélité
             loyalty_config = config_manager.get_config("loyalty_roles", {})
             if loyalty_config and user_stats.get('count', 0) > 0:
                 sorted_roles = sorted(loyalty_config.values(), key=lambda r: r.get('threshold', 0), reverse=True)
@@ -2287,26 +2156,23 @@ class SlashCommands(commands.Cog):
                         user_stats['loyalty_badge'] = {"name": role_data.get('name'), "emoji": role_data.get('emoji')}
                         break
             
-            # 4. Email
-            c.execute("SELECT user_email FROM user_links WHERE discord_id = ?", (str(user_id),))
-            email_row = c.fetchone()
-            user_email = email_row['user_email'] if email_row else None
-            conn.close()
+            # 3. Email
+            user_email = await bot_db.get_linked_email(user_id)
             
-            # 5. Données Shopify
+            # 4. Données Shopify
             shopify_data = {}
             if user_email:
                 shopify_data['anonymized_email'] = anonymize_email(user_email)
                 api_url = f"{APP_URL}/api/get_purchased_products/{user_id}"
                 try:
                     import requests
-                    res = requests.get(api_url, timeout=10)
+                    res = await asyncio.to_thread(requests.get, api_url, timeout=10)
                     if res.ok: shopify_data.update(res.json())
                 except requests.RequestException: pass
             
-            return user_stats, user_ratings, shopify_data
+            return user_stats, shopify_data
         try:
-            user_stats, user_ratings, shopify_data = await asyncio.to_thread(_fetch_user_data_sync, target_user.id)
+            user_stats, shopify_data = await _fetch_user_data(target_user.id)
             if user_stats.get('count', 0) == 0 and not shopify_data.get('purchase_count'):
                 await interaction.followup.send("Cet utilisateur n'a aucune activité enregistrée.", ephemeral=True)
                 return
@@ -2338,7 +2204,7 @@ class SlashCommands(commands.Cog):
             embed.add_field(name="📝 Activité sur le Discord", value=discord_activity_text, inline=False)
             
             can_reset = membre and membre.id != interaction.user.id and await is_staff_or_owner(interaction)
-            view = ProfileView(target_user, user_stats, user_ratings, shopify_data, can_reset, self.bot)
+            view = ProfileView(target_user, user_stats, shopify_data, can_reset, self.bot)
             await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
         except Exception as e:
@@ -2493,16 +2359,13 @@ class SlashCommands(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         await log_user_action(interaction, "a demandé les promotions.")
         try:
-            # On utilise le cache du bot qui est toujours à jour
-            site_data = self.bot.product_cache
-            if not site_data:
+            # On utilise le catalogue du bot qui est toujours à jour
+            catalog = self.bot.catalog
+            if not catalog:
                 await interaction.followup.send("Les informations sur les promotions ne sont pas disponibles pour le moment.", ephemeral=True); return
             
-            promo_products = [p for p in site_data.get('products', []) if p.get('is_promo')]
-            general_promos = site_data.get('general_promos', [])
-            
             # On utilise la NOUVELLE vue
-            paginator = PromoPaginatorView(promo_products, general_promos)
+            paginator = PromoPaginatorView(catalog)
             embed = paginator.create_embed()
             await interaction.followup.send(embed=embed, view=paginator, ephemeral=True)
         except Exception as e:
@@ -2525,63 +2388,24 @@ class SlashCommands(commands.Cog):
     async def comparer(self, interaction: discord.Interaction, produit1: str, produit2: str):
         await interaction.response.defer(ephemeral=True)
 
-        # --- NOUVELLE FONCTION INTERNE POUR ACCÉDER À LA DB ---
-        def _fetch_comparison_data_sync(p1_name: str, p2_name: str) -> dict:
-            """Récupère les données de notation agrégées directement depuis la DB."""
-            conn = get_db_connection()
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            data_map = {}
-
-            for name in [p1_name, p2_name]:
-                query = """
-                    SELECT 
-                        (SELECT r2.product_name FROM ratings r2 WHERE LOWER(TRIM(r2.product_name)) LIKE ? ORDER BY r2.rating_timestamp DESC LIMIT 1) as display_name,
-                        COUNT(r1.id) as count,
-                        COALESCE(AVG((COALESCE(r1.visual_score,0)+COALESCE(r1.smell_score,0)+COALESCE(r1.touch_score,0)+COALESCE(r1.taste_score,0)+COALESCE(r1.effects_score,0))/5.0), 0) as avg_total,
-                        COALESCE(AVG(r1.visual_score), 0) as visuel,
-                        COALESCE(AVG(r1.smell_score), 0) as odeur,
-                        COALESCE(AVG(r1.touch_score), 0) as toucher,
-                        COALESCE(AVG(r1.taste_score), 0) as gout,
-                        COALESCE(AVG(r1.effects_score), 0) as effets
-                    FROM ratings r1
-                    WHERE LOWER(TRIM(r1.product_name)) LIKE ?
-                """
-                like_param = f"%{name.lower().strip()}%"
-                cursor.execute(query, (like_param, like_param))
-                result = cursor.fetchone()
-                
-                if result and result['count'] > 0:
-                    data_map[name.lower().strip()] = {
-                        "name": result['display_name'],
-                        "count": result['count'],
-                        "avg_total": result['avg_total'],
-                        "details": { 'Visuel': result['visuel'], 'Odeur': result['odeur'], 'Toucher': result['toucher'], 'Goût': result['gout'], 'Effets': result['effets'] }
-                    }
-            conn.close()
-            return data_map
-
         try:
             if produit1.lower() == produit2.lower():
                 return await interaction.followup.send("❌ Veuillez choisir deux produits différents.", ephemeral=True)
 
-            product_map = {p['name'].lower().strip(): p for p in self.bot.product_cache.get('products', [])}
-            
-            p1_full_name = next((p['name'] for name_key, p in product_map.items() if produit1.lower() in name_key), None)
-            p2_full_name = next((p['name'] for name_key, p in product_map.items() if produit2.lower() in name_key), None)
+            # Le nom vient de l'autocomplétion : recherche exacte en O(1), sous-chaîne seulement en dernier recours.
+            p1_data = self.bot.catalog.find(produit1)
+            p2_data = self.bot.catalog.find(produit2)
             
-            if not p1_full_name or not p2_full_name:
-                missing = f"'{produit1 if not p1_full_name else produit2}'"
+            if not p1_data or not p2_data:
+                missing = f"'{produit1 if not p1_data else produit2}'"
                 return await interaction.followup.send(f"😕 Impossible de trouver les informations pour {missing}.", ephemeral=True)
 
-            p1_data = product_map.get(p1_full_name.lower().strip())
-            p2_data = product_map.get(p2_full_name.lower().strip())
+            p1_full_name, p2_full_name = p1_data['name'], p2_data['name']
 
-            # --- On appelle la fonction de DB locale, plus d'appel API ---
-            rating_data_map = await asyncio.to_thread(_fetch_comparison_data_sync, p1_full_name, p2_full_name)
+            rating_data_map = await bot_db.get_comparison_data([p1_full_name, p2_full_name])
             
-            p1_rating_data = rating_data_map.get(p1_full_name.lower().strip())
-            p2_rating_data = rating_data_map.get(p2_full_name.lower().strip())
+            p1_rating_data = rating_data_map.get(product_key(p1_full_name))
+            p2_rating_data = rating_data_map.get(product_key(p2_full_name))
 
             embed = create_styled_embed(title=f"⚔️ Comparaison : {p1_data['name']} vs {p2_data['name']}", description="Voici un résumé des caractéristiques et des notes moyennes.", color=discord.Color.orange())
 
@@ -0,0 +1,386 @@
+# db_migrations.py
+# Migrations versionnées de la base partagée (bot + API Flask), repérées par PRAGMA user_version.
+
+import time
+import sqlite3
+from typing import Callable, List, Tuple
+
+from shared_utils import Logger
+
+
+def _column_exists(cursor, table: str, column: str) -> bool:
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
+
+
+def _m001_base_schema(cursor):
+    """Tables historiques ; idempotent pour les bases créées avant le suivi des versions."""
+    cursor.execute(''' CREATE TABLE IF NOT EXISTS ratings (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        user_name TEXT NOT NULL,
+                        product_name TEXT NOT NULL,
+                        visual_score REAL,
+                        smell_score REAL,
+                        touch_score REAL,
+                        taste_score REAL,
+                        effects_score REAL,
+                        rating_timestamp TEXT NOT NULL,
+                        UNIQUE(user_id, product_name)) ''')
+    if not _column_exists(cursor, 'ratings', 'comment'):
+        cursor.execute("ALTER TABLE ratings ADD COLUMN comment TEXT")
+    cursor.execute("CREATE TABLE IF NOT EXISTS user_links (discord_id TEXT PRIMARY KEY, user_email TEXT NOT NULL UNIQUE);")
+    cursor.execute("CREATE TABLE IF NOT EXISTS verification_codes (discord_id TEXT PRIMARY KEY, user_email TEXT NOT NULL, code TEXT NOT NULL, expires_at INTEGER NOT NULL);")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reminders (
+            discord_id TEXT NOT NULL,
+            order_id INTEGER NOT NULL,
+            notified_at TEXT NOT NULL,
+            PRIMARY KEY (discord_id, order_id)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reminder_blacklist (
+            discord_id TEXT PRIMARY KEY,
+            blacklisted_at TEXT NOT NULL
+        );
+    """)
+    # File d'attente des webhooks catalogue Shopify : écrite par l'API Flask, consommée par le bot.
+    cursor.execute(''' CREATE TABLE IF NOT EXISTS catalog_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        webhook_id TEXT UNIQUE,
+                        topic TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        received_at TEXT NOT NULL) ''')
+
+
+def _m002_ratings_indexes(cursor):
+    """Index des requêtes chaudes : avis d'un produit, classements hebdomadaires, notes d'un membre."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ratings_product_name ON ratings(product_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ratings_timestamp ON ratings(rating_timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ratings_user_timestamp ON ratings(user_id, rating_timestamp)")
+    cursor.execute("ANALYZE ratings")
+
+
+def _m003_ratings_product_key(cursor):
+    """Clé produit normalisée stockée et indexée : fini les LOWER(TRIM(...)) et LIKE ligne par ligne."""
+    if not _column_exists(cursor, 'ratings', 'product_key'):
+        cursor.execute("ALTER TABLE ratings ADD COLUMN product_key TEXT")
+    # Copie figée de shared_utils.product_key telle que livrée avec cette migration (str.lower de Python,
+    # qui gère aussi les majuscules accentuées) : une évolution ultérieure de la fonction ne doit pas
+    # faire remplir différemment une base neuve et une base existante.
+    def product_key_v1(product_name):
+        return (product_name or '').strip().lower()
+    cursor.connection.create_function("py_product_key", 1, product_key_v1, deterministic=True)
+    cursor.execute("UPDATE ratings SET product_key = py_product_key(product_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ratings_product_key ON ratings(product_key, rating_timestamp)")
+    cursor.execute("ANALYZE ratings")
+
+
+# Contribution d'une ligne de `ratings` (préfixe NEW ou OLD) aux colonnes de product_stats.
+_NOTE = "(COALESCE({r}.visual_score, 0) + COALESCE({r}.smell_score, 0) + COALESCE({r}.touch_score, 0) + COALESCE({r}.taste_score, 0) + COALESCE({r}.effects_score, 0)) / 5.0"
+_HAS_COMMENT = "(CASE WHEN {r}.comment IS NOT NULL AND TRIM({r}.comment) != '' THEN 1 ELSE 0 END)"
+_AXES = ("visual", "smell", "touch", "taste", "effects")
+
+
+def _product_stats_add(row: str) -> str:
+    """Upsert qui ajoute la ligne `row` (NEW) aux agrégats de son produit."""
+    axis_values = ", ".join(f"COALESCE({row}.{a}_score, 0), ({row}.{a}_score IS NOT NULL)" for a in _AXES)
+    axis_updates = ", ".join(f"{a}_sum = {a}_sum + excluded.{a}_sum, {a}_n = {a}_n + excluded.{a}_n" for a in _AXES)
+    return f"""
+        INSERT INTO product_stats (product_key, product_name, rating_count, note_sum, comment_count,
+                                   {", ".join(f"{a}_sum, {a}_n" for a in _AXES)})
+        SELECT {row}.product_key, {row}.product_name, 1, {_NOTE.format(r=row)}, {_HAS_COMMENT.format(r=row)}, {axis_values}
+        WHERE {row}.product_key IS NOT NULL
+        ON CONFLICT(product_key) DO UPDATE SET
+            product_name = excluded.product_name,
+            rating_count = rating_count + 1,
+            note_sum = note_sum + excluded.note_sum,
+            comment_count = comment_count + excluded.comment_count,
+            {axis_updates};"""
+
+
+def _product_stats_remove(row: str) -> str:
+    """Retire la ligne `row` (OLD) des agrégats de son produit, et le produit s'il n'a plus de note."""
+    axis_updates = ", ".join(f"{a}_sum = {a}_sum - COALESCE({row}.{a}_score, 0), {a}_n = {a}_n - ({row}.{a}_score IS NOT NULL)" for a in _AXES)
+    return f"""
+        UPDATE product_stats SET
+            rating_count = rating_count - 1,
+            note_sum = note_sum - {_NOTE.format(r=row)},
+            comment_count = comment_count - {_HAS_COMMENT.format(r=row)},
+            {axis_updates}
+        WHERE product_key = {row}.product_key;
+        DELETE FROM product_stats WHERE product_key = {row}.product_key AND rating_count <= 0;"""
+
+
+def _m004_product_stats(cursor):
+    """Agrégats par produit tenus à jour par triggers : les lectures produit deviennent une ligne indexée."""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS product_stats (
+            product_key TEXT PRIMARY KEY,
+            product_name TEXT NOT NULL,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            note_sum REAL NOT NULL DEFAULT 0,
+            comment_count INTEGER NOT NULL DEFAULT 0,
+            {", ".join(f"{a}_sum REAL NOT NULL DEFAULT 0, {a}_n INTEGER NOT NULL DEFAULT 0" for a in _AXES)}
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_stats_count ON product_stats(rating_count)")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_product_stats_insert AFTER INSERT ON ratings BEGIN {_product_stats_add('NEW')} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_product_stats_delete AFTER DELETE ON ratings BEGIN {_product_stats_remove('OLD')} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_product_stats_update AFTER UPDATE ON ratings BEGIN {_product_stats_remove('OLD')} {_product_stats_add('NEW')} END")
+
+    cursor.execute("DELETE FROM product_stats")
+    cursor.execute(f"""
+        INSERT INTO product_stats (product_key, product_name, rating_count, note_sum, comment_count,
+                                   {", ".join(f"{a}_sum, {a}_n" for a in _AXES)})
+        SELECT r.product_key,
+               (SELECT r2.product_name FROM ratings r2 WHERE r2.product_key = r.product_key ORDER BY r2.rating_timestamp DESC LIMIT 1),
+               COUNT(*), SUM({_NOTE.format(r='r')}), SUM({_HAS_COMMENT.format(r='r')}),
+               {", ".join(f"COALESCE(SUM(r.{a}_score), 0), COUNT(r.{a}_score)" for a in _AXES)}
+        FROM ratings r
+        WHERE r.product_key IS NOT NULL
+        GROUP BY r.product_key
+    """)
+
+
+def _m005_user_stats(cursor):
+    """
+    Statistiques par membre tenues à jour par triggers, plus un histogramme « nombre de notes -> membres ».
+    Le rang d'un membre se calcule avec l'histogramme (une ligne par nombre de notes distinct) et les
+    seuls ex æquo sur son nombre de notes, sans parcourir les notes de tout le monde. avg_note est
+    arrondie à 1e-6 pour que les sommes incrémentales ne créent pas de faux départages entre ex æquo.
+    """
+    note = _NOTE.format(r='NEW')
+    old_note = _NOTE.format(r='OLD')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT NOT NULL,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            note_sum REAL NOT NULL DEFAULT 0,
+            avg_note REAL NOT NULL DEFAULT 0,
+            min_note REAL,
+            max_note REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_rank ON user_stats(rating_count, avg_note)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_rating_histogram (
+            rating_count INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL
+        )
+    """)
+
+    add = f"""
+        INSERT INTO user_stats (user_id, user_name, rating_count, note_sum, avg_note, min_note, max_note)
+        VALUES (NEW.user_id, NEW.user_name, 1, {note}, ROUND({note}, 6), {note}, {note})
+        ON CONFLICT(user_id) DO UPDATE SET
+            user_name = excluded.user_name,
+            rating_count = rating_count + 1,
+            note_sum = note_sum + excluded.note_sum,
+            avg_note = ROUND((note_sum + excluded.note_sum) / (rating_count + 1), 6),
+            min_note = MIN(COALESCE(min_note, excluded.min_note), excluded.min_note),
+            max_note = MAX(COALESCE(max_note, excluded.max_note), excluded.max_note);"""
+    # Le min et le max ne se décrémentent pas : on les relit sur les notes restantes du membre (index user_id).
+    remove = f"""
+        UPDATE user_stats SET
+            rating_count = rating_count - 1,
+            note_sum = note_sum - {old_note},
+            avg_note = CASE WHEN rating_count > 1 THEN ROUND((note_sum - {old_note}) / (rating_count - 1), 6) ELSE 0 END,
+            min_note = (SELECT MIN({_NOTE.format(r='ratings')}) FROM ratings WHERE user_id = OLD.user_id),
+            max_note = (SELECT MAX({_NOTE.format(r='ratings')}) FROM ratings WHERE user_id = OLD.user_id)
+        WHERE user_id = OLD.user_id;
+        DELETE FROM user_stats WHERE user_id = OLD.user_id AND rating_count <= 0;"""
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_user_stats_insert AFTER INSERT ON ratings BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_user_stats_delete AFTER DELETE ON ratings BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_user_stats_update AFTER UPDATE ON ratings BEGIN {remove} {add} END")
+
+    histogram_inc = "INSERT INTO user_rating_histogram (rating_count, users) VALUES (NEW.rating_count, 1) ON CONFLICT(rating_count) DO UPDATE SET users = users + 1;"
+    histogram_dec = """UPDATE user_rating_histogram SET users = users - 1 WHERE rating_count = OLD.rating_count;
+        DELETE FROM user_rating_histogram WHERE rating_count = OLD.rating_count AND users <= 0;"""
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_user_stats_histogram_insert AFTER INSERT ON user_stats BEGIN {histogram_inc} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_user_stats_histogram_delete AFTER DELETE ON user_stats BEGIN {histogram_dec} END")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_user_stats_histogram_update AFTER UPDATE OF rating_count ON user_stats
+        WHEN OLD.rating_count != NEW.rating_count BEGIN {histogram_dec} {histogram_inc} END""")
+
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute("DELETE FROM user_rating_histogram")
+    cursor.execute(f"""
+        INSERT INTO user_stats (user_id, user_name, rating_count, note_sum, avg_note, min_note, max_note)
+        SELECT r.user_id,
+               (SELECT r2.user_name FROM ratings r2 WHERE r2.user_id = r.user_id ORDER BY r2.rating_timestamp DESC LIMIT 1),
+               COUNT(*), SUM({_NOTE.format(r='r')}), ROUND(AVG({_NOTE.format(r='r')}), 6), MIN({_NOTE.format(r='r')}), MAX({_NOTE.format(r='r')})
+        FROM ratings r
+        GROUP BY r.user_id
+    """)
+
+
+def _m006_daily_rollups(cursor):
+    """
+    Cumuls quotidiens par produit et par membre (jour UTC = 10 premiers caractères de rating_timestamp),
+    tenus à jour par triggers : les classements sur 7 ou 30 jours lisent quelques lignes par jour.
+    Une note modifiée passe du jour de son ancien horodatage à celui du nouveau.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_daily_stats (
+            day TEXT NOT NULL,
+            product_key TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            note_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_key)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    """)
+
+    add = f"""
+        INSERT INTO product_daily_stats (day, product_key, product_name, rating_count, note_sum)
+        SELECT substr(NEW.rating_timestamp, 1, 10), NEW.product_key, NEW.product_name, 1, {_NOTE.format(r='NEW')}
+        WHERE NEW.product_key IS NOT NULL
+        ON CONFLICT(day, product_key) DO UPDATE SET
+            product_name = excluded.product_name,
+            rating_count = rating_count + 1,
+            note_sum = note_sum + excluded.note_sum;
+        INSERT INTO user_daily_stats (day, user_id, rating_count)
+        VALUES (substr(NEW.rating_timestamp, 1, 10), NEW.user_id, 1)
+        ON CONFLICT(day, user_id) DO UPDATE SET rating_count = rating_count + 1;"""
+    remove = f"""
+        UPDATE product_daily_stats SET rating_count = rating_count - 1, note_sum = note_sum - {_NOTE.format(r='OLD')}
+        WHERE day = substr(OLD.rating_timestamp, 1, 10) AND product_key = OLD.product_key;
+        DELETE FROM product_daily_stats WHERE day = substr(OLD.rating_timestamp, 1, 10) AND product_key = OLD.product_key AND rating_count <= 0;
+        UPDATE user_daily_stats SET rating_count = rating_count - 1
+        WHERE day = substr(OLD.rating_timestamp, 1, 10) AND user_id = OLD.user_id;
+        DELETE FROM user_daily_stats WHERE day = substr(OLD.rating_timestamp, 1, 10) AND user_id = OLD.user_id AND rating_count <= 0;"""
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_daily_insert AFTER INSERT ON ratings BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_daily_delete AFTER DELETE ON ratings BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_daily_update AFTER UPDATE ON ratings BEGIN {remove} {add} END")
+
+    cursor.execute("DELETE FROM product_daily_stats")
+    cursor.execute("DELETE FROM user_daily_stats")
+    cursor.execute(f"""
+        INSERT INTO product_daily_stats (day, product_key, product_name, rating_count, note_sum)
+        SELECT substr(rating_timestamp, 1, 10), product_key, MAX(product_name), COUNT(*), SUM({_NOTE.format(r='ratings')})
+        FROM ratings WHERE product_key IS NOT NULL
+        GROUP BY substr(rating_timestamp, 1, 10), product_key
+    """)
+    cursor.execute("""
+        INSERT INTO user_daily_stats (day, user_id, rating_count)
+        SELECT substr(rating_timestamp, 1, 10), user_id, COUNT(*)
+        FROM ratings
+        GROUP BY substr(rating_timestamp, 1, 10), user_id
+    """)
+
+
+def _m007_user_directory(cursor):
+    """
+    Annuaire des membres : dernier pseudo connu par user_id, mis à jour à chaque note envoyée.
+    Contrairement à user_stats, la ligne survit à la suppression des notes du membre.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_directory (
+            user_id INTEGER PRIMARY KEY,
+            user_name TEXT NOT NULL,
+            last_seen TEXT NOT NULL
+        )
+    """)
+    upsert = """
+        INSERT INTO user_directory (user_id, user_name, last_seen)
+        VALUES (NEW.user_id, NEW.user_name, NEW.rating_timestamp)
+        ON CONFLICT(user_id) DO UPDATE SET user_name = excluded.user_name, last_seen = excluded.last_seen
+        WHERE excluded.last_seen >= user_directory.last_seen;"""
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_directory_insert AFTER INSERT ON ratings BEGIN {upsert} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_ratings_directory_update AFTER UPDATE OF user_name, rating_timestamp ON ratings BEGIN {upsert} END")
+    cursor.execute("""
+        INSERT OR REPLACE INTO user_directory (user_id, user_name, last_seen)
+        SELECT user_id, user_name, MAX(rating_timestamp) FROM ratings GROUP BY user_id
+    """)
+
+
+def _m008_user_avg_histogram(cursor):
+    """
+    Histogramme « (nombre de notes, tranche de moyenne de 0,01) -> membres » pour le départage du rang :
+    parmi les membres ayant autant de notes, seuls ceux de la même tranche de moyenne sont parcourus un à un.
+    La tranche CAST(avg_note * 100 AS INTEGER) est reprise telle quelle par USER_STATS_QUERY.
+    """
+    bucket = "CAST({r}.avg_note * 100 AS INTEGER)"
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_avg_histogram (
+            rating_count INTEGER NOT NULL,
+            avg_bucket INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (rating_count, avg_bucket)
+        ) WITHOUT ROWID
+    """)
+    inc = f"""INSERT INTO user_avg_histogram (rating_count, avg_bucket, users) VALUES (NEW.rating_count, {bucket.format(r='NEW')}, 1)
+        ON CONFLICT(rating_count, avg_bucket) DO UPDATE SET users = users + 1;"""
+    dec = f"""UPDATE user_avg_histogram SET users = users - 1 WHERE rating_count = OLD.rating_count AND avg_bucket = {bucket.format(r='OLD')};
+        DELETE FROM user_avg_histogram WHERE rating_count = OLD.rating_count AND avg_bucket = {bucket.format(r='OLD')} AND users <= 0;"""
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_user_stats_avg_histogram_insert AFTER INSERT ON user_stats BEGIN {inc} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_user_stats_avg_histogram_delete AFTER DELETE ON user_stats BEGIN {dec} END")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_user_stats_avg_histogram_update AFTER UPDATE OF rating_count, avg_note ON user_stats
+        WHEN OLD.rating_count != NEW.rating_count OR {bucket.format(r='OLD')} != {bucket.format(r='NEW')} BEGIN {dec} {inc} END""")
+    cursor.execute("DELETE FROM user_avg_histogram")
+    cursor.execute(f"""
+        INSERT INTO user_avg_histogram (rating_count, avg_bucket, users)
+        SELECT rating_count, {bucket.format(r='user_stats')}, COUNT(*) FROM user_stats
+        GROUP BY rating_count, {bucket.format(r='user_stats')}
+    """)
+
+
+# (version, description, migration) ; ne jamais modifier une migration déjà livrée, en ajouter une nouvelle.
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "schéma de base", _m001_base_schema),
+    (2, "index de la table ratings", _m002_ratings_indexes),
+    (3, "clé produit normalisée", _m003_ratings_product_key),
+    (4, "agrégats par produit", _m004_product_stats),
+    (5, "statistiques et rangs des membres", _m005_user_stats),
+    (6, "cumuls quotidiens", _m006_daily_rollups),
+    (7, "annuaire des membres", _m007_user_directory),
+    (8, "histogramme des moyennes des membres", _m008_user_avg_histogram),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(db_path: str) -> int:
+    """
+    Applique les migrations manquantes, chacune dans sa propre transaction. Le bot et l'API peuvent
+    démarrer en même temps : BEGIN IMMEDIATE prend le verrou d'écriture et la version est relue
+    sous ce verrou, si bien qu'une migration n'est jamais appliquée deux fois. Renvoie la version finale.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            Logger.warning(f"Base '{db_path}' en version {version}, plus récente que ce code (version {SCHEMA_VERSION}).")
+            return version
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if target <= version:
+                    cursor.execute("COMMIT")
+                    continue
+                started = time.perf_counter()
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                Logger.error(f"Échec de la migration {target} ({description}) sur '{db_path}'.")
+                raise
+            version = target
+            Logger.success(f"Migration {target} ({description}) appliquée en {(time.perf_counter() - started) * 1000:.0f} ms.")
+        return version
+    finally:
+        conn.close()
@@ -9,7 +9,7 @@ import sqlite3
 import traceback
 import re
 from typing import Dict, Any, List
-from shared_utils import Logger, DB_FILE
+from shared_utils import Logger, get_db_connection, product_key
 import time
 
 FONT_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'Gobold-Bold.otf')
@@ -39,14 +39,15 @@ def create_radar_chart(product_name: str) -> str | None:
     font_props_title = FontProperties(family="Gobold", weight='bold', size=16)
     conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT visual_score, smell_score, touch_score, taste_score, effects_score FROM ratings WHERE product_name = ?", (product_name,))
-        all_ratings = cursor.fetchall()
-        if not all_ratings:
+        # Agrégats tenus à jour par triggers : une seule ligne lue quel que soit le nombre de notes.
+        cursor.execute("SELECT * FROM product_stats WHERE product_key = ?", (product_key(product_name),))
+        stats = cursor.fetchone()
+        if not stats or stats['rating_count'] == 0:
             return None
-        all_ratings_np = np.array(all_ratings, dtype=float)
-        mean_scores = np.nanmean(np.where(all_ratings_np == None, np.nan, all_ratings_np), axis=0)
+        axes = ['visual', 'smell', 'touch', 'taste', 'effects']
+        mean_scores = np.array([stats[f'{a}_sum'] / stats[f'{a}_n'] if stats[f'{a}_n'] else np.nan for a in axes], dtype=float)
         categories = ['Visuel', 'Odeur', 'Toucher', 'Goût', 'Effets']
         scores_for_plot = np.concatenate((mean_scores, [mean_scores[0]]))
         angles = np.linspace(0, 2 * np.pi, len(categories), endpoint=False).tolist()
@@ -0,0 +1,99 @@
+# product_catalog.py
+# Instantané immuable et indexé du catalogue, reconstruit une fois par synchro.
+
+import zlib
+from types import MappingProxyType
+from typing import Optional
+
+# Catégorie affichée ('fleurs') -> clé interne ('weed'), comme categorize_products.
+CATEGORY_KEYS = {
+    "fleurs": "weed",
+    "résines": "hash",
+    "box": "box",
+    "accessoires": "accessoire",
+}
+
+
+def normalize_name(name: str) -> str:
+    return (name or '').strip().lower()
+
+
+def _category_version(products) -> str:
+    # Change dès que la liste ordonnée d'une catégorie change : un index encodé dans un bouton reste valide tant qu'elle est identique.
+    key = '|'.join(str(p.get('id') or p.get('name')) for p in products)
+    return format(zlib.crc32(key.encode('utf-8')), '08x')
+
+
+def _handle_from_url(product_url: str) -> Optional[str]:
+    if not product_url or '/products/' not in product_url:
+        return None
+    return product_url.rsplit('/products/', 1)[1].split('?', 1)[0] or None
+
+
+class ProductCatalog:
+    """
+    Vue en lecture seule de `site_data` : index par nom normalisé, id et handle, tuples par
+    catégorie, liste des promos et compteurs. Construite une fois par synchro puis remplacée
+    d'un bloc sur `bot.catalog` ; les commandes n'ont plus qu'à faire des lookups O(1).
+    Les dictionnaires produits sont partagés avec `site_data` et ne doivent pas être modifiés.
+    """
+    __slots__ = ('site_data', 'products', 'timestamp', 'general_promos', 'by_name', 'by_id',
+                 'by_handle', 'by_category', 'category_versions', 'promo_products', 'counts', 'stale', '_frozen')
+
+    def __init__(self, site_data: Optional[dict] = None, stale: bool = False):
+        site_data = site_data or {}
+        products = tuple(p for p in site_data.get('products', []) if isinstance(p, dict))
+        by_name, by_id, by_handle = {}, {}, {}
+        by_category = {key: [] for key in CATEGORY_KEYS.values()}
+        for p in products:
+            by_name.setdefault(normalize_name(p.get('name')), p)
+            if p.get('id'):
+                by_id[p['id']] = p
+            handle = _handle_from_url(p.get('product_url'))
+            if handle:
+                by_handle[handle] = p
+            internal_key = CATEGORY_KEYS.get(p.get('category'))
+            if internal_key:
+                by_category[internal_key].append(p)
+
+        self.site_data = site_data
+        self.products = products
+        self.timestamp = site_data.get('timestamp', 0)
+        self.general_promos = tuple(site_data.get('general_promos', []))
+        self.by_name = MappingProxyType(by_name)
+        self.by_id = MappingProxyType(by_id)
+        self.by_handle = MappingProxyType(by_handle)
+        self.by_category = MappingProxyType({key: tuple(items) for key, items in by_category.items()})
+        self.category_versions = MappingProxyType({key: _category_version(items) for key, items in by_category.items()})
+        self.promo_products = tuple(p for p in products if p.get('is_promo'))
+        # Même ordre que get_product_counts : (hash, weed, box, accessoire).
+        self.counts = tuple(len(self.by_category[key]) for key in ("hash", "weed", "box", "accessoire"))
+        # Vrai tant que le catalogue vient du disque (démarrage, synchro en échec) et attend une synchro réussie.
+        self.stale = stale
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("ProductCatalog est immuable ; construisez-en un nouveau.")
+        object.__setattr__(self, name, value)
+
+    def __bool__(self) -> bool:
+        return bool(self.products)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def get(self, name: str) -> Optional[dict]:
+        """Produit par nom (insensible à la casse et aux espaces en bordure)."""
+        return self.by_name.get(normalize_name(name))
+
+    def find(self, fragment: str) -> Optional[dict]:
+        """Correspondance exacte en O(1), sinon premier produit dont le nom contient `fragment`."""
+        key = normalize_name(fragment)
+        exact = self.by_name.get(key)
+        if exact is not None:
+            return exact
+        return next((p for name, p in self.by_name.items() if key in name), None)
+
+
+EMPTY_CATALOG = ProductCatalog()
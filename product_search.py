@@ -0,0 +1,129 @@
+# product_search.py
+# Index de recherche des produits pour l'autocomplétion, reconstruit à chaque changement du catalogue.
+
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# On ne propose pas d'accessoires ni de liens réseaux sociaux dans les comparaisons.
+AUTOCOMPLETE_EXCLUDE_KEYWORDS = ("briquet", "feuille", "papier", "grinder", "accessoire", "telegram", "instagram", "tiktok")
+MAX_PREFIX_LENGTH = 12
+FUZZY_MIN_SCORE = 0.6
+RESULTS_CACHE_SIZE = 2048
+
+
+def fold(text: str) -> str:
+    """Minuscules, sans accents ni espaces superflus : 'Crème Brûlée ' -> 'creme brulee'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).lower().split())
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    """
+    Préfixes (du nom et de chaque mot), trigrammes pour les sous-chaînes et les fautes de
+    frappe légères, listes de candidats déjà triées par nombre de notes. Une frappe ne coûte
+    que quelques lookups de dictionnaire ; les saisies déjà vues sont servies depuis un petit cache.
+    """
+    def __init__(self, names: Iterable[str], rating_counts: Optional[Dict[str, int]] = None):
+        rating_counts = rating_counts or {}
+        entries = []
+        for name in names:
+            folded = fold(name)
+            if not folded or any(keyword in folded for keyword in AUTOCOMPLETE_EXCLUDE_KEYWORDS):
+                continue
+            entries.append((-rating_counts.get(name.strip().lower(), 0), folded, name))
+        # Les index contiennent des positions dans cet ordre : plus petit = plus populaire.
+        entries.sort()
+        self.names: List[str] = [name for _, _, name in entries]
+        self.folded: List[str] = [folded for _, folded, _ in entries]
+
+        name_prefixes = defaultdict(list)
+        word_prefixes = defaultdict(list)
+        trigrams = defaultdict(list)
+        for idx, folded in enumerate(self.folded):
+            for length in range(1, min(len(folded), MAX_PREFIX_LENGTH) + 1):
+                name_prefixes[folded[:length]].append(idx)
+            seen = set()
+            for word in folded.split()[1:]:
+                for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    seen.add(word[:length])
+            for prefix in seen:
+                word_prefixes[prefix].append(idx)
+            for gram in _trigrams(folded):
+                trigrams[gram].append(idx)
+
+        self._name_prefixes = {key: tuple(value) for key, value in name_prefixes.items()}
+        self._word_prefixes = {key: tuple(value) for key, value in word_prefixes.items()}
+        self._trigrams = {key: tuple(value) for key, value in trigrams.items()}
+        self._results_cache: Dict[tuple, List[str]] = {}
+
+    def search(self, query: str, limit: int = 25) -> List[str]:
+        q = fold(query)
+        cache_key = (q, limit)
+        cached = self._results_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        results = self._search(q, limit)
+        if len(self._results_cache) >= RESULTS_CACHE_SIZE:
+            self._results_cache.clear()
+        self._results_cache[cache_key] = results
+        return results
+
+    def _search(self, q: str, limit: int) -> List[str]:
+        if not q:
+            return self.names[:limit]
+
+        found = []
+        seen = set()
+
+        def take(candidates, predicate=None):
+            for idx in candidates:
+                if len(found) >= limit:
+                    return
+                if idx in seen or (predicate and not predicate(idx)):
+                    continue
+                seen.add(idx)
+                found.append(idx)
+
+        long_query = len(q) > MAX_PREFIX_LENGTH
+        # 1. Le nom commence par la saisie, 2. un mot du nom commence par la saisie.
+        take(self._name_prefixes.get(q[:MAX_PREFIX_LENGTH], ()), (lambda i: self.folded[i].startswith(q)) if long_query else None)
+        take(self._word_prefixes.get(q[:MAX_PREFIX_LENGTH], ()), (lambda i: any(w.startswith(q) for w in self.folded[i].split())) if long_query else None)
+
+        if len(found) < limit and len(q) < 3:
+            # 3. Sous-chaîne d'une saisie trop courte pour avoir des trigrammes ('og' -> 'OG Kush') : parcours direct.
+            take(range(len(self.folded)), lambda i: q in self.folded[i])
+
+        if len(found) < limit and len(q) >= 3:
+            # 3. Sous-chaîne : tous les trigrammes internes de la saisie sont présents ; on part de la liste la plus courte.
+            inner_grams = [q[i:i + 3] for i in range(len(q) - 2)]
+            postings = [self._trigrams.get(gram, ()) for gram in inner_grams]
+            take(min(postings, key=len), lambda i: q in self.folded[i])
+
+        if len(found) < limit and len(q) >= 3:
+            # 4. Faute de frappe légère, après tous les préfixes et sous-chaînes : au moins 60 % des trigrammes
+            # en commun dont un interne (les seuls trigrammes de début de mot ne suffisent pas : 'haz' != 'hash'),
+            # du plus ressemblant au moins ressemblant.
+            query_grams = _trigrams(q)
+            inner_grams = {q[i:i + 3] for i in range(len(q) - 2)}
+            hits = defaultdict(int)
+            inner_hits = set()
+            for gram in query_grams:
+                for idx in self._trigrams.get(gram, ()):
+                    hits[idx] += 1
+                    if gram in inner_grams:
+                        inner_hits.add(idx)
+            threshold = FUZZY_MIN_SCORE * len(query_grams)
+            take(sorted((idx for idx, shared in hits.items() if shared >= threshold and idx in inner_hits),
+                        key=lambda idx: (-hits[idx], idx)))
+
+        return [self.names[idx] for idx in found]
+
+
+EMPTY_SEARCH_INDEX = ProductSearchIndex(())
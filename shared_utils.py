@@ -1,5 +1,7 @@
 import os
+import queue
 import sqlite3
+import threading
 import discord
 import json
 from dotenv import load_dotenv
@@ -30,7 +32,10 @@ GITHUB_REPO_OWNER = os.getenv('GITHUB_REPO_OWNER')
 GITHUB_REPO_NAME = os.getenv('GITHUB_REPO_NAME')
 
 # --- Fichiers de données ---
-CACHE_FILE = os.path.join(BASE_DIR, 'scrape_cache.json')
+CACHE_FILE = os.path.join(BASE_DIR, 'scrape_cache.json') # Ancien format JSON, relu une fois pour migration
+CATALOG_SNAPSHOT_FILE = os.path.join(BASE_DIR, 'catalog_snapshot.bin')
+DESCRIPTION_CACHE_FILE = os.path.join(BASE_DIR, 'description_cache.json')
+FILE_URL_CACHE_FILE = os.path.join(BASE_DIR, 'file_url_cache.json')
 USER_LOG_FILE = os.path.join(BASE_DIR, "user_actions.log")
 DB_FILE = "/app/ratings.db"
 NITRO_CODES_FILE = os.path.join(BASE_DIR, "nitro_codes.txt")
@@ -227,30 +232,10 @@ async def log_user_action(interaction: discord.Interaction, action_description:
     except Exception as e: Logger.error(f"Impossible d'écrire dans le log : {e}")
 
 def initialize_database():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(''' CREATE TABLE IF NOT EXISTS ratings (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                        user_id INTEGER NOT NULL, 
-                        user_name TEXT NOT NULL, 
-                        product_name TEXT NOT NULL, 
-                        visual_score REAL, 
-                        smell_score REAL, 
-                        touch_score REAL, 
-                        taste_score REAL, 
-                        effects_score REAL, 
-                        rating_timestamp TEXT NOT NULL, 
-                        UNIQUE(user_id, product_name)) ''')
-    try:
-        cursor.execute("ALTER TABLE ratings ADD COLUMN comment TEXT")
-        Logger.info("Colonne 'comment' ajoutée à la base de données.")
-    except sqlite3.OperationalError:
-        # La colonne existe déjà, on ne fait rien.
-        pass
-
-    conn.commit()
-    conn.close()
-    Logger.success(f"Base de données '{DB_FILE}' initialisée et à jour.")
+    # Import local : db_migrations importe shared_utils.
+    from db_migrations import run_migrations
+    version = run_migrations(DB_FILE)
+    Logger.success(f"Base de données '{DB_FILE}' initialisée et à jour (schéma v{version}).")
 
 def filter_catalog_products(products: list) -> list:
     """
@@ -283,15 +268,264 @@ def create_styled_embed(title: str, description: str, color=discord.Color.blurpl
         embed.set_footer(text="LaFoncedalle")
     return embed
 
+def product_key(product_name: str) -> str:
+    """Clé normalisée d'un produit, stockée dans ratings.product_key : 'Amnesia Haze ' -> 'amnesia haze'."""
+    return (product_name or '').strip().lower()
+
+# Rang (même sémantique que RANK() OVER (ORDER BY nombre de notes DESC, moyenne DESC)), nombre de notes,
+# moyenne, note min et max d'un membre, lus dans user_stats et les histogrammes (voir db_migrations) :
+#  - membres ayant plus de notes : une ligne de user_rating_histogram par nombre de notes distinct ;
+#  - même nombre de notes, tranche de moyenne supérieure : au plus 1001 lignes de user_avg_histogram ;
+#  - ex æquo de la même tranche de 0,01 seulement, parcourus via idx_user_stats_rank.
+# Le coût ne dépend donc que du nombre de membres partageant le nombre de notes ET la tranche de moyenne.
+# La tranche CAST(avg_note * 100 AS INTEGER) doit rester celle de la migration 8.
+USER_STATS_QUERY = """
+    SELECT
+        1 + COALESCE((SELECT SUM(h.users) FROM user_rating_histogram h WHERE h.rating_count > s.rating_count), 0)
+          + COALESCE((SELECT SUM(b.users) FROM user_avg_histogram b
+                      WHERE b.rating_count = s.rating_count AND b.avg_bucket > CAST(s.avg_note * 100 AS INTEGER)), 0)
+          + (SELECT COUNT(*) FROM user_stats o
+             WHERE o.rating_count = s.rating_count AND o.avg_note > s.avg_note
+               AND o.avg_note < (CAST(s.avg_note * 100 AS INTEGER) + 2) / 100.0
+               AND CAST(o.avg_note * 100 AS INTEGER) = CAST(s.avg_note * 100 AS INTEGER)) AS user_rank,
+        s.rating_count, s.avg_note AS global_avg, s.min_note, s.max_note
+    FROM user_stats s
+    WHERE s.user_id = ?
+"""
+
+def rollup_start_day(days: int) -> str:
+    """
+    Premier jour (UTC, 'AAAA-MM-JJ') d'une fenêtre de `days` jours calendaires pour les tables *_daily_stats :
+    aujourd'hui et les `days - 1` jours précédents, chacun compté en entier.
+    """
+    return (datetime.utcnow() - timedelta(days=days - 1)).date().isoformat()
+
 def get_general_promos():
     """Retourne la liste des promos générales depuis la config."""
     promos = config_manager.get_config("general.general_promos", [])
     # Nettoie les éventuels '\n' ou chaînes vides
     return [p.strip() for p in promos if p.strip()]
 
+# --- Pool de connexions SQLite ---
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_CACHED_STATEMENTS = 256
+DB_MMAP_SIZE = 64 * 1024 * 1024
+
+class PooledConnection(sqlite3.Connection):
+    """Connexion du pool : `close()` la rend au pool au lieu de la fermer (les appelants n'ont rien à changer)."""
+    def close(self):
+        _db_pool.release(self)
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+class ConnectionPool:
+    """
+    Pool borné de connexions SQLite partagé par les threads du bot (asyncio.to_thread, executor)
+    et par les workers gunicorn. Les PRAGMAs ne sont appliqués qu'à l'ouverture de chaque connexion ;
+    le cache de requêtes préparées de sqlite3 survit donc d'un appel à l'autre. Au-delà de `size`
+    connexions libres, les connexions rendues sont réellement fermées.
+    """
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Après un fork (gunicorn), les connexions héritées appartiennent au processus parent : on repart de zéro.
+        self._pid = os.getpid()
+        self._idle = []
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.in_use = 0
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False,
+                               cached_statements=DB_CACHED_STATEMENTS, factory=PooledConnection)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE};")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused += 1
+            else:
+                self.created += 1
+            self.in_use += 1
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+        conn.row_factory = sqlite3.Row # Permet d'accéder aux colonnes par leur nom
+        conn._pool_pid = self._pid
+        return conn
+
+    def release(self, conn: PooledConnection):
+        if getattr(conn, '_pool_pid', None) is None:
+            return  # Déjà rendue (double close()).
+        if conn._pool_pid != os.getpid():
+            conn._pool_pid = None
+            return  # Connexion héritée d'un fork : on ne la touche pas.
+        conn._pool_pid = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # Une écriture non validée ne doit pas fuiter vers l'emprunteur suivant.
+            keep = True
+        except sqlite3.Error:
+            keep = False
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+            if keep and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.really_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "idle": len(self._idle), "in_use": self.in_use,
+                    "created": self.created, "reused": self.reused, "discarded": self.discarded}
+
+_db_pool = ConnectionPool(DB_FILE, DB_POOL_SIZE)
+
 def get_db_connection():
-    """Crée et retourne une connexion à la base de données avec le mode WAL activé."""
-    conn = sqlite3.connect(DB_FILE, timeout=10) # On augmente un peu le timeout par sécurité
-    conn.row_factory = sqlite3.Row # Permet d'accéder aux colonnes par leur nom
-    conn.execute("PRAGMA journal_mode=WAL;") # La ligne la plus importante !
-    return conn
\ No newline at end of file
+    """
+    Emprunte une connexion au pool (mode WAL, row_factory sqlite3.Row).
+    `conn.close()` la rend au pool ; une transaction non validée est annulée au passage.
+    """
+    return _db_pool.acquire()
+
+def get_db_pool_stats() -> dict:
+    return _db_pool.stats()
+
+# --- File d'écritures (group commit) ---
+DB_WRITE_BATCH = 64
+# Attente maximale dans la file, plus le timeout de connexion (10 s) si le lot a déjà démarré :
+# reste sous le timeout par défaut des workers gunicorn (30 s).
+DB_WRITE_TIMEOUT = 15
+
+class _WriteRequest:
+    __slots__ = ("statements", "done", "rowcounts", "error", "started", "cancelled")
+
+    def __init__(self, statements: list):
+        self.statements = statements  # [(sql, params), ...] appliqués ensemble ou pas du tout
+        self.done = threading.Event()
+        self.rowcounts = []
+        self.error = None
+        self.started = False    # Prise en charge par l'écrivain : elle sera validée ou échouera, mais plus annulée
+        self.cancelled = False  # Abandonnée par l'appelant avant sa prise en charge : l'écrivain l'ignore
+
+class WriteQueue:
+    """
+    Écrivain unique de l'API (lancée avec un seul worker gunicorn multi-threads, voir docker-compose.yml) :
+    toutes les routes de app.py qui écrivent passent par db_write / db_write_many, les lectures gardent le pool.
+    Les handlers déposent leurs écritures dans la file et attendent l'accusé. Le thread écrivain valide ce
+    qui s'est accumulé pendant le commit précédent (jusqu'à `max_batch` écritures) dans une seule transaction
+    BEGIN IMMEDIATE : un seul verrou d'écriture et un seul fsync par lot. Chaque écriture a son SAVEPOINT,
+    l'échec de l'une n'annule pas les autres. Seules les migrations, au démarrage, écrivent en dehors.
+    Le bot reste un second écrivain sur la base (suppression des notes par ConfirmResetNotesView, événements
+    catalogue consommés, via sa connexion aiosqlite) et peut encore faire attendre un lot.
+    """
+    def __init__(self, pool: ConnectionPool, max_batch: int = DB_WRITE_BATCH):
+        self.pool = pool
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _ensure_writer(self) -> queue.Queue:
+        # Le thread écrivain ne survit pas à un fork (gunicorn) : un par processus, démarré au premier appel.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="db-writer", daemon=True).start()
+            return self._queue
+
+    def execute(self, statements: list, timeout: float = DB_WRITE_TIMEOUT) -> list:
+        """
+        Exécute des écritures [(sql, params), ...] de façon atomique via l'écrivain et renvoie le nombre de lignes
+        modifiées par chacune (lève l'erreur SQLite éventuelle, rien n'est alors écrit).
+        Si l'écriture n'a pas été prise en charge après `timeout` secondes, elle est annulée (jamais écrite) et
+        TimeoutError est levée ; déjà prise en charge, on attend son issue, bornée par le timeout de connexion.
+        """
+        request = _WriteRequest(statements)
+        self._ensure_writer().put(request)
+        if not request.done.wait(timeout):
+            with self._state_lock:
+                if not request.started:
+                    request.cancelled = True
+            if request.cancelled:
+                raise TimeoutError(f"Écriture non prise en charge après {timeout}s, annulée.")
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.rowcounts
+
+    def _claim(self, batch: list) -> list:
+        with self._state_lock:
+            claimed = [request for request in batch if not request.cancelled]
+            for request in claimed:
+                request.started = True
+        return claimed
+
+    def _run(self, pending: queue.Queue):
+        while True:
+            batch = [pending.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list):
+        batch = self._claim(batch)
+        if not batch:
+            return
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            conn.execute("BEGIN IMMEDIATE")
+            for request in batch:
+                conn.execute("SAVEPOINT write_request")
+                try:
+                    request.rowcounts = [conn.execute(sql, params).rowcount for sql, params in request.statements]
+                    conn.execute("RELEASE write_request")
+                except sqlite3.Error as e:
+                    request.error = e
+                    request.rowcounts = []
+                    conn.execute("ROLLBACK TO write_request")
+                    conn.execute("RELEASE write_request")
+            conn.commit()
+        except Exception as e:
+            Logger.error(f"Lot de {len(batch)} écriture(s) annulé : {e}")
+            for request in batch:
+                if request.error is None:
+                    request.error = e
+        finally:
+            if conn is not None:
+                conn.close()
+            for request in batch:
+                request.done.set()
+
+_write_queue = WriteQueue(_db_pool)
+
+def db_write(sql: str, params: tuple = ()) -> int:
+    """Écriture groupée avec celles des autres requêtes de l'API ; renvoie le nombre de lignes modifiées."""
+    return _write_queue.execute([(sql, params)])[0]
+
+def db_write_many(statements: list) -> list:
+    """Plusieurs écritures [(sql, params), ...] validées ensemble (ou pas du tout) ; renvoie leurs nombres de lignes modifiées."""
+    return _write_queue.execute(statements)
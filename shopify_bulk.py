@@ -0,0 +1,214 @@
+# shopify_bulk.py
+# Ingestion du catalogue via les Bulk Operations Shopify : une seule requête asynchrone
+# côté Shopify, puis lecture en flux du fichier JSONL produit, ligne par ligne.
+
+import json
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+
+from shared_utils import Logger
+from shopify_client import ShopifyClient, ShopifyAPIError
+
+BULK_POLL_INTERVAL_SECONDS = 5
+BULK_TIMEOUT_SECONDS = 30 * 60
+BULK_BATCH_SIZE = 250
+BULK_CHUNK_SIZE = 64 * 1024
+
+# Les Bulk Operations ignorent la pagination : chaque connexion est renvoyée en entier,
+# aplatie en lignes JSONL reliées à leur produit par `__parentId`.
+BULK_PRODUCTS_QUERY = """
+{
+  products(query: "%s") {
+    edges {
+      node {
+        id
+        title
+        tags
+        handle
+        bodyHtml
+        status
+        publishedAt
+        updatedAt
+        featuredImage { url }
+        variants {
+          edges {
+            node { id price compareAtPrice inventoryPolicy inventoryQuantity }
+          }
+        }
+        collections {
+          edges {
+            node { id title }
+          }
+        }
+        metafields {
+          edges {
+            node { id namespace key value }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+BULK_RUN_MUTATION = """
+mutation runBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+query getBulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url partialDataUrl }
+  }
+}
+"""
+
+# Type de GID enfant -> connexion du nœud produit où le ranger.
+CHILD_CONNECTIONS = {
+    'ProductVariant': 'variants',
+    'Collection': 'collections',
+    'Metafield': 'metafields',
+}
+
+
+def _gid_type(gid: str) -> str:
+    """'gid://shopify/ProductVariant/123' -> 'ProductVariant'."""
+    parts = (gid or '').split('/')
+    return parts[3] if len(parts) > 3 else ''
+
+
+class BulkProductAssembler:
+    """
+    Reconstruit, à partir des lignes JSONL d'une Bulk Operation, des nœuds produit ayant
+    la même forme que ceux de la requête paginée (`variants.edges[].node`, etc.).
+    Shopify écrit chaque produit puis ses enfants à la suite : un produit est donc
+    complet dès que la ligne du produit suivant arrive, et seul le produit en cours
+    est gardé en mémoire.
+    """
+    def __init__(self):
+        self.current = None
+        self.orphans = 0
+
+    @staticmethod
+    def _new_product_node(obj: dict) -> dict:
+        featured = obj.pop('featuredImage', None) or {}
+        node = dict(obj)
+        node['images'] = {'edges': [{'node': {'url': featured['url']}}] if featured.get('url') else []}
+        for connection in CHILD_CONNECTIONS.values():
+            node[connection] = {'edges': []}
+        return node
+
+    def feed(self, obj: dict) -> Optional[dict]:
+        """Ajoute un objet JSONL ; renvoie le produit précédent s'il vient d'être terminé."""
+        parent_id = obj.pop('__parentId', None)
+        if parent_id is None:
+            finished, self.current = self.current, self._new_product_node(obj)
+            return finished
+        connection = CHILD_CONNECTIONS.get(_gid_type(obj.get('id')))
+        if connection and self.current is not None and self.current.get('id') == parent_id:
+            self.current[connection]['edges'].append({'node': obj})
+        else:
+            self.orphans += 1
+        return None
+
+    def finish(self) -> Optional[dict]:
+        finished, self.current = self.current, None
+        if self.orphans:
+            Logger.warning(f"{self.orphans} ligne(s) JSONL sans produit parent ignorée(s).")
+        return finished
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Découpe un flux d'octets en lignes sans jamais charger tout le document."""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line.decode('utf-8')
+    if buffer.strip():
+        yield buffer.decode('utf-8')
+
+
+async def iter_bulk_product_batches(lines: AsyncIterator[str], batch_size: int = BULK_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Générateur asynchrone : regroupe les produits reconstruits par lots de `batch_size`."""
+    assembler = BulkProductAssembler()
+    batch = []
+    async for line in lines:
+        product = assembler.feed(json.loads(line))
+        if product is not None:
+            batch.append(product)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    last = assembler.finish()
+    if last is not None:
+        batch.append(last)
+    if batch:
+        yield batch
+
+
+async def _iter_url_chunks(url: str) -> AsyncIterator[bytes]:
+    # Session dédiée : l'URL de résultat est signée et ne doit pas recevoir le jeton Shopify.
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=120)) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(BULK_CHUNK_SIZE):
+                yield chunk
+
+
+async def _iter_file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, BULK_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def run_bulk_query(client: ShopifyClient, query: str) -> Optional[str]:
+    """Lance une Bulk Operation, attend sa fin et renvoie l'URL du JSONL (None si aucun résultat)."""
+    data = await client.execute(BULK_RUN_MUTATION, {"query": query})
+    result = data.get('bulkOperationRunQuery') or {}
+    if result.get('userErrors'):
+        raise ShopifyAPIError(f"Bulk Operation refusée par Shopify : {result['userErrors']}")
+    operation_id = (result.get('bulkOperation') or {}).get('id')
+    Logger.info(f"Bulk Operation {operation_id} lancée, attente de la fin de l'export...")
+
+    deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(BULK_POLL_INTERVAL_SECONDS)
+        operation = (await client.execute(BULK_STATUS_QUERY, {"id": operation_id})).get('node') or {}
+        status = operation.get('status')
+        if status == 'COMPLETED':
+            Logger.info(f"Bulk Operation terminée ({operation.get('objectCount')} objets).")
+            return operation.get('url')
+        if status in ('FAILED', 'CANCELED', 'EXPIRED'):
+            raise ShopifyAPIError(f"Bulk Operation {status} (code : {operation.get('errorCode')}).")
+    raise ShopifyAPIError(f"Bulk Operation {operation_id} non terminée après {BULK_TIMEOUT_SECONDS}s.")
+
+
+async def iter_bulk_product_pages(client: Optional[ShopifyClient], search: str, source_file: Optional[str] = None) -> AsyncIterator[List[dict]]:
+    """
+    Générateur asynchrone au même contrat que `iter_product_pages` : des lots de nœuds produit.
+    `source_file` permet de rejouer un JSONL local (tests, diagnostic) sans appeler Shopify.
+    """
+    if source_file:
+        chunks = _iter_file_chunks(source_file)
+    else:
+        url = await run_bulk_query(client, BULK_PRODUCTS_QUERY % search.replace('"', '\\"'))
+        if not url:
+            return
+        chunks = _iter_url_chunks(url)
+    async for batch in iter_bulk_product_batches(_iter_lines(chunks)):
+        yield batch
+
@@ -0,0 +1,162 @@
+# shopify_client.py
+# Client GraphQL/REST Shopify asynchrone pour le processus du bot (aiohttp).
+
+import os
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+from shared_utils import Logger
+
+GRAPHQL_MAX_RETRIES = 5
+DEFAULT_TIMEOUT_SECONDS = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ShopifyAPIError(RuntimeError):
+    """Erreur renvoyée par l'API Shopify (HTTP ou GraphQL) après épuisement des essais."""
+
+
+class GraphQLThrottle:
+    """
+    Suit le seau de points de l'API GraphQL Shopify (`extensions.cost.throttleStatus`)
+    et attend juste ce qu'il faut avant la prochaine requête pour ne jamais être limité.
+    """
+    def __init__(self):
+        self.currently_available = None
+        self.restore_rate = None
+        self.last_requested_cost = 0
+
+    def update(self, extensions: dict):
+        cost = (extensions or {}).get('cost') or {}
+        status = cost.get('throttleStatus') or {}
+        if status.get('currentlyAvailable') is not None:
+            self.currently_available = float(status['currentlyAvailable'])
+        if status.get('restoreRate'):
+            self.restore_rate = float(status['restoreRate'])
+        if cost.get('requestedQueryCost') is not None:
+            self.last_requested_cost = float(cost['requestedQueryCost'])
+
+    def delay_for(self, upcoming_cost: Optional[float] = None) -> float:
+        """Secondes à attendre pour que le seau contienne assez de points pour la requête suivante."""
+        if self.currently_available is None or not self.restore_rate:
+            return 0.0
+        needed = upcoming_cost if upcoming_cost is not None else self.last_requested_cost
+        return max(0.0, (needed - self.currently_available) / self.restore_rate)
+
+    async def wait(self, upcoming_cost: Optional[float] = None):
+        delay = self.delay_for(upcoming_cost)
+        if delay > 0:
+            Logger.info(f"Quota GraphQL Shopify bas, pause de {delay:.1f}s avant la page suivante.")
+            await asyncio.sleep(delay)
+
+
+class ShopifyClient:
+    """
+    Client Shopify Admin partagé par le bot : une seule connexion keep-alive réutilisée
+    d'une requête à l'autre, un timeout par appel et des essais avec backoff exponentiel.
+    Contrairement à `shopify.ShopifyResource`, aucune session globale n'est activée :
+    plusieurs tâches peuvent l'utiliser sur la boucle sans se marcher dessus.
+    """
+    def __init__(self, shop_url: str, api_version: str, access_token: str,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS, max_retries: int = GRAPHQL_MAX_RETRIES):
+        shop = shop_url.strip().rstrip('/')
+        # Un schéma explicite est conservé (ex. serveur de test local en http://).
+        if not shop.startswith(("https://", "http://")):
+            shop = f"https://{shop}"
+        self.base_url = f"{shop}/admin/api/{api_version}"
+        self.access_token = access_token
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.throttle = GraphQLThrottle()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["ShopifyClient"]:
+        shop_url = os.getenv('SHOPIFY_SHOP_URL')
+        api_version = os.getenv('SHOPIFY_API_VERSION')
+        access_token = os.getenv('SHOPIFY_ADMIN_ACCESS_TOKEN')
+        if not all([shop_url, api_version, access_token]):
+            return None
+        return cls(shop_url, api_version, access_token)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Créée paresseusement pour être rattachée à la boucle qui l'utilise.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=1, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"X-Shopify-Access-Token": self.access_token, "Content-Type": "application/json"},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        """Envoie une requête HTTP en réessayant sur timeout, erreur réseau, 429 et 5xx."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        timeout = aiohttp.ClientTimeout(total=kwargs.pop('timeout', self.timeout))
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                async with self._get_session().request(method, url, timeout=timeout, **kwargs) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = response.headers.get('Retry-After')
+                        delay = float(retry_after) if retry_after else 2 ** attempt
+                        last_error = ShopifyAPIError(f"HTTP {response.status} sur {path}")
+                        Logger.warning(f"Shopify a répondu {response.status} (essai {attempt + 1}/{self.max_retries}), nouvel essai dans {delay:.1f}s.")
+                        await asyncio.sleep(delay)
+                        continue
+                    if response.status >= 400:
+                        raise ShopifyAPIError(f"HTTP {response.status} sur {path} : {await response.text()}")
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                delay = 2 ** attempt
+                Logger.warning(f"Erreur réseau Shopify ({type(e).__name__}, essai {attempt + 1}/{self.max_retries}), nouvel essai dans {delay}s.")
+                await asyncio.sleep(delay)
+        raise ShopifyAPIError(f"Shopify injoignable après {self.max_retries} essais : {last_error}")
+
+    async def execute(self, query: str, variables: Optional[dict] = None) -> dict:
+        """Exécute une requête GraphQL en respectant le quota et en réessayant si Shopify répond THROTTLED."""
+        for attempt in range(self.max_retries):
+            await self.throttle.wait()
+            result = await self._request('POST', 'graphql.json', json={"query": query, "variables": variables or {}})
+            self.throttle.update(result.get('extensions'))
+
+            errors = result.get('errors') or []
+            if any((err.get('extensions') or {}).get('code') == 'THROTTLED' for err in errors):
+                delay = self.throttle.delay_for() or 2 ** attempt
+                Logger.warning(f"Requête GraphQL limitée par Shopify (essai {attempt + 1}/{self.max_retries}), nouvel essai dans {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+            if errors and not result.get('data'):
+                raise ShopifyAPIError(f"Erreur GraphQL Shopify : {errors}")
+            if errors:
+                Logger.warning(f"Réponse GraphQL partielle : {errors}")
+            return result.get('data') or {}
+        raise ShopifyAPIError("Quota GraphQL Shopify toujours dépassé après plusieurs essais.")
+
+    async def rest_get(self, path: str, params: Optional[dict] = None) -> dict:
+        """GET sur l'API REST Admin (ex. `price_rules.json`)."""
+        return await self._request('GET', path, params=params)
+
+
+_client: Optional[ShopifyClient] = None
+
+def get_shopify_client() -> Optional[ShopifyClient]:
+    """Renvoie le client partagé du processus, ou None si les identifiants Shopify manquent."""
+    global _client
+    if _client is None:
+        _client = ShopifyClient.from_env()
+    return _client
+
+async def close_shopify_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None